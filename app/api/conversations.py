@@ -1,7 +1,8 @@
 """
 Conversation API endpoints
 """
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -15,12 +16,13 @@ from app.schemas.conversation import (
 from app.services.conversation_service import ConversationService
 
 router = APIRouter(prefix="/api/v1/conversations", tags=["conversations"])
-conversation_service = ConversationService()
+conversation_service = ConversationService()  # shared with the message endpoints
 
 
 @router.post("", response_model=ConversationDetailResponse, status_code=201)
-def create_conversation(
+async def create_conversation(
     conversation_data: ConversationCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
@@ -31,7 +33,13 @@ def create_conversation(
     - **mode**: Conversation mode ('open' or 'rag')
     - **document_ids**: List of document IDs for RAG mode (optional)
     """
-    conversation = conversation_service.create_conversation(db, conversation_data)
+    conversation = await conversation_service.acreate_conversation(db, conversation_data)
+    
+    # A long first exchange may already exceed the summary trigger
+    if await run_in_threadpool(conversation_service.needs_compaction, db, conversation.id):
+        background_tasks.add_task(
+            conversation_service.compact_in_background, db.get_bind(), conversation.id
+        )
     
     return ConversationDetailResponse(
         id=conversation.id,
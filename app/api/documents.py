@@ -1,17 +1,26 @@
 """
 Document API endpoints for RAG
 """
-from fastapi import APIRouter, Depends, HTTPException
+import codecs
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from app.database import get_db
-from app.schemas.document import DocumentCreate, DocumentResponse
+from app.schemas.document import (
+    DocumentCreate,
+    DocumentResponse,
+    DocumentUpdate,
+    DocumentUpdateResponse,
+    DocumentBulkCreate,
+    DocumentBulkResponse
+)
 from app.models import Document, Conversation
-from app.services.rag_service import RAGService
+from app.services.document_service import DocumentService, iter_archive_documents
 from app.utils.error_handler import DocumentNotFoundError, ConversationNotFoundError
 
 router = APIRouter(prefix="/api/v1/documents", tags=["documents"])
-rag_service = RAGService()
+document_service = DocumentService()
 
 
 @router.post("", response_model=DocumentResponse, status_code=201)
@@ -25,24 +34,135 @@ def create_document(
     - **title**: Document title
     - **content**: Document content
     """
-    # Chunk the document
-    chunks = rag_service.chunk_document(document_data.content)
-    
-    # Create document
-    document = Document(
-        title=document_data.title,
-        content=document_data.content,
-        chunks=chunks
+    document = document_service.create_document(db, document_data)
+    
+    return DocumentResponse(
+        id=document.id,
+        title=document.title,
+        created_at=document.created_at,
+        chunk_count=document.chunk_count,
+        duplicate_chunk_count=document.duplicate_chunk_count,
+        version=document.version
     )
-    db.add(document)
-    db.commit()
-    db.refresh(document)
+
+
+@router.post("/stream", response_model=DocumentResponse, status_code=201)
+async def upload_document_stream(
+    request: Request,
+    title: str = Query(..., min_length=1, max_length=255, description="Document title"),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a large document as a streamed UTF-8 request body
+    
+    The body (plain or chunked transfer encoding) is chunked and stored
+    while it arrives, so documents of any size use bounded memory.
+    
+    - **title**: Document title (query parameter)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    writer = await run_in_threadpool(document_service.open_stream, db, title)
+    
+    try:
+        async for data in request.stream():
+            text = decoder.decode(data)
+            if text:
+                await run_in_threadpool(writer.feed, text)
+        
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            await run_in_threadpool(writer.feed, tail)
+        document = await run_in_threadpool(writer.finish)
+    except BaseException:
+        await run_in_threadpool(writer.abort)
+        raise
+    
+    if not document.chunk_count:
+        await run_in_threadpool(writer.abort)
+        raise HTTPException(status_code=400, detail="Document content is empty")
     
     return DocumentResponse(
         id=document.id,
         title=document.title,
         created_at=document.created_at,
-        chunk_count=len(chunks) if chunks else 0
+        chunk_count=document.chunk_count,
+        duplicate_chunk_count=document.duplicate_chunk_count,
+        version=document.version
+    )
+
+
+@router.post("/bulk", response_model=DocumentBulkResponse, status_code=201)
+def create_documents_bulk(
+    bulk_data: DocumentBulkCreate,
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a batch of documents for RAG
+    
+    Documents are chunked and indexed in parallel worker processes and
+    stored in batched transactions. Each document gets its own status.
+    
+    - **documents**: List of documents with title and content
+    """
+    results = document_service.create_documents_bulk(
+        db, ((item.title, item.content) for item in bulk_data.documents)
+    )
+    return _bulk_response(results)
+
+
+@router.post("/bulk/archive", response_model=DocumentBulkResponse, status_code=201)
+def create_documents_from_archive(
+    archive: UploadFile = File(..., description="Zip or tar archive of text files"),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a zip or tar archive; every file becomes a document
+    
+    - **archive**: Archive file (multipart form field)
+    """
+    try:
+        results = document_service.create_documents_bulk(
+            db, iter_archive_documents(archive.file)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _bulk_response(results)
+
+
+@router.put("/{document_id}", response_model=DocumentUpdateResponse)
+def update_document(
+    document_id: int,
+    document_data: DocumentUpdate,
+    db: Session = Depends(get_db)
+):
+    """
+    Replace a document's content, re-indexing only the edited region
+    
+    - **document_id**: Document ID
+    - **content**: New document content
+    - **title**: New title (optional)
+    - **expected_version**: Reject with 409 unless the document is at this version (optional)
+    """
+    document, stats = document_service.update_document(db, document_id, document_data)
+    
+    return DocumentUpdateResponse(
+        id=document.id,
+        title=document.title,
+        created_at=document.created_at,
+        chunk_count=document.chunk_count,
+        duplicate_chunk_count=document.duplicate_chunk_count,
+        version=document.version,
+        **stats
+    )
+
+
+def _bulk_response(results) -> DocumentBulkResponse:
+    """Summarize per-document bulk ingestion statuses"""
+    created = sum(1 for result in results if result.status == "created")
+    return DocumentBulkResponse(
+        created=created,
+        failed=len(results) - created,
+        results=results
     )
 
 
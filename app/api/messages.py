@@ -1,21 +1,27 @@
 """
 Message API endpoints
 """
-from fastapi import APIRouter, Depends
+import json
+
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.schemas.message import MessageCreate, MessagePairResponse, MessageResponse
-from app.services.conversation_service import ConversationService
+from app.api.conversations import conversation_service
+from app.utils.error_handler import LLMAPIError
 
 router = APIRouter(prefix="/api/v1/conversations", tags=["messages"])
-conversation_service = ConversationService()
 
 
 @router.post("/{conversation_id}/messages", response_model=MessagePairResponse, status_code=201)
-def add_message(
+async def add_message(
     conversation_id: int,
     message_data: MessageCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
@@ -24,10 +30,78 @@ def add_message(
     - **conversation_id**: Conversation ID
     - **content**: Message content
     """
-    user_message, assistant_message = conversation_service.add_message(
+    user_message, assistant_message = await conversation_service.aadd_message(
+        db, conversation_id, message_data.content
+    )
+    
+    # Fold older turns into the rolling summary after the response is sent
+    if await run_in_threadpool(conversation_service.needs_compaction, db, conversation_id):
+        background_tasks.add_task(
+            conversation_service.compact_in_background, db.get_bind(), conversation_id
+        )
+    
+    return _message_pair(user_message, assistant_message)
+
+
+@router.post("/{conversation_id}/messages/stream", status_code=201)
+async def stream_message(
+    conversation_id: int,
+    message_data: MessageCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """
+    Add a new message and stream the LLM response as Server-Sent Events
+    
+    Emits a `token` event (`{"content": ...}`) per text delta, then one
+    `message` event with the stored message pair (as returned by the
+    non-streaming endpoint), or an `error` event if generation fails
+    midway. Errors before the first token are plain HTTP errors. If the
+    client disconnects, the upstream call is cancelled and nothing is
+    stored.
+    
+    - **conversation_id**: Conversation ID
+    - **content**: Message content
+    """
+    user_tokens, stream = await conversation_service.astream_message(
         db, conversation_id, message_data.content
     )
+    bind = db.get_bind()
     
+    async def events():
+        try:
+            async for delta in stream:
+                yield _sse("token", {"content": delta})
+            user_message, assistant_message = await conversation_service.astore_streamed(
+                bind, conversation_id, message_data.content, user_tokens, stream
+            )
+            if conversation_service.summary_enabled:
+                background_tasks.add_task(
+                    conversation_service.compact_in_background, bind, conversation_id
+                )
+            yield _sse("message", _message_pair(user_message, assistant_message).model_dump(mode="json"))
+        except LLMAPIError as e:
+            yield _sse("error", {"detail": e.detail})
+        finally:
+            # Also reached when the client disconnects and the response is cancelled
+            with anyio.CancelScope(shield=True):
+                await stream.aclose()
+    
+    return StreamingResponse(
+        events(),
+        status_code=201,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _message_pair(user_message, assistant_message) -> MessagePairResponse:
+    """Response body for a stored user message and its reply"""
     return MessagePairResponse(
         user_message=MessageResponse(
             id=user_message.id,
@@ -0,0 +1,89 @@
+"""
+Command-line tools for offline administration
+
+Usage:
+    python -m app.cli ingest PATH [PATH ...]
+
+PATH may be a text file, a directory (all files, recursively) or a zip /
+tar archive; every file becomes one document.
+"""
+import argparse
+import os
+import sys
+import tarfile
+import zipfile
+from typing import Iterator, List, Tuple
+
+from app.database import SessionLocal, init_db
+from app.services.document_service import (
+    DocumentService,
+    iter_archive_documents,
+    shutdown_process_pool
+)
+
+
+def iter_path_documents(paths: List[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Lazily read documents from files, directories and archives
+
+    Args:
+        paths: Filesystem paths
+
+    Yields:
+        (title, content) pairs
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                yield from iter_path_documents(
+                    sorted(os.path.join(root, name) for name in files)
+                )
+        elif zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
+            with open(path, "rb") as fileobj:
+                yield from iter_archive_documents(fileobj)
+        else:
+            with open(path, encoding="utf-8", errors="replace") as fileobj:
+                yield os.path.basename(path)[:255], fileobj.read()
+
+
+def ingest(paths: List[str]) -> int:
+    """
+    Bulk-load documents into the database
+
+    Returns:
+        Process exit code (1 if any document failed)
+    """
+    init_db()
+    db = SessionLocal()
+    try:
+        results = DocumentService().create_documents_bulk(db, iter_path_documents(paths))
+    finally:
+        db.close()
+        shutdown_process_pool()
+
+    failed = 0
+    for result in results:
+        if result.status == "created":
+            print(f"created  {result.id:>6}  {result.chunk_count:>6} chunks  {result.title}")
+        else:
+            failed += 1
+            print(f"failed                         {result.title}: {result.error}")
+    print(f"{len(results) - failed} created, {failed} failed")
+    return 1 if failed else 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="BOT GPT admin tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Bulk-load documents for RAG")
+    ingest_parser.add_argument("paths", nargs="+", help="Files, directories or archives")
+
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        return ingest(args.paths)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,7 @@
 Configuration management using Pydantic Settings
 """
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -13,8 +13,38 @@ class Settings(BaseSettings):
     
     # LLM API
     GROQ_API_KEY: str
+    GROQ_API_KEYS: List[str] = []  # several keys: one pooled backend each (default [GROQ_API_KEY])
+    LLM_PROVIDER: str = "groq"  # 'groq' or 'fake' (local stand-in, no API calls)
+    # Provider pool, overriding GROQ_API_KEYS/LLM_PROVIDER: a list of
+    # {"kind": "groq" | "openai" | "fake", "name", "api_key", "base_url", "model"}
+    LLM_BACKENDS: List[Dict[str, Any]] = []
+    LLM_EWMA_ALPHA: float = 0.3  # weight of the newest latency sample in routing
+    LLM_HEALTH_CHECK_SECONDS: float = 30.0  # ping backends this often (0 disables)
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 60.0
+    LLM_KEEPALIVE_CONNECTIONS: int = 20  # idle connections kept per OpenAI-compatible backend
+    FAKE_LLM_LATENCY_SECONDS: float = 0.5  # fake provider: time to first token
+    FAKE_LLM_TOKEN_SECONDS: float = 0.02  # fake provider: time per further token
     LLM_MODEL: str = "llama3-8b-8192"
     MAX_TOKENS: int = 4000
+    MODEL_CONTEXT_WINDOW: int = 8192  # LLM_MODEL's window (prompt + completion)
+    COMPLETION_TOKENS: int = 1000  # completion reserved per response
+    MIN_COMPLETION_TOKENS: int = 256  # smallest completion a squeezed request still gets
+    LLM_CACHE_MAX_BYTES: int = 16 * 1024 * 1024  # in-process response cache; 0 disables
+    LLM_CACHE_TTL_SECONDS: float = 3600.0  # 0 means entries never expire
+    LLM_CACHE_DIR: str = ""  # persistent response cache shared by workers ("" keeps it in process memory)
+    LLM_COALESCE_REQUESTS: bool = True  # identical concurrent requests share one provider call
+    LLM_MAX_RETRIES: int = 3  # attempts per request (rate limits and provider errors only)
+    LLM_RETRY_BASE_SECONDS: float = 1.0  # jittered exponential backoff base
+    LLM_RETRY_MAX_SECONDS: float = 20.0  # backoff cap; a longer Retry-After fails fast with 503
+    LLM_BREAKER_FAILURES: int = 5  # consecutive failures that open a backend's circuit
+    LLM_BREAKER_COOLDOWN_SECONDS: float = 30.0  # open circuit rejects calls this long, then probes
+    LLM_CONCURRENCY_INITIAL: int = 16  # starting limit on concurrent calls per backend (AIMD-adapted)
+    LLM_CONCURRENCY_MAX: int = 64
+    LLM_LATENCY_TARGET_SECONDS: float = 30.0  # slower calls shrink the concurrency limit
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 30.0  # longest wait for a concurrency slot before 503
+    LLM_RATE_LIMIT_RPM: int = 0  # provider requests per minute across all backends (0: no client-side limit)
+    LLM_RATE_LIMIT_TPM: int = 0  # provider tokens per minute, prompt estimates corrected by reported usage
+    LLM_RATE_QUEUE_TIMEOUT_SECONDS: float = 30.0  # longest wait for the rate budget before 503
     
     # Application
     APP_NAME: str = "BOT GPT"
@@ -22,13 +52,45 @@ class Settings(BaseSettings):
     DEBUG: bool = True
     
     # Context Management
-    MAX_CONTEXT_TOKENS: int = 4000
+    MAX_CONTEXT_TOKENS: int = 4000  # prompt cap: system prompt, retrieved context and history
+    TOKEN_BUDGET_POLICY: str = "fixed"  # 'fixed', 'proportional' or 'priority' (see app.utils.token_budget)
+    TOKEN_BUDGET_SHARES: Dict[str, float] = {"rag": 0.35, "history": 0.45, "completion": 0.2}
+    TOKEN_BUDGET_PRIORITY: List[str] = ["completion", "rag", "history"]  # most important first
+    TOKEN_BUDGET_RESERVE: int = 128  # held back for chat formatting and tokenizer differences
     SLIDING_WINDOW_SIZE: int = 10
+    TOKEN_COUNT_CACHE_MAX_BYTES: int = 8 * 1024 * 1024  # content-hash -> token count cache; 0 disables
+    TOKENIZER_THREADS: Optional[int] = None  # threads for batch token counting (None: one per CPU)
+    CONTEXT_SUMMARY_ENABLED: bool = False  # fold older turns into a rolling summary
+    SUMMARY_BACKEND: str = "llm"  # 'llm' (extractive if the API fails) or 'extractive'
+    SUMMARY_TRIGGER_TOKENS: int = 3000  # unsummarized history that triggers compaction
+    SUMMARY_KEEP_RECENT_TOKENS: int = 1000  # newest history kept verbatim when compacting
+    SUMMARY_MAX_TOKENS: int = 300
     
     # RAG Settings
     CHUNK_SIZE: int = 500
     CHUNK_OVERLAP: int = 50
     TOP_K_CHUNKS: int = 3
+    CHUNKING_MODE: str = "words"  # 'words' (CHUNK_SIZE words) or 'tokens' (sentence-aligned)
+    CHUNK_TOKENS: int = 256  # tokenizer tokens per chunk in 'tokens' mode
+    CHUNK_OVERLAP_TOKENS: int = 32
+    RAG_CONTEXT_TOKENS: int = 1500  # budget for retrieved chunks in the system prompt
+    DEDUP_SIMHASH_DISTANCE: int = 3  # max differing SimHash bits for near-duplicates; -1 disables
+    RETRIEVAL_MATRIX_CACHE_SIZE: int = 256  # documents kept as sparse matrices
+    RETRIEVAL_BACKEND: str = "keyword"  # 'keyword' (BM25) or 'vector' (embeddings)
+    RETRIEVAL_PRUNING: bool = True  # MaxScore top-k (same results as exhaustive BM25)
+    RETRIEVAL_SHARD_CHUNKS: int = 100000  # chunks per shard; smaller corpora are scored inline
+    RETRIEVAL_WORKERS: Optional[int] = None  # shard-search threads (None: executor default)
+    EMBEDDING_DIM: int = 256
+    ANN_NPROBE: int = 8  # IVF lists scanned per query
+    ANN_MIN_IVF_SIZE: int = 2048  # smaller corpora are searched exactly
+    RETRIEVAL_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # 0 disables the result cache
+    RETRIEVAL_CACHE_TTL_SECONDS: float = 600.0  # 0 means entries never expire
+    INDEX_DIR: str = ""  # directory of mmap-shared index files ("" keeps indexes in process memory)
+    
+    # Document Ingestion
+    INGEST_BATCH_CHUNKS: int = 256  # chunk rows written per batch
+    BULK_INGEST_WORKERS: Optional[int] = None  # process pool size (default: CPU count)
+    BULK_INGEST_COMMIT_SIZE: int = 100  # documents per transaction
     
     class Config:
         env_file = ".env"
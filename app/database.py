@@ -1,7 +1,7 @@
 """
 Database connection and session management
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
@@ -35,3 +35,34 @@ def init_db():
     Initialize database tables
     """
     Base.metadata.create_all(bind=engine)
+    migrate_db()
+    
+    # Data migrations need the models, which import this module
+    from app.migrations import compact_chunk_text, migrate_legacy_chunks
+    migrate_legacy_chunks()
+    compact_chunk_text()
+
+
+def migrate_db():
+    """
+    Add columns and indexes introduced after a table was first created
+
+    ``create_all`` only creates missing tables, so existing databases
+    (e.g. an older botgpt.db) get new nullable columns and indexes added
+    in place.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                ))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
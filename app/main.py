@@ -6,6 +6,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.database import init_db
 from app.api import conversations, messages, documents
+from app.services.document_service import shutdown_process_pool
+from app.services.llm_service import in_flight, provider_pool, rate_governor, response_cache
+from app.services.rag_service import retrieval_cache, dedup_stats, shutdown_retrieval_pool
+from app.utils.token_budget import budget_stats
+from app.utils.tokenizer import token_counter_stats
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -33,6 +38,15 @@ app.include_router(documents.router)
 def startup_event():
     """Initialize database on startup"""
     init_db()
+    provider_pool.start_health_checks(settings.LLM_HEALTH_CHECK_SECONDS)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Stop background worker pools"""
+    provider_pool.stop_health_checks()
+    shutdown_process_pool()
+    shutdown_retrieval_pool()
 
 
 @app.get("/")
@@ -49,3 +63,18 @@ def root():
 def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Process-wide cache, retrieval and LLM provider counters"""
+    return {
+        "retrieval_cache": retrieval_cache.stats(),
+        "retrieval_dedup": dict(dedup_stats),
+        "token_count_cache": token_counter_stats(),
+        "token_budget": dict(budget_stats),
+        "llm_response_cache": response_cache.stats(),
+        "llm_coalescing": in_flight.stats(),
+        "llm_provider": provider_pool.stats(),
+        "llm_rate_governor": rate_governor.stats()
+    }
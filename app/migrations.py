@@ -0,0 +1,109 @@
+"""
+Data migrations for databases created by older versions
+
+Run manually with ``python -m app.migrations``; ``init_db`` also runs them
+on startup.
+"""
+import json
+from sqlalchemy import func, inspect, select, text, update
+from app.database import Base, engine, SessionLocal, migrate_db
+
+
+def migrate_legacy_chunks() -> int:
+    """
+    Move chunks from the legacy ``documents.chunks`` JSON column into
+    the ``document_chunks`` table
+
+    Offsets are recovered by re-chunking the content when the current chunk
+    settings reproduce the stored chunks; otherwise they are left empty.
+    Migrated documents get their legacy column cleared, so the migration
+    is idempotent.
+
+    Returns:
+        Number of documents migrated
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("documents")}
+    if "chunks" not in columns:
+        return 0
+    
+    from app.models import Document
+    from app.services.rag_service import RAGService
+    
+    rag_service = RAGService()
+    migrated = 0
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            text("SELECT id, chunks FROM documents WHERE chunks IS NOT NULL")
+        ).fetchall()
+        
+        for document_id, raw_chunks in rows:
+            legacy = json.loads(raw_chunks) if isinstance(raw_chunks, str) else raw_chunks
+            document = db.get(Document, document_id)
+            
+            if legacy and not document.chunks:
+                chunks = rag_service.chunk_document(document.content)
+                if [c["text"] for c in chunks] != [c["text"] for c in legacy]:
+                    chunks = [{"index": c["index"], "text": c["text"]} for c in legacy]
+                
+                document.chunks = rag_service.build_chunk_rows(chunks)
+                document.chunk_count = len(chunks)
+                if document.term_index is None:
+                    document.term_index = rag_service.build_index(chunks)
+                if document.embeddings is None:
+                    document.embeddings = rag_service.embed_chunks(chunks)
+            
+            db.execute(
+                text("UPDATE documents SET chunks = NULL WHERE id = :id"),
+                {"id": document_id}
+            )
+            db.commit()
+            migrated += 1
+    finally:
+        db.close()
+    
+    return migrated
+
+
+def compact_chunk_text() -> int:
+    """
+    Replace stored chunk text by its offsets into the document content
+
+    Rows whose text equals the content slice at their offsets get an
+    empty ``text`` (see ``stored_chunk_text``); other rows are kept. On
+    SQLite the space is reused by new rows, or returned by ``VACUUM``.
+
+    Returns:
+        Number of chunk rows compacted
+    """
+    from app.models import Document, DocumentChunk
+    
+    content_slice = select(
+        func.substr(
+            Document.content,
+            DocumentChunk.start_offset + 1,
+            DocumentChunk.end_offset - DocumentChunk.start_offset
+        )
+    ).where(Document.id == DocumentChunk.document_id).scalar_subquery()
+    
+    with engine.begin() as connection:
+        result = connection.execute(
+            update(DocumentChunk)
+            .where(
+                DocumentChunk.start_offset.is_not(None),
+                DocumentChunk.end_offset.is_not(None),
+                DocumentChunk.text != "",
+                DocumentChunk.text == content_slice
+            )
+            .values(text="")
+        )
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    import app.models  # noqa: F401  (register tables)
+    
+    Base.metadata.create_all(bind=engine)
+    migrate_db()
+    print(f"Migrated {migrate_legacy_chunks()} documents")
+    print(f"Compacted {compact_chunk_text()} chunk rows")
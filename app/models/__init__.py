@@ -0,0 +1,10 @@
+"""
+Database models
+"""
+from app.models.user import User
+from app.models.conversation import Conversation, conversation_documents
+from app.models.message import Message
+from app.models.document import Document
+from app.models.document_chunk import DocumentChunk
+
+__all__ = ["User", "Conversation", "conversation_documents", "Message", "Document", "DocumentChunk"]
@@ -1,7 +1,7 @@
 """
 Conversation model
 """
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table
+from sqlalchemy import Boolean, Column, Integer, String, Text, DateTime, ForeignKey, Table
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -22,6 +22,9 @@ class Conversation(Base):
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     title = Column(String(255))
     mode = Column(String(20), default='open')  # 'open' or 'rag'
+    summary = Column(Text)  # rolling summary of the messages up to summary_through_id
+    summary_through_id = Column(Integer)  # newest message folded into the summary
+    cache_responses = Column(Boolean, default=True)  # serve repeated prompts from the response cache (NULL: yes)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -1,11 +1,12 @@
 """
 Document model for RAG
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, LargeBinary
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from app.database import Base
 from app.models.conversation import conversation_documents
+from app.models.types import CompactJSON
 
 
 class Document(Base):
@@ -13,9 +14,20 @@ class Document(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
-    content = Column(Text, nullable=False)
-    chunks = Column(JSON)  # Stores pre-processed chunks as JSON
+    # Large columns are deferred so the chat path never loads them unless needed
+    content = deferred(Column(Text, nullable=False))
+    chunk_count = Column(Integer, default=0)
+    duplicate_chunk_count = Column(Integer, default=0)  # near-duplicate chunks collapsed at ingestion
+    version = Column(Integer, default=1)  # bumped whenever content or chunks change
+    term_index = deferred(Column(CompactJSON))  # BM25 inverted index over chunks
+    embeddings = deferred(Column(LargeBinary))  # float32 chunk vectors, one row per chunk
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     conversations = relationship("Conversation", secondary=conversation_documents, back_populates="documents")
+    chunks = relationship(
+        "DocumentChunk",
+        back_populates="document",
+        cascade="all, delete-orphan",
+        order_by="DocumentChunk.chunk_index"
+    )
@@ -0,0 +1,25 @@
+"""
+Document chunk model for RAG
+"""
+from sqlalchemy import Column, Integer, BigInteger, Text, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import relationship
+from app.database import Base
+
+
+class DocumentChunk(Base):
+    __tablename__ = "document_chunks"
+    __table_args__ = (
+        UniqueConstraint('document_id', 'chunk_index', name='uq_document_chunks_document_index'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey('documents.id', ondelete='CASCADE'), nullable=False)
+    chunk_index = Column(Integer, nullable=False)  # Position within the document
+    start_offset = Column(Integer)  # Character offsets into Document.content
+    end_offset = Column(Integer)
+    token_count = Column(Integer)
+    simhash = Column(BigInteger)  # 64-bit SimHash, stored signed (see app.utils.simhash)
+    text = Column(Text, nullable=False, default="")  # '' when stored as offsets into Document.content
+    
+    # Relationships
+    document = relationship("Document", back_populates="chunks")
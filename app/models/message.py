@@ -1,7 +1,7 @@
 """
 Message model
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -9,12 +9,17 @@ from app.database import Base
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Covers the context-window scan (newest first, summing token counts)
+        Index('ix_messages_conversation_window', 'conversation_id', 'id', 'prompt_tokens'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
     role = Column(String(20), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     tokens_used = Column(Integer, default=0)
+    prompt_tokens = Column(Integer)  # Tokens of ``content`` when sent as context (NULL: not yet counted)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
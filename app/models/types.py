@@ -0,0 +1,52 @@
+"""
+Custom column types
+"""
+import json
+from array import array
+from sqlalchemy import JSON
+from sqlalchemy.types import TypeDecorator
+
+
+def _json_default(value):
+    """Serialize compact ``array`` buffers as lists"""
+    if isinstance(value, array):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_compact(value) -> "RawJSON":
+    """Serialize a value that may contain ``array`` buffers"""
+    return RawJSON(json.dumps(value, default=_json_default))
+
+
+class RawJSON(str):
+    """Already-serialized JSON text, stored as is by ``CompactJSON``"""
+
+
+class CompactJSON(TypeDecorator):
+    """
+    JSON column that also accepts ``array.array`` values
+
+    Large structures such as index postings can be built in compact
+    ``array`` buffers and are converted to lists one at a time while
+    serializing, instead of materializing every list up front.
+    """
+    
+    impl = JSON
+    cache_ok = True
+    
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            if isinstance(value, RawJSON):
+                return str(value)
+            return json.dumps(value, default=_json_default)
+        return process
+    
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None or not isinstance(value, (str, bytes)):
+                return value
+            return json.loads(value)
+        return process
@@ -12,6 +12,7 @@ class ConversationCreate(BaseModel):
     first_message: str = Field(..., min_length=1, max_length=10000)
     mode: str = Field(default="open", pattern="^(open|rag)$")
     document_ids: Optional[List[int]] = []
+    cache_responses: bool = True  # False: always ask the LLM, never reuse a cached response
 
 
 class ConversationResponse(BaseModel):
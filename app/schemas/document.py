@@ -12,12 +12,51 @@ class DocumentCreate(BaseModel):
     content: str = Field(..., min_length=1)
 
 
+class DocumentUpdate(BaseModel):
+    """Schema for replacing a document's content"""
+    content: str = Field(..., min_length=1)
+    title: Optional[str] = Field(None, min_length=1, max_length=255)
+    expected_version: Optional[int] = None  # reject the update if the document moved on
+
+
 class DocumentResponse(BaseModel):
     """Schema for document response"""
     id: int
     title: str
     created_at: datetime
     chunk_count: Optional[int] = 0
+    duplicate_chunk_count: Optional[int] = 0
+    version: Optional[int] = 1
     
     class Config:
         from_attributes = True
+
+
+class DocumentUpdateResponse(DocumentResponse):
+    """Schema for document update response"""
+    incremental: bool  # False when the document had to be fully re-chunked
+    chunks_rechunked: int
+    chunks_removed: int
+    chunks_reused: int
+
+
+class DocumentBulkCreate(BaseModel):
+    """Schema for creating many documents in one request"""
+    documents: List[DocumentCreate] = Field(..., min_length=1, max_length=10000)
+
+
+class DocumentBulkItemStatus(BaseModel):
+    """Per-document outcome of a bulk ingestion"""
+    title: str
+    status: str  # 'created' or 'failed'
+    id: Optional[int] = None
+    chunk_count: int = 0
+    duplicate_chunk_count: int = 0
+    error: Optional[str] = None
+
+
+class DocumentBulkResponse(BaseModel):
+    """Schema for bulk ingestion results"""
+    created: int
+    failed: int
+    results: List[DocumentBulkItemStatus]
@@ -1,13 +1,23 @@
 """
 Conversation Service - Business logic for conversation management
 """
-from typing import List, Optional
-from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session, selectinload
+from app.config import settings
 from app.models import Conversation, Message, User, Document
 from app.schemas.conversation import ConversationCreate
-from app.services.llm_service import LLMService
-from app.services.rag_service import RAGService
-from app.utils.error_handler import ConversationNotFoundError, DocumentNotFoundError
+from app.services.llm_service import LLMService, ResponseStream
+from app.services.rag_service import RAGService, context_token_count
+from app.utils.context_manager import count_tokens, count_tokens_batch
+from app.utils.error_handler import ConversationNotFoundError, DocumentNotFoundError, LLMAPIError
+from app.utils.summarizer import extractive_summary
+
+SUMMARY_BACKENDS = ("llm", "extractive")
+
+# Messages scanned by the first context-window query (see ``_load_history``)
+_HISTORY_SCAN_START = 128
 
 
 class ConversationService:
@@ -17,6 +27,13 @@ class ConversationService:
         """Initialize services"""
         self.llm_service = LLMService()
         self.rag_service = RAGService()
+        self.summary_enabled = settings.CONTEXT_SUMMARY_ENABLED
+        self.summary_backend = settings.SUMMARY_BACKEND
+        if self.summary_backend not in SUMMARY_BACKENDS:
+            raise ValueError(
+                f"Invalid SUMMARY_BACKEND: {self.summary_backend}. "
+                f"Must be one of {SUMMARY_BACKENDS}"
+            )
     
     def create_conversation(
         self,
@@ -26,6 +43,9 @@ class ConversationService:
         """
         Create new conversation with first message
         
+        Nothing is written until the response is generated, so a failed
+        LLM call leaves no conversation behind.
+        
         Args:
             db: Database session
             conversation_data: Conversation creation data
@@ -33,62 +53,116 @@ class ConversationService:
         Returns:
             Created conversation with messages
         """
+        documents, user_tokens, request = self._prepare_conversation(db, conversation_data)
+        assistant_content, tokens = self.llm_service.generate_response(**request)
+        return self._store_conversation(
+            db, conversation_data, documents, user_tokens, assistant_content, tokens
+        )
+    
+    async def acreate_conversation(
+        self,
+        db: Session,
+        conversation_data: ConversationCreate
+    ) -> Conversation:
+        """
+        Async ``create_conversation``: database work runs in the threadpool
+        and the LLM call is awaited, so the event loop never blocks and no
+        thread or transaction is held while the response is generated
+        """
+        documents, user_tokens, request = await run_in_threadpool(
+            self._prepare_conversation, db, conversation_data
+        )
+        assistant_content, tokens = await self.llm_service.agenerate_response(**request)
+        return await run_in_threadpool(
+            self._store_conversation,
+            db, conversation_data, documents, user_tokens, assistant_content, tokens
+        )
+    
+    def _prepare_conversation(
+        self,
+        db: Session,
+        conversation_data: ConversationCreate
+    ) -> tuple[List[Document], int, Dict]:
+        """
+        Read what the first response needs, ending the read transaction
+        
+        Returns:
+            Tuple of (documents to attach, first message tokens, LLM request)
+        """
+        # Attach documents if in RAG mode (unknown ids are ignored)
+        documents = []
+        if conversation_data.mode == "rag" and conversation_data.document_ids:
+            found = {
+                document.id: document
+                for document in db.query(Document).filter(
+                    Document.id.in_(conversation_data.document_ids)
+                )
+            }
+            documents = [found[doc_id] for doc_id in conversation_data.document_ids if doc_id in found]
+        
+        user_tokens = count_tokens(conversation_data.first_message)
+        request = self._build_request(
+            db, conversation_data.first_message, user_tokens, documents,
+            use_cache=conversation_data.cache_responses
+        )
+        db.commit()
+        return documents, user_tokens, request
+    
+    def _store_conversation(
+        self,
+        db: Session,
+        conversation_data: ConversationCreate,
+        documents: List[Document],
+        user_tokens: int,
+        assistant_content: str,
+        tokens: int
+    ) -> Conversation:
+        """Write the conversation and its first exchange in one transaction"""
         # Ensure user exists (create if not)
         user = db.query(User).filter(User.id == conversation_data.user_id).first()
         if not user:
             # Create default user for demo purposes
-            user = User(
+            db.add(User(
                 id=conversation_data.user_id,
                 username=f"user_{conversation_data.user_id}",
                 email=f"user_{conversation_data.user_id}@example.com"
-            )
-            db.add(user)
-            db.commit()
+            ))
         
         # Generate title from first message
         title = self.llm_service.generate_title(conversation_data.first_message)
         
-        # Create conversation
         conversation = Conversation(
             user_id=conversation_data.user_id,
             title=title,
-            mode=conversation_data.mode
+            mode=conversation_data.mode,
+            cache_responses=conversation_data.cache_responses
         )
+        conversation.documents.extend(documents)
         db.add(conversation)
         db.flush()  # Get conversation ID
         
-        # Attach documents if in RAG mode
-        if conversation_data.mode == "rag" and conversation_data.document_ids:
-            for doc_id in conversation_data.document_ids:
-                document = db.query(Document).filter(Document.id == doc_id).first()
-                if document:
-                    conversation.documents.append(document)
-        
-        # Create user message
-        user_message = Message(
-            conversation_id=conversation.id,
-            role="user",
-            content=conversation_data.first_message
-        )
-        db.add(user_message)
-        
-        # Generate assistant response
-        assistant_content, tokens = self._generate_response(
-            db, conversation, conversation_data.first_message
-        )
-        
-        # Create assistant message
-        assistant_message = Message(
-            conversation_id=conversation.id,
-            role="assistant",
-            content=assistant_content,
-            tokens_used=tokens
-        )
-        db.add(assistant_message)
-        
+        db.add_all([
+            Message(
+                conversation_id=conversation.id,
+                role="user",
+                content=conversation_data.first_message,
+                prompt_tokens=user_tokens
+            ),
+            Message(
+                conversation_id=conversation.id,
+                role="assistant",
+                content=assistant_content,
+                tokens_used=tokens,
+                prompt_tokens=count_tokens(assistant_content)
+            )
+        ])
         db.commit()
-        db.refresh(conversation)
         
+        # Loaded here, so callers on the event loop do not lazy-load
+        conversation = db.query(Conversation).options(selectinload(Conversation.messages)).filter(
+            Conversation.id == conversation.id
+        ).one()
+        self._detach(db, conversation)
         return conversation
     
     def add_message(
@@ -100,6 +174,9 @@ class ConversationService:
         """
         Add user message and generate assistant response
         
+        Both messages are written once the response is generated; no
+        transaction is held during the LLM call.
+        
         Args:
             db: Database session
             conversation_id: Conversation ID
@@ -108,96 +185,426 @@ class ConversationService:
         Returns:
             Tuple of (user_message, assistant_message)
         """
-        # Get conversation
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id
-        ).first()
+        user_tokens, request = self._prepare_message(db, conversation_id, content)
+        assistant_content, tokens = self.llm_service.generate_response(**request)
+        return self._store_exchange(
+            db, conversation_id, content, user_tokens, assistant_content, tokens
+        )
+    
+    async def aadd_message(
+        self,
+        db: Session,
+        conversation_id: int,
+        content: str
+    ) -> tuple[Message, Message]:
+        """
+        Async ``add_message``: database work runs in the threadpool and the
+        LLM call is awaited, so the event loop never blocks and no thread
+        or transaction is held while the response is generated
+        """
+        user_tokens, request = await run_in_threadpool(
+            self._prepare_message, db, conversation_id, content
+        )
+        assistant_content, tokens = await self.llm_service.agenerate_response(**request)
+        return await run_in_threadpool(
+            self._store_exchange,
+            db, conversation_id, content, user_tokens, assistant_content, tokens
+        )
+    
+    async def astream_message(
+        self,
+        db: Session,
+        conversation_id: int,
+        content: str
+    ) -> tuple[int, ResponseStream]:
+        """
+        Start a streamed response to a new user message
         
-        if not conversation:
-            raise ConversationNotFoundError(conversation_id)
+        Nothing is stored yet: iterate the stream, then pass it to
+        ``astore_streamed`` to write both messages.
+        
+        Args:
+            db: Database session
+            conversation_id: Conversation ID
+            content: User message content
+        
+        Returns:
+            Tuple of (user message tokens, response stream)
+        """
+        user_tokens, request = await run_in_threadpool(
+            self._prepare_message, db, conversation_id, content
+        )
+        return user_tokens, await self.llm_service.astream_response(**request)
+    
+    async def astore_streamed(
+        self,
+        bind,
+        conversation_id: int,
+        content: str,
+        user_tokens: int,
+        stream: ResponseStream
+    ) -> tuple[Message, Message]:
+        """
+        Store a user message and its fully streamed response
+        
+        Runs in a session of its own, as the request's session may already
+        be closed while a response streams.
+        
+        Args:
+            bind: Engine or connection of the request's session
+            conversation_id: Conversation ID
+            content: User message content
+            user_tokens: Tokens in the user message
+            stream: Exhausted response stream (a cached response is stored
+                with 0 tokens used)
+        
+        Returns:
+            Tuple of (user_message, assistant_message)
+        """
+        def store():
+            assistant_content, tokens = stream.finish()  # may write the persistent cache
+            with Session(bind=bind) as db:
+                return self._store_exchange(
+                    db, conversation_id, content, user_tokens, assistant_content, tokens
+                )
+        
+        return await run_in_threadpool(store)
+    
+    def _prepare_message(
+        self,
+        db: Session,
+        conversation_id: int,
+        content: str
+    ) -> tuple[int, Dict]:
+        """
+        Read what the response needs, ending the read transaction
         
-        # Create user message
+        Returns:
+            Tuple of (user message tokens, LLM request)
+        
+        Raises:
+            ConversationNotFoundError: If the conversation does not exist
+        """
+        conversation = self.get_conversation(db, conversation_id)
+        user_tokens = count_tokens(content)
+        documents = conversation.documents if conversation.mode == "rag" else []
+        request = self._build_request(
+            db, content, user_tokens, documents, conversation,
+            use_cache=conversation.cache_responses is not False
+        )
+        db.commit()  # keeps backfilled token counts
+        return user_tokens, request
+    
+    def _store_exchange(
+        self,
+        db: Session,
+        conversation_id: int,
+        content: str,
+        user_tokens: int,
+        assistant_content: str,
+        tokens: int
+    ) -> tuple[Message, Message]:
+        """Write a user message and its response in one transaction"""
         user_message = Message(
             conversation_id=conversation_id,
             role="user",
-            content=content
+            content=content,
+            prompt_tokens=user_tokens
         )
-        db.add(user_message)
-        
-        # Generate assistant response
-        assistant_content, tokens = self._generate_response(db, conversation, content)
-        
-        # Create assistant message
         assistant_message = Message(
             conversation_id=conversation_id,
             role="assistant",
             content=assistant_content,
-            tokens_used=tokens
+            tokens_used=tokens,
+            prompt_tokens=count_tokens(assistant_content)
         )
-        db.add(assistant_message)
-        
+        db.add_all([user_message, assistant_message])
         db.commit()
         db.refresh(user_message)
         db.refresh(assistant_message)
+        self._detach(db, user_message, assistant_message)
         
         return user_message, assistant_message
     
-    def _generate_response(
+    def _detach(self, db: Session, *instances):
+        """
+        End the session's transaction now, keeping ``instances`` loaded
+        
+        Otherwise the connection stays checked out until the request's
+        session closes, after the response is sent; under load, finished
+        requests would hold the pool while new ones wait for it.
+        """
+        for instance in instances:
+            db.expunge(instance)  # cascades to a conversation's messages
+        db.rollback()
+    
+    def _build_request(
         self,
         db: Session,
-        conversation: Conversation,
-        user_message: str
-    ) -> tuple[str, int]:
+        user_message: str,
+        user_tokens: int,
+        documents: List[Document],
+        conversation: Optional[Conversation] = None,
+        use_cache: bool = True
+    ) -> Dict:
         """
-        Generate LLM response based on conversation mode
+        Build the LLM request for a new user message
         
         Args:
             db: Database session
-            conversation: Conversation object
-            user_message: Current user message
+            user_message: Current user message (not stored yet)
+            user_tokens: Tokens in the user message
+            documents: Documents to retrieve context from (empty: open mode)
+            conversation: Conversation the message continues (None: a new one)
+            use_cache: Whether the response may come from the response cache
         
         Returns:
-            Tuple of (response_content, tokens_used)
+            ``LLMService.generate_response`` keyword arguments
         """
-        # Get conversation history
-        messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in conversation.messages
+        summary = conversation.summary if conversation is not None and self.summary_enabled else None
+        suffix = f"\n\nSummary of the earlier conversation:\n{summary}" if summary else ""
+        
+        # RAG mode: retrieve relevant chunks via the documents' indexes
+        relevant_chunks = []
+        if documents:
+            relevant_chunks = self.rag_service.retrieve_from_documents(db, user_message, documents)
+        
+        def build_system_prompt(chunks, rag_budget):
+            if relevant_chunks:
+                return self.rag_service.build_rag_prompt(user_message, chunks, rag_budget) + suffix
+            return "You are a helpful AI assistant." + suffix
+        
+        # Split the model window: the instructions first, then retrieved
+        # context, history and completion by the budget policy. History is
+        # read only up to the largest share it could get, then the split
+        # is settled on what was actually read.
+        budget = self.llm_service.budget
+        demands = {
+            "system": count_tokens(build_system_prompt([], 0)),
+            "rag": context_token_count(relevant_chunks),
+            "history": budget.window,
+            "completion": settings.COMPLETION_TOKENS
+        }
+        
+        # Recent history that can fit alongside the new message; with a
+        # rolling summary, only the turns it does not cover
+        messages = []
+        if conversation is not None:
+            messages = self._load_history(
+                db, conversation.id,
+                max_tokens=max(budget.allocate(demands)["history"] - user_tokens, 0),
+                after_id=conversation.summary_through_id if summary else None
+            )
+        messages.append({"role": "user", "content": user_message, "tokens": user_tokens})
+        demands["history"] = sum(message["tokens"] for message in messages)
+        allocation = budget.allocate(demands)
+        
+        packed = self.rag_service.pack_chunks(relevant_chunks, allocation["rag"])
+        return {
+            "messages": messages,
+            "system_prompt": build_system_prompt(packed, allocation["rag"]),
+            "allocation": allocation,
+            "rag_tokens": context_token_count(packed),
+            "use_cache": use_cache
+        }
+    
+    def _load_history(
+        self,
+        db: Session,
+        conversation_id: int,
+        max_tokens: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Load the newest messages whose stored token counts fit the budget
+        
+        A running sum of ``prompt_tokens`` from the newest message backwards
+        selects the window in SQL over the newest few messages (widened
+        until the budget is reached), so only the messages that fit are
+        loaded and the work does not grow with the conversation. Messages
+        stored before counts existed are counted once and backfilled.
+        
+        Args:
+            db: Database session
+            conversation_id: Conversation ID
+            max_tokens: Token budget (default MAX_CONTEXT_TOKENS)
+            after_id: Only consider messages newer than this one
+        
+        Returns:
+            Message dicts with 'role', 'content' and 'tokens', oldest first
+        """
+        if max_tokens is None:
+            max_tokens = settings.MAX_CONTEXT_TOKENS
+        
+        # Every message costs at least one token, so at most ``max_tokens``
+        # messages can fit; start with a small scan and widen it if needed
+        limit = min(_HISTORY_SCAN_START, max_tokens)
+        while True:
+            newest = select(Message.id, Message.prompt_tokens).where(
+                Message.conversation_id == conversation_id,
+                Message.id > (after_id or 0)
+            ).order_by(Message.id.desc()).limit(limit).subquery()
+            window = select(
+                newest.c.id,
+                func.sum(func.coalesce(newest.c.prompt_tokens, 0)).over(
+                    order_by=newest.c.id.desc()
+                ).label("running_tokens")
+            ).subquery()
+            rows = db.query(Message.id, Message.role, Message.content, Message.prompt_tokens).join(
+                window, window.c.id == Message.id
+            ).filter(
+                window.c.running_tokens <= max_tokens
+            ).order_by(Message.id).all()
+            if len(rows) < limit or limit >= max_tokens:
+                break
+            limit = min(limit * 8, max_tokens)
+        
+        history = [
+            {"role": row.role, "content": row.content, "tokens": tokens}
+            for row, tokens in zip(rows, self._message_tokens(db, rows))
         ]
         
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
-        
-        # Generate response based on mode
-        if conversation.mode == "rag" and conversation.documents:
-            # RAG mode: retrieve relevant chunks
-            all_chunks = []
-            for document in conversation.documents:
-                if document.chunks:
-                    all_chunks.extend(document.chunks)
-            
-            if all_chunks:
-                # Retrieve relevant chunks
-                relevant_chunks = self.rag_service.retrieve_relevant_chunks(
-                    user_message, all_chunks
-                )
-                
-                # Build RAG prompt
-                system_prompt = self.rag_service.build_rag_prompt(
-                    user_message, relevant_chunks
-                )
-            else:
-                system_prompt = "You are a helpful AI assistant."
-        else:
-            # Open mode: standard prompt
-            system_prompt = "You are a helpful AI assistant."
-        
-        # Generate response
-        response, tokens = self.llm_service.generate_response(
-            messages, system_prompt
+        # Backfilled counts were summed as 0 above: drop what no longer fits
+        total = sum(message["tokens"] for message in history)
+        start = 0
+        while total > max_tokens:
+            total -= history[start]["tokens"]
+            start += 1
+        return history[start:]
+    
+    def _message_tokens(self, db: Session, rows: List) -> List[int]:
+        """
+        Stored token counts of message rows, backfilling missing ones
+        
+        Args:
+            db: Database session
+            rows: Rows with 'id', 'content' and 'prompt_tokens'
+        
+        Returns:
+            Token count of each row, in order
+        """
+        uncounted = [row for row in rows if row.prompt_tokens is None]
+        backfill = [
+            {"id": row.id, "prompt_tokens": tokens}
+            for row, tokens in zip(uncounted, count_tokens_batch([row.content for row in uncounted]))
+        ] if uncounted else []
+        if backfill:
+            db.execute(update(Message), backfill)
+        counted = {item["id"]: item["prompt_tokens"] for item in backfill}
+        return [
+            row.prompt_tokens if row.prompt_tokens is not None else counted[row.id]
+            for row in rows
+        ]
+    
+    def needs_compaction(self, db: Session, conversation_id: int) -> bool:
+        """
+        Check whether a conversation's unsummarized history exceeds the trigger
+        
+        One aggregate over the messages after the summary; messages stored
+        before counts existed are estimated at four characters per token.
+        
+        Args:
+            db: Database session
+            conversation_id: Conversation ID
+        
+        Returns:
+            True if summarization is enabled and ``compact_history`` would fold turns
+        """
+        if not self.summary_enabled:
+            return False
+        through = select(func.coalesce(Conversation.summary_through_id, 0)).where(
+            Conversation.id == conversation_id
+        ).scalar_subquery()
+        pending = db.query(func.coalesce(func.sum(func.coalesce(
+            Message.prompt_tokens, func.length(Message.content) / 4
+        )), 0)).filter(
+            Message.conversation_id == conversation_id,
+            Message.id > through
+        ).scalar()
+        return pending > settings.SUMMARY_TRIGGER_TOKENS
+    
+    def compact_history(self, db: Session, conversation_id: int) -> bool:
+        """
+        Fold older turns into the conversation's rolling summary
+        
+        When the messages after the summary exceed SUMMARY_TRIGGER_TOKENS,
+        all but the newest SUMMARY_KEEP_RECENT_TOKENS of them are merged
+        into the summary, so later prompts carry the summary plus a bounded
+        number of recent turns. The update only applies if no other
+        compaction moved the summary meanwhile.
+        
+        Args:
+            db: Database session
+            conversation_id: Conversation ID
+        
+        Returns:
+            True if the summary was updated
+        """
+        conversation = self.get_conversation(db, conversation_id)
+        previous = conversation.summary
+        through = conversation.summary_through_id or 0
+        rows = db.query(Message.id, Message.role, Message.content, Message.prompt_tokens).filter(
+            Message.conversation_id == conversation_id,
+            Message.id > through
+        ).order_by(Message.id).all()
+        tokens = self._message_tokens(db, rows)
+        if sum(tokens) <= settings.SUMMARY_TRIGGER_TOKENS:
+            db.commit()  # keep backfilled counts
+            return False
+        
+        # The newest turns that fit stay verbatim; at least one is folded
+        keep_from = len(rows)
+        recent = 0
+        while keep_from > 1 and recent + tokens[keep_from - 1] <= settings.SUMMARY_KEEP_RECENT_TOKENS:
+            keep_from -= 1
+            recent += tokens[keep_from]
+        folded = rows[:keep_from]
+        
+        summary = self._summarize(
+            previous, [{"role": row.role, "content": row.content} for row in folded]
         )
+        result = db.execute(
+            update(Conversation).where(
+                Conversation.id == conversation_id,
+                func.coalesce(Conversation.summary_through_id, 0) == through
+            ).values(
+                summary=summary,
+                summary_through_id=folded[-1].id,
+                updated_at=Conversation.updated_at  # not a user-visible change
+            ).execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount == 1
+    
+    def compact_in_background(self, bind, conversation_id: int):
+        """
+        Run ``compact_history`` in a session of its own (e.g. as a response
+        background task, after the request's session is closed)
         
-        return response, tokens
+        Args:
+            bind: Engine or connection of the request's session
+            conversation_id: Conversation ID
+        """
+        with Session(bind=bind) as db:
+            try:
+                self.compact_history(db, conversation_id)
+            except ConversationNotFoundError:
+                pass  # deleted meanwhile
+    
+    def _summarize(self, previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+        """
+        Merge turns into a summary with the configured backend
+        
+        The LLM backend falls back to the extractive summarizer when the
+        API is unavailable.
+        """
+        if self.summary_backend == "llm":
+            try:
+                return self.llm_service.summarize(previous, messages, settings.SUMMARY_MAX_TOKENS)
+            except LLMAPIError:
+                pass
+        texts = ([previous] if previous else []) + [message["content"] for message in messages]
+        return extractive_summary(texts, settings.SUMMARY_MAX_TOKENS, count_tokens)
     
     def get_conversation(self, db: Session, conversation_id: int) -> Conversation:
         """Get conversation by ID"""
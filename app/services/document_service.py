@@ -0,0 +1,655 @@
+"""
+Document Service - Business logic for document ingestion
+"""
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Document, DocumentChunk
+from app.models.types import dumps_compact
+from app.schemas.document import DocumentCreate, DocumentUpdate, DocumentBulkItemStatus
+from app.services.rag_service import RAGService, chunk_row_text, stored_chunk_text
+from app.utils.context_manager import count_tokens_batch
+from app.utils.embeddings import vectors_to_bytes
+from app.utils.error_handler import DocumentNotFoundError, DocumentVersionConflictError
+from app.utils.inverted_index import IndexBuilder, patch_index
+from app.utils.simhash import ChunkDeduplicator, to_signed, from_signed
+
+
+# Text is fed to the chunker in blocks of this many characters on update
+_UPDATE_FEED_CHARS = 1 << 20
+
+_worker_rag_service: Optional[RAGService] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def prepare_document(content: str) -> Dict:
+    """
+    Chunk, deduplicate, tokenize, index and embed a document's content
+
+    CPU-bound and free of database access, so it can run in a worker
+    process; the result is picklable and the index is already serialized.
+
+    Args:
+        content: Document content
+
+    Returns:
+        Dict with 'chunks' (offsets, token counts and SimHashes; text only
+        for chunks without offsets), 'duplicate_chunk_count',
+        'term_index', 'embeddings' and 'index_file' (staged mapped index
+        file, or None)
+    """
+    global _worker_rag_service
+    if _worker_rag_service is None:
+        _worker_rag_service = RAGService()
+    rag_service = _worker_rag_service
+
+    deduplicator = rag_service.make_deduplicator()
+    chunks = list(deduplicator.filter(rag_service.iter_chunks([content])))
+    fill_token_counts(chunks)
+    index = rag_service.build_index(chunks)
+    embeddings = rag_service.embed_chunks(chunks)
+    index_file = rag_service.stage_index_file(index, chunks, embeddings) if chunks else None
+    for chunk in chunks:
+        # Stored as offsets: don't ship a second copy of the content back
+        if not stored_chunk_text(chunk):
+            del chunk["text"]
+    return {
+        "chunks": chunks,
+        "duplicate_chunk_count": deduplicator.collapsed,
+        "term_index": dumps_compact(index),
+        "embeddings": embeddings,
+        "index_file": index_file
+    }
+
+
+def fill_token_counts(chunks: List[Dict]):
+    """Set 'token_count' on chunks the chunker did not count, in one batch"""
+    uncounted = [chunk for chunk in chunks if "token_count" not in chunk]
+    if uncounted:
+        counts = count_tokens_batch([chunk["text"] for chunk in uncounted])
+        for chunk, tokens in zip(uncounted, counts):
+            chunk["token_count"] = tokens
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared ingestion process pool, creating it on first use"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=settings.BULK_INGEST_WORKERS)
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Stop the ingestion process pool (called on application shutdown)"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(cancel_futures=True)
+            _process_pool = None
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Length of the longest common prefix, compared block-wise"""
+    limit = min(len(a), len(b))
+    length, block = 0, 4096
+    while block:
+        while length + block <= limit and a[length:length + block] == b[length:length + block]:
+            length += block
+        block //= 8
+    while length < limit and a[length] == b[length]:
+        length += 1
+    return length
+
+
+def common_suffix_length(a: str, b: str, limit: int) -> int:
+    """Length of the longest common suffix, at most ``limit``"""
+    end_a, end_b = len(a), len(b)
+    length, block = 0, 4096
+    while block:
+        while (
+            length + block <= limit
+            and a[end_a - length - block:end_a - length] == b[end_b - length - block:end_b - length]
+        ):
+            length += block
+        block //= 8
+    while length < limit and a[end_a - length - 1] == b[end_b - length - 1]:
+        length += 1
+    return length
+
+
+def iter_archive_documents(fileobj: BinaryIO) -> Iterator[Tuple[str, str]]:
+    """
+    Lazily read the files of a zip or tar archive as documents
+
+    Each regular file becomes one document titled by its file name and
+    decoded as UTF-8 (invalid bytes are replaced).
+
+    Args:
+        fileobj: Seekable binary file containing the archive
+
+    Yields:
+        (title, content) pairs
+
+    Raises:
+        ValueError: If the file is neither a zip nor a tar archive
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    content = archive.read(info).decode("utf-8", errors="replace")
+                    yield os.path.basename(info.filename)[:255], content
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError:
+        raise ValueError("Archive must be a zip or tar file")
+    with archive:
+        for member in archive:
+            if member.isfile():
+                content = archive.extractfile(member).read().decode("utf-8", errors="replace")
+                yield os.path.basename(member.name)[:255], content
+
+
+class DocumentService:
+    """Service for document ingestion"""
+
+    def __init__(self):
+        """Initialize services"""
+        self.rag_service = RAGService()
+
+    def create_document(self, db: Session, document_data: DocumentCreate) -> Document:
+        """
+        Chunk, index and store a document sent in one piece
+
+        Args:
+            db: Database session
+            document_data: Document creation data
+
+        Returns:
+            Created document
+        """
+        prepared = prepare_document(document_data.content)
+        document = self._build_document(document_data.title, document_data.content, prepared)
+        try:
+            db.add(document)
+            db.commit()
+        except BaseException:
+            self.rag_service.publish_staged_index(prepared["index_file"], None)
+            raise
+        self.rag_service.publish_staged_index(prepared["index_file"], document.id)
+        db.refresh(document)
+
+        return document
+
+    def create_documents_bulk(
+        self,
+        db: Session,
+        documents: Iterable[Tuple[str, str]]
+    ) -> List[DocumentBulkItemStatus]:
+        """
+        Ingest many documents, preparing them in parallel worker processes
+
+        Chunking, token counting, indexing and embedding fan out to the
+        process pool; at most two batches are in flight so lazily read
+        sources (e.g. archives) are not loaded all at once. Prepared
+        documents are committed ``BULK_INGEST_COMMIT_SIZE`` at a time.
+
+        Args:
+            db: Database session
+            documents: (title, content) pairs
+
+        Returns:
+            Status for every input document, in input order
+        """
+        pool = get_process_pool()
+        commit_size = settings.BULK_INGEST_COMMIT_SIZE
+        max_in_flight = 2 * commit_size
+
+        results: List[DocumentBulkItemStatus] = []
+        in_flight = deque()
+        batch = []
+
+        def collect():
+            title, content, future = in_flight.popleft()
+            status = DocumentBulkItemStatus(title=title, status="created")
+            results.append(status)
+            try:
+                prepared = future.result()
+            except Exception as e:
+                status.status, status.error = "failed", str(e) or type(e).__name__
+                return
+            if not prepared["chunks"]:
+                status.status, status.error = "failed", "Document content is empty"
+                return
+            batch.append((status, title, content, prepared))
+            if len(batch) >= commit_size:
+                self._commit_batch(db, batch)
+
+        for title, content in documents:
+            in_flight.append((title, content, pool.submit(prepare_document, content)))
+            if len(in_flight) >= max_in_flight:
+                collect()
+        while in_flight:
+            collect()
+        self._commit_batch(db, batch)
+
+        return results
+
+    def _build_document(self, title: str, content: str, prepared: Dict) -> Document:
+        """Create an unsaved Document (with chunk rows) from prepared data"""
+        document = Document(
+            title=title,
+            content=content,
+            chunk_count=len(prepared["chunks"]),
+            duplicate_chunk_count=prepared["duplicate_chunk_count"],
+            term_index=prepared["term_index"],
+            embeddings=prepared["embeddings"]
+        )
+        document.chunks = self.rag_service.build_chunk_rows(prepared["chunks"])
+        return document
+
+    def _commit_batch(self, db: Session, batch: List[Tuple[DocumentBulkItemStatus, str, str, Dict]]):
+        """
+        Insert a batch of documents in one transaction and record their ids
+
+        Chunk rows go through a single executemany insert rather than
+        one ORM object per chunk.
+        """
+        if not batch:
+            return
+        try:
+            documents = [
+                Document(
+                    title=title,
+                    content=content,
+                    chunk_count=len(prepared["chunks"]),
+                    duplicate_chunk_count=prepared["duplicate_chunk_count"],
+                    term_index=prepared["term_index"],
+                    embeddings=prepared["embeddings"]
+                )
+                for _, title, content, prepared in batch
+            ]
+            db.add_all(documents)
+            db.flush()
+
+            chunk_rows = []
+            for (status, _, _, prepared), document in zip(batch, documents):
+                status.id = document.id
+                status.chunk_count = document.chunk_count
+                status.duplicate_chunk_count = document.duplicate_chunk_count
+                chunk_rows.extend(
+                    {
+                        "document_id": document.id,
+                        "chunk_index": chunk["index"],
+                        "start_offset": chunk.get("start"),
+                        "end_offset": chunk.get("end"),
+                        "token_count": chunk["token_count"],
+                        "simhash": to_signed(chunk["simhash"]),
+                        "text": stored_chunk_text(chunk)
+                    }
+                    for chunk in prepared["chunks"]
+                )
+            db.execute(insert(DocumentChunk), chunk_rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            for status, _, _, _ in batch:
+                status.id, status.chunk_count, status.duplicate_chunk_count = None, 0, 0
+                status.status, status.error = "failed", f"Database error: {e}"
+        for status, _, _, prepared in batch:
+            self.rag_service.publish_staged_index(prepared["index_file"], status.id)
+        db.expunge_all()
+        batch.clear()
+
+    def update_document(
+        self,
+        db: Session,
+        document_id: int,
+        document_data: DocumentUpdate
+    ) -> Tuple[Document, Dict]:
+        """
+        Replace a document's content, re-chunking only the edited region
+
+        The new content is diffed against the old (common prefix and
+        suffix). Chunking resumes one chunk before the edit and stops as
+        soon as it emits a chunk identical to a stored chunk after the edit;
+        from there on the stored chunks are kept with shifted offsets. The
+        inverted index and embeddings are patched for the replaced run
+        only. Everything is written in one transaction that also bumps
+        ``version``, so readers and caches see either the old or the new
+        document. Documents stored without offsets, index or embeddings
+        are re-chunked in full.
+
+        Args:
+            db: Database session
+            document_id: Document to update
+            document_data: New content (and optionally title)
+
+        Returns:
+            (updated document, stats dict with 'incremental',
+            'chunks_rechunked', 'chunks_removed' and 'chunks_reused')
+
+        Raises:
+            DocumentNotFoundError: If the document does not exist
+            DocumentVersionConflictError: If ``expected_version`` is stale or
+                another update commits first
+        """
+        document = db.get(Document, document_id)
+        if document is None:
+            raise DocumentNotFoundError(document_id)
+        version = document.version or 1
+        if document_data.expected_version is not None and document_data.expected_version != version:
+            raise DocumentVersionConflictError(document_id)
+
+        old_content, new_content = document.content, document_data.content
+        rows = db.query(
+            DocumentChunk.chunk_index,
+            DocumentChunk.start_offset,
+            DocumentChunk.end_offset,
+            DocumentChunk.text,
+            DocumentChunk.simhash
+        ).filter(DocumentChunk.document_id == document_id).order_by(DocumentChunk.chunk_index).all()
+        index, embeddings = document.term_index, document.embeddings
+        row_bytes = self.rag_service.embedder.dim * 4
+
+        incremental = bool(
+            rows
+            and all(row.start_offset is not None for row in rows)
+            and index and index["chunk_count"] == len(rows)
+            and embeddings and len(embeddings) == len(rows) * row_bytes
+        )
+        if incremental:
+            restart, resync, new_chunks, collapsed = self._rechunk_delta(old_content, new_content, rows)
+            # Collapsed chunks leave no rows: count the replaced run's by re-chunking the old content
+            duplicate_chunk_count = (
+                (document.duplicate_chunk_count or 0)
+                - self._count_collapsed(old_content, rows, restart, resync)
+                + collapsed
+            )
+            fill_token_counts(new_chunks)
+            texts = [chunk["text"] for chunk in new_chunks]
+            term_index = patch_index(index, restart, resync, texts)
+            embeddings = b"".join([
+                embeddings[:restart * row_bytes],
+                self.rag_service.embed_chunks(new_chunks) if new_chunks else b"",
+                embeddings[resync * row_bytes:]
+            ])
+        else:
+            prepared = prepare_document(new_content)
+            self.rag_service.publish_staged_index(prepared["index_file"], None)  # rebuilt below at the new version
+            restart, resync, new_chunks = 0, len(rows), prepared["chunks"]
+            term_index, embeddings = prepared["term_index"], prepared["embeddings"]
+            duplicate_chunk_count = prepared["duplicate_chunk_count"]
+
+        removed = resync - restart
+        shift = len(new_chunks) - removed
+        delta = len(new_content) - len(old_content)
+
+        # Optimistic lock: only one update can move the document past ``version``
+        result = db.execute(
+            update(Document)
+            .where(Document.id == document_id, func.coalesce(Document.version, 1) == version)
+            .values(
+                version=version + 1,
+                title=document_data.title or document.title,
+                content=new_content,
+                chunk_count=len(rows) + shift,
+                duplicate_chunk_count=duplicate_chunk_count,
+                term_index=term_index,
+                embeddings=embeddings
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            raise DocumentVersionConflictError(document_id)
+
+        db.execute(delete(DocumentChunk).where(
+            DocumentChunk.document_id == document_id,
+            DocumentChunk.chunk_index >= restart,
+            DocumentChunk.chunk_index < resync
+        ))
+        if resync < len(rows) and (shift or delta):
+            # Negate first so (document_id, chunk_index) stays unique mid-update
+            db.execute(
+                update(DocumentChunk)
+                .where(DocumentChunk.document_id == document_id, DocumentChunk.chunk_index >= resync)
+                .values(
+                    chunk_index=-(DocumentChunk.chunk_index + shift) - 1,
+                    start_offset=DocumentChunk.start_offset + delta,
+                    end_offset=DocumentChunk.end_offset + delta
+                )
+            )
+            db.execute(
+                update(DocumentChunk)
+                .where(DocumentChunk.document_id == document_id, DocumentChunk.chunk_index < 0)
+                .values(chunk_index=-DocumentChunk.chunk_index - 1)
+            )
+        if new_chunks:
+            db.execute(insert(DocumentChunk), [
+                {
+                    "document_id": document_id,
+                    "chunk_index": chunk["index"],
+                    "start_offset": chunk.get("start"),
+                    "end_offset": chunk.get("end"),
+                    "token_count": chunk["token_count"],
+                    "simhash": to_signed(chunk["simhash"]),
+                    "text": stored_chunk_text(chunk)
+                }
+                for chunk in new_chunks
+            ])
+        db.commit()
+        db.expire(document)
+        self.rag_service.invalidate_documents([document_id])
+        self.rag_service.publish_index(db, document_id)
+
+        return document, {
+            "incremental": incremental,
+            "chunks_rechunked": len(new_chunks),
+            "chunks_removed": removed,
+            "chunks_reused": len(rows) - removed
+        }
+
+    def _rechunk_delta(self, old_content: str, new_content: str, rows: List) -> Tuple[int, int, List[Dict], int]:
+        """
+        Re-chunk the region of a document affected by an edit
+
+        Args:
+            old_content: Stored content
+            new_content: Replacement content
+            rows: Stored chunk rows (index, offsets, text, simhash) in order
+
+        Returns:
+            (restart, resync, new_chunks, collapsed): stored chunks
+            ``restart:resync`` are replaced by ``new_chunks``; later ones are
+            unchanged apart from their offsets. ``collapsed`` near-duplicates
+            were dropped from ``new_chunks``
+        """
+        prefix = common_prefix_length(old_content, new_content)
+        suffix = common_suffix_length(
+            old_content, new_content, min(len(old_content), len(new_content)) - prefix
+        )
+        delta = len(new_content) - len(old_content)
+        edit_end = len(new_content) - suffix
+
+        # A chunk's end can depend on the sentence after it, so resume one
+        # chunk before the first chunk reaching the edit
+        first = bisect_left([row.end_offset for row in rows], prefix)
+        restart = max(0, min(first, len(rows) - 1) - 1)
+        emitted, deduplicator = self._resume_chunking(new_content, rows, restart)
+
+        # Stored chunks lying wholly in the unchanged suffix, by old start offset
+        tail = {
+            row.start_offset: position
+            for position, row in enumerate(rows)
+            if row.start_offset >= len(old_content) - suffix
+        }
+        new_chunks = []
+        for chunk in emitted:
+            position = tail.get(chunk["start"] - delta)
+            if (
+                chunk["start"] >= edit_end
+                and position is not None
+                and chunk_row_text(rows[position], old_content) == chunk["text"]
+            ):
+                # Identical chunk and identical text after it: the rest is unchanged
+                return restart, position, new_chunks, deduplicator.collapsed
+            new_chunks.extend(deduplicator.filter([chunk]))
+        return restart, len(rows), new_chunks, deduplicator.collapsed
+
+    def _count_collapsed(self, old_content: str, rows: List, restart: int, resync: int) -> int:
+        """Number of near-duplicates collapsed when stored chunks ``restart:resync`` were chunked"""
+        end = rows[resync].start_offset if resync < len(rows) else len(old_content)
+        emitted, deduplicator = self._resume_chunking(old_content, rows, restart)
+        for chunk in emitted:
+            if chunk["start"] >= end:
+                break
+            for _ in deduplicator.filter([chunk]):
+                pass
+        return deduplicator.collapsed
+
+    def _resume_chunking(self, content: str, rows: List, restart: int) -> Tuple[Iterator[Dict], ChunkDeduplicator]:
+        """
+        Chunk ``content`` from stored chunk ``restart`` on, in bounded blocks
+
+        Returns:
+            (chunks, deduplicator): the emitted chunks, not yet deduplicated,
+            and a deduplicator seeded with the stored chunks before ``restart``
+        """
+        offset = rows[restart].start_offset
+        chunker = self.rag_service.make_chunker()
+        chunker.resume(offset, restart, rows[restart - 1].end_offset if restart else None)
+        deduplicator = self.rag_service.make_deduplicator(start_index=restart)
+        deduplicator.seed(from_signed(row.simhash) for row in rows[:restart] if row.simhash is not None)
+
+        def emitted():
+            for start in range(offset, len(content), _UPDATE_FEED_CHARS):
+                yield from chunker.feed(content[start:start + _UPDATE_FEED_CHARS])
+            yield from chunker.close()
+
+        return emitted(), deduplicator
+
+    def open_stream(self, db: Session, title: str) -> "DocumentStreamWriter":
+        """
+        Start ingesting a document whose content arrives incrementally
+
+        Args:
+            db: Database session
+            title: Document title
+
+        Returns:
+            Writer to feed decoded text pieces into
+        """
+        return DocumentStreamWriter(db, self.rag_service, title)
+
+
+class DocumentStreamWriter:
+    """
+    Incrementally chunk, index and store a streamed document
+
+    Chunks are emitted as text arrives and written in batches, and the
+    content is spooled to a temporary file and stored in one write by
+    ``finish``, so while the body arrives memory stays bounded by the
+    batch sizes rather than the document size (the inverted index and
+    vectors still grow with the number of chunks). The document keeps
+    ``chunk_count = 0``, which hides it from retrieval, until ``finish``.
+    """
+
+    def __init__(self, db: Session, rag_service: RAGService, title: str):
+        self.db = db
+        self.rag_service = rag_service
+        self.chunker = rag_service.make_chunker()
+        self.deduplicator = rag_service.make_deduplicator()
+        self.index_builder = IndexBuilder()
+        self.vectors = []
+        self.pending_chunks = []
+        self.content_file = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+        self.chunk_count = 0
+
+        document = Document(title=title, content="", chunk_count=0)
+        db.add(document)
+        db.commit()
+        self.document_id = document.id
+
+    def feed(self, text: str):
+        """
+        Add the next piece of document text
+
+        Args:
+            text: Decoded text, in document order
+        """
+        self.content_file.write(text)
+
+        for chunk in self.deduplicator.filter(self.chunker.feed(text)):
+            self.pending_chunks.append(chunk)
+            if len(self.pending_chunks) >= settings.INGEST_BATCH_CHUNKS:
+                self._flush()
+
+    def finish(self) -> Document:
+        """
+        Flush the remaining chunks and publish the document
+
+        Returns:
+            The completed document
+        """
+        self.pending_chunks.extend(self.deduplicator.filter(self.chunker.close()))
+        self._flush()
+
+        self.content_file.seek(0)
+        document = self.db.get(Document, self.document_id)
+        document.content = self.content_file.read()
+        self.content_file.close()
+        document.chunk_count = self.chunk_count
+        document.duplicate_chunk_count = self.deduplicator.collapsed
+        document.term_index = self.index_builder.build()
+        document.embeddings = b"".join(self.vectors)
+        self.db.commit()
+        if self.chunk_count:
+            self.rag_service.publish_index(self.db, self.document_id)
+        self.db.refresh(document)
+        return document
+
+    def abort(self):
+        """Discard a partially written document"""
+        self.content_file.close()
+        self.db.rollback()
+        document = self.db.get(Document, self.document_id)
+        if document is not None:
+            self.db.delete(document)
+            self.db.commit()
+
+    def _flush(self):
+        """Write pending chunk rows, then release them"""
+        if self.pending_chunks:
+            rows = self.rag_service.build_chunk_rows(self.pending_chunks)
+            for row in rows:
+                row.document_id = self.document_id
+            self.db.add_all(rows)
+
+            for chunk in self.pending_chunks:
+                self.index_builder.add(chunk["text"])
+            self.vectors.append(vectors_to_bytes(
+                self.rag_service.embedder.embed([chunk["text"] for chunk in self.pending_chunks])
+            ))
+            self.chunk_count += len(self.pending_chunks)
+            self.pending_chunks = []
+
+        # Commit releases the write lock between batches and the flushed
+        # rows from the session
+        self.db.commit()
+        self.db.expunge_all()
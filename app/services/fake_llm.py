@@ -0,0 +1,190 @@
+"""
+Local stand-in for the LLM provider (offline development and load tests)
+
+Mimics the part of the Groq client ``LLMService`` uses,
+``client.chat.completions.create(...)`` (streamed or not), answering
+after a fixed latency plus a fixed time per token, without any network
+access. ``stand_in_app`` serves the same answers over HTTP as an
+OpenAI-compatible endpoint:
+
+    uvicorn app.services.fake_llm:stand_in_app --port 8001
+"""
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.config import settings
+
+
+def fake_completion(messages: List[Dict[str, str]], max_tokens: int) -> SimpleNamespace:
+    """
+    Build a completion shaped like the provider's response
+
+    The reply echoes the last user message; token usage is counted in
+    words.
+    """
+    last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    words = f"You said: {last}".split()[:max_tokens]
+    prompt_tokens = sum(len(m["content"].split()) for m in messages)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=" ".join(words)))],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(words),
+            total_tokens=prompt_tokens + len(words)
+        )
+    )
+
+
+def fake_chunks(completion: SimpleNamespace) -> List[SimpleNamespace]:
+    """
+    Split a completion into stream chunks shaped like the provider's
+
+    One chunk per word, then a final chunk without choices carrying the
+    usage (where Groq reports it, under ``x_groq``).
+    """
+    words = completion.choices[0].message.content.split(" ")
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word if i == 0 else " " + word))])
+        for i, word in enumerate(words)
+    ]
+    chunks.append(SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=completion.usage)))
+    return chunks
+
+
+class FakeLLMClient:
+    """Blocking fake client: each call sleeps for its latency and tokens"""
+
+    def __init__(self, latency: float = 0.0, token_interval: float = 0.0):
+        """
+        Args:
+            latency: Seconds before the first token
+            token_interval: Seconds per further token
+        """
+        self.latency = latency
+        self.token_interval = token_interval
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0  # most calls waiting at once
+        self.closed_streams = 0  # streams the caller closed before their end
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _duration(self, completion: SimpleNamespace) -> float:
+        """Seconds a whole (non-streamed) completion takes"""
+        return self.latency + self.token_interval * max(completion.usage.completion_tokens - 1, 0)
+
+    def create(self, model: str, messages: List[Dict[str, str]], max_tokens: int, **kwargs) -> SimpleNamespace:
+        """Return a completion once it is fully generated"""
+        completion = fake_completion(messages, max_tokens)
+        self._enter()
+        try:
+            time.sleep(self._duration(completion))
+        finally:
+            self._exit()
+        return completion
+
+
+class AsyncFakeStream:
+    """Async stream of fake chunks; ``close`` stops it like dropping the connection"""
+
+    def __init__(self, client: "AsyncFakeLLMClient", chunks: List[SimpleNamespace]):
+        self.client = client
+        self.chunks = chunks
+        self.finished = False
+        self._iterator = None
+
+    def __aiter__(self):
+        self._iterator = self._iterate()
+        return self._iterator
+
+    async def _iterate(self):
+        self.client._enter()
+        try:
+            await asyncio.sleep(self.client.latency)
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    await asyncio.sleep(self.client.token_interval)
+                yield chunk
+            self.finished = True
+        finally:
+            self.client._exit()
+
+    async def close(self):
+        """Stop generating (counted when the stream had not finished)"""
+        if not self.finished:
+            self.finished = True
+            self.client.closed_streams += 1
+        if self._iterator is not None:
+            await self._iterator.aclose()
+
+
+class AsyncFakeLLMClient(FakeLLMClient):
+    """Async fake client: waits without blocking the event loop"""
+
+    async def create(self, model: str, messages: List[Dict[str, str]], max_tokens: int, stream: bool = False, **kwargs):
+        """Return a completion once generated, or (``stream=True``) a chunk stream"""
+        completion = fake_completion(messages, max_tokens)
+        if stream:
+            return AsyncFakeStream(self, fake_chunks(completion))
+        self._enter()
+        try:
+            await asyncio.sleep(self._duration(completion))
+        finally:
+            self._exit()
+        return completion
+
+
+def _plain(value):
+    """SimpleNamespace tree back to JSON-ready values"""
+    if isinstance(value, SimpleNamespace):
+        return {key: _plain(item) for key, item in vars(value).items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+stand_in_app = FastAPI(title="Fake LLM provider")
+_stand_in_client = AsyncFakeLLMClient(settings.FAKE_LLM_LATENCY_SECONDS, settings.FAKE_LLM_TOKEN_SECONDS)
+
+
+@stand_in_app.post("/v1/chat/completions")
+async def stand_in_completions(payload: dict):
+    """OpenAI-style chat completion (``stream: true`` for server-sent events)"""
+    messages, max_tokens = payload["messages"], payload.get("max_tokens") or 1024
+    if not payload.get("stream"):
+        completion = await _stand_in_client.create(payload.get("model", "fake"), messages, max_tokens)
+        return _plain(completion)
+    stream = await _stand_in_client.create(payload.get("model", "fake"), messages, max_tokens, stream=True)
+
+    async def events():
+        async for chunk in stream:
+            chunk = _plain(chunk)
+            if "x_groq" in chunk:
+                chunk["usage"] = chunk.pop("x_groq")["usage"]  # where OpenAI-style servers report it
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@stand_in_app.get("/v1/models")
+async def stand_in_models():
+    """Model list (used as the health check)"""
+    return {"object": "list", "data": [{"id": "fake", "object": "model"}]}
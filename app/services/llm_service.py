@@ -1,72 +1,560 @@
 """
-LLM Service - Integration with Groq API
+LLM Service - Integration with Groq and OpenAI-compatible APIs
 """
+import asyncio
 import time
-from typing import List, Dict, Optional
-from groq import Groq
+from typing import Callable, List, Dict, Optional
+from fastapi.concurrency import run_in_threadpool
 from app.config import settings
+from app.services.provider_pool import Backend, provider_pool_from_settings
 from app.utils.context_manager import count_tokens, build_context_window
-from app.utils.error_handler import LLMAPIError
+from app.utils.error_handler import LLMAPIError, PromptTooLargeError, ProviderUnavailableError
+from app.utils.rate_governor import INTERACTIVE, SUMMARY, RateGovernor
+from app.utils.resilience import RATE_LIMITED, REJECTED, backoff_delay, classify_error, retry_after_seconds
+from app.utils.response_cache import FileResponseStore, ResponseCache, response_cache_key
+from app.utils.single_flight import SingleFlight
+from app.utils.token_budget import record_spend, token_budget_from_settings
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation. Merge the new turns "
+    "into the current summary. Keep facts, decisions, names and open "
+    "questions; drop pleasantries. Reply with the updated summary only."
+)
+
+
+# Process-wide so every service instance shares the provider clients (and
+# their keep-alive connections), cached responses, calls in flight and
+# the rate budgets
+response_cache = ResponseCache(
+    max_bytes=settings.LLM_CACHE_MAX_BYTES,
+    ttl_seconds=settings.LLM_CACHE_TTL_SECONDS or None,
+    store=FileResponseStore(
+        settings.LLM_CACHE_DIR, settings.LLM_CACHE_TTL_SECONDS or None
+    ) if settings.LLM_CACHE_DIR else None
+)
+in_flight = SingleFlight()
+provider_pool = provider_pool_from_settings()
+rate_governor = RateGovernor(
+    requests_per_minute=settings.LLM_RATE_LIMIT_RPM,
+    tokens_per_minute=settings.LLM_RATE_LIMIT_TPM,
+    queue_timeout=settings.LLM_RATE_QUEUE_TIMEOUT_SECONDS
+)
+
+
+def _chunk_usage(chunk):
+    """Token usage reported by a stream chunk (Groq sends it last, under ``x_groq``), if any"""
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        x_groq = getattr(chunk, "x_groq", None)
+        usage = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    if isinstance(usage, dict):
+        return usage.get("completion_tokens"), usage.get("total_tokens")
+    if usage is not None:
+        return usage.completion_tokens, usage.total_tokens
+    return None
+
+
+class ResponseStream:
+    """
+    A streamed completion: iterate it for text deltas, then ``finish`` it
+    for the full text and token usage
+    
+    ``aclose`` stops the upstream call (closing its connection), e.g. when
+    the client that asked for the response has gone. A stream over a
+    cached response yields the whole text at once.
+    """
+    
+    def __init__(
+        self,
+        upstream,
+        spend: Dict[str, int],
+        cached: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        cache_key: Optional[str] = None,
+        on_done: Optional[Callable[[Optional[BaseException], Optional[float]], None]] = None,
+        on_usage: Optional[Callable[[int], None]] = None
+    ):
+        """
+        Args:
+            upstream: Provider chunk stream (None for a cached response)
+            spend: Prompt tokens per component (see ``LLMService._prepare_request``)
+            cached: Cached response text to replay instead of ``upstream``
+            cache: Response cache to store the completed response in
+            cache_key: Key of the response in ``cache`` (None: not cached)
+            on_done: Called once when the upstream call ends, with the
+                error that ended it (None: completed or closed) and the
+                seconds to the first chunk (None: closed before the end)
+            on_usage: Called by ``finish`` with the tokens used
+        """
+        self.upstream = upstream
+        self.spend = spend
+        self.cached = cached
+        self.cache = cache
+        self.cache_key = cache_key
+        self.on_done = on_done
+        self.on_usage = on_usage
+        self.parts: List[str] = []
+        self.usage = None
+        self.completed = False
+        self.started = time.perf_counter()
+        self.first_chunk_seconds = None
+    
+    async def __aiter__(self):
+        if self.cached is not None:
+            self.parts.append(self.cached)
+            self.completed = True
+            yield self.cached
+            return
+        try:
+            async for chunk in self.upstream:
+                if self.first_chunk_seconds is None:
+                    self.first_chunk_seconds = time.perf_counter() - self.started
+                self.usage = _chunk_usage(chunk) or self.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    self.parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self._settle(e, None)
+            raise LLMAPIError(f"LLM stream failed: {str(e)}")
+        self.completed = True
+        self._settle(None, self.first_chunk_seconds or time.perf_counter() - self.started)
+    
+    def _settle(self, error: Optional[BaseException], latency: Optional[float]):
+        if self.on_done is not None:
+            on_done, self.on_done = self.on_done, None
+            on_done(error, latency)
+    
+    async def aclose(self):
+        """Stop the upstream call"""
+        self._settle(None, None)
+        if self.upstream is not None:
+            await self.upstream.close()
+    
+    def finish(self) -> tuple[str, int]:
+        """
+        Full response text and tokens used, recording the spend and
+        caching a completed response (may write to the persistent cache
+        tier, so call it off the event loop)
+        
+        Usage is estimated from the prompt and response text when the
+        provider did not report it; a cached response used no tokens.
+        """
+        content = "".join(self.parts)
+        if self.cached is not None:
+            return content, 0
+        completion_tokens, total_tokens = self.usage or (None, None)
+        if completion_tokens is None:
+            completion_tokens = count_tokens(content)
+        if total_tokens is None:
+            total_tokens = sum(self.spend.values()) + completion_tokens
+        record_spend(dict(self.spend, completion=completion_tokens))
+        if self.on_usage is not None:
+            self.on_usage(total_tokens)
+        if self.cache_key is not None and self.completed:
+            self.cache.set(self.cache_key, {"content": content, "seconds": time.perf_counter() - self.started})
+        return content, total_tokens
 
 
 class LLMService:
     """Service for interacting with LLM APIs"""
     
     def __init__(self):
-        """Initialize Groq client"""
-        self.client = Groq(api_key=settings.GROQ_API_KEY)
+        """Use the process-wide provider pool, response cache and coalescer"""
+        self.pool = provider_pool
         self.model = settings.LLM_MODEL
-        self.max_retries = 3
-        self.retry_delay = 1  # seconds
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self.retry_delay = settings.LLM_RETRY_BASE_SECONDS
+        self.max_retry_delay = settings.LLM_RETRY_MAX_SECONDS
+        self.budget = token_budget_from_settings()
+        self.response_cache = response_cache
+        self.in_flight = in_flight
+        self.coalesce = settings.LLM_COALESCE_REQUESTS
+        self.governor = rate_governor
     
     def generate_response(
         self,
-        messages: List[Dict[str, str]],
+        messages: List[Dict],
         system_prompt: str = "You are a helpful AI assistant.",
-        max_tokens: int = 1000
+        max_tokens: Optional[int] = None,
+        allocation: Optional[Dict[str, int]] = None,
+        rag_tokens: int = 0,
+        use_cache: bool = True,
+        priority: str = INTERACTIVE
     ) -> tuple[str, int]:
         """
         Generate response from LLM
         
+        The request is fitted to the model's window by the token budget:
+        history is cut to what the system prompt leaves of the prompt
+        allotment, and the completion is capped at its allotment.
+        
         Args:
             messages: List of message dicts with 'role' and 'content'
+                (and optionally a stored 'tokens' count)
             system_prompt: System prompt for the LLM
-            max_tokens: Maximum tokens in response
+            max_tokens: Completion tokens wanted (default COMPLETION_TOKENS);
+                ignored when ``allocation`` is given
+            allocation: Precomputed ``TokenBudget.allocate`` result (e.g.
+                one that also sized the retrieved context); computed here
+                when omitted
+            rag_tokens: Tokens of retrieved context inside ``system_prompt``,
+                reported separately from the instructions
+            use_cache: Serve and store the response in the response cache,
+                and share the response of an identical request in flight
+                (a cached or shared response reports 0 tokens used)
+            priority: Queue position when the rate budgets are used up
+                (a ``rate_governor`` priority; chat turns are 'interactive')
         
         Returns:
             Tuple of (response_text, tokens_used)
         
         Raises:
-            LLMAPIError: If API call fails after retries
+            LLMAPIError: If the request is rejected, or fails after retries
+            ProviderUnavailableError: If the provider is known to be down
+                (circuit open) or saturated (no concurrency slot or rate
+                budget in time)
+            PromptTooLargeError: If the system prompt leaves no room for a response
         """
-        # Build context window with token management
-        context = build_context_window(messages, system_prompt)
+        request, spend = self._prepare_request(messages, system_prompt, max_tokens, allocation, rag_tokens)
+        fingerprint = response_cache_key(request) if use_cache else None
+        if fingerprint is not None and self.response_cache.enabled:
+            cached = self.response_cache.get(fingerprint)
+            if cached is not None:
+                return cached["content"], 0
+        if fingerprint is None or not self.coalesce:
+            return self._complete(request, spend, fingerprint, priority)
+        # Identical requests already in flight share its response
+        (content, tokens), shared = self.in_flight.do(
+            fingerprint, lambda: self._complete(request, spend, fingerprint, priority)
+        )
+        return content, 0 if shared else tokens
+    
+    def _complete(
+        self, request: Dict, spend: Dict[str, int], fingerprint: Optional[str], priority: str
+    ) -> tuple[str, int]:
+        """Call the provider pool with retries, caching the response under ``fingerprint``"""
+        estimate = sum(spend.values())
+        tried = []
+        for attempt in range(self.max_retries):
+            backend = self._admit(estimate, priority, tried)
+            started = time.perf_counter()
+            try:
+                response = backend.complete(request)
+                content, tokens = self._read_response(response, spend)
+            except Exception as e:
+                tried.append(backend)
+                time.sleep(self._on_failure(backend, e, attempt, tried))
+                continue
+            except BaseException:
+                self._on_abandon(backend)
+                raise
+            seconds = time.perf_counter() - started
+            self._on_success(backend, seconds)
+            self.governor.settle(estimate, tokens)
+            if fingerprint is not None and self.response_cache.enabled:
+                self.response_cache.set(fingerprint, {"content": content, "seconds": seconds})
+            return content, tokens
+    
+    async def agenerate_response(
+        self,
+        messages: List[Dict],
+        system_prompt: str = "You are a helpful AI assistant.",
+        max_tokens: Optional[int] = None,
+        allocation: Optional[Dict[str, int]] = None,
+        rag_tokens: int = 0,
+        use_cache: bool = True,
+        priority: str = INTERACTIVE
+    ) -> tuple[str, int]:
+        """
+        Async ``generate_response``: awaits the provider and the backoff,
+        so a call in flight holds no thread
         
-        # Retry logic with exponential backoff
+        Takes the same arguments, returns and raises the same as
+        ``generate_response``.
+        """
+        request, spend = self._prepare_request(messages, system_prompt, max_tokens, allocation, rag_tokens)
+        fingerprint = response_cache_key(request) if use_cache else None
+        if fingerprint is not None and self.response_cache.enabled:
+            cached = await self._aget_cached(fingerprint)
+            if cached is not None:
+                return cached["content"], 0
+        if fingerprint is None or not self.coalesce:
+            return await self._acomplete(request, spend, fingerprint, priority)
+        (content, tokens), shared = await self.in_flight.ado(
+            fingerprint, lambda: self._acomplete(request, spend, fingerprint, priority)
+        )
+        return content, 0 if shared else tokens
+    
+    async def _acomplete(
+        self, request: Dict, spend: Dict[str, int], fingerprint: Optional[str], priority: str
+    ) -> tuple[str, int]:
+        """Async ``_complete``"""
+        estimate = sum(spend.values())
+        tried = []
         for attempt in range(self.max_retries):
+            backend = await self._aadmit(estimate, priority, tried)
+            started = time.perf_counter()
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=context,
-                    max_tokens=max_tokens,
-                    temperature=0.7
-                )
-                
-                # Extract response and token usage
-                assistant_message = response.choices[0].message.content
-                tokens_used = response.usage.total_tokens
-                
-                return assistant_message, tokens_used
-                
+                response = await backend.acomplete(request)
+                content, tokens = self._read_response(response, spend)
             except Exception as e:
-                if attempt < self.max_retries - 1:
-                    # Exponential backoff
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    # Final attempt failed
-                    raise LLMAPIError(f"LLM API failed after {self.max_retries} attempts: {str(e)}")
+                tried.append(backend)
+                await asyncio.sleep(self._on_failure(backend, e, attempt, tried))
+                continue
+            except BaseException:
+                self._on_abandon(backend)  # cancelled, e.g. the client went away
+                raise
+            seconds = time.perf_counter() - started
+            self._on_success(backend, seconds)
+            self.governor.settle(estimate, tokens)
+            if fingerprint is not None and self.response_cache.enabled:
+                await self._aset_cached(fingerprint, {"content": content, "seconds": seconds})
+            return content, tokens
+    
+    async def astream_response(
+        self,
+        messages: List[Dict],
+        system_prompt: str = "You are a helpful AI assistant.",
+        max_tokens: Optional[int] = None,
+        allocation: Optional[Dict[str, int]] = None,
+        rag_tokens: int = 0,
+        use_cache: bool = True,
+        priority: str = INTERACTIVE
+    ) -> ResponseStream:
+        """
+        Start a streamed response
+        
+        Opening the stream is retried like ``agenerate_response``; once
+        tokens flow, a failure ends the stream with ``LLMAPIError``. The
+        stream holds a concurrency slot until it ends or is closed.
+        
+        Takes the same arguments as ``generate_response``.
+        
+        Returns:
+            Stream of text deltas (see ``ResponseStream``)
+        
+        Raises:
+            LLMAPIError: If the stream cannot be opened after retries
+            ProviderUnavailableError: As for ``generate_response``
+            PromptTooLargeError: If the system prompt leaves no room for a response
+        """
+        request, spend = self._prepare_request(messages, system_prompt, max_tokens, allocation, rag_tokens)
+        cache_key = response_cache_key(request) if use_cache and self.response_cache.enabled else None
+        if cache_key is not None:
+            cached = await self._aget_cached(cache_key)
+            if cached is not None:
+                return ResponseStream(None, spend, cached=cached["content"])
+        
+        estimate = sum(spend.values())
+        tried = []
+        for attempt in range(self.max_retries):
+            backend = await self._aadmit(estimate, priority, tried)
+            try:
+                upstream = await backend.astream(request)
+            except Exception as e:
+                tried.append(backend)
+                await asyncio.sleep(self._on_failure(backend, e, attempt, tried))
+                continue
+            except BaseException:
+                self._on_abandon(backend)
+                raise
+            # The slot is held until the stream ends
+            return ResponseStream(
+                upstream, spend, cache=self.response_cache, cache_key=cache_key,
+                on_done=lambda error, seconds, backend=backend: self._on_stream_done(backend, error, seconds),
+                on_usage=lambda tokens: self.governor.settle(estimate, tokens)
+            )
+    
+    def _prepare_request(
+        self,
+        messages: List[Dict],
+        system_prompt: str,
+        max_tokens: Optional[int],
+        allocation: Optional[Dict[str, int]],
+        rag_tokens: int
+    ) -> tuple[Dict, Dict[str, int]]:
+        """
+        Fit a request to the token budget
+        
+        Returns:
+            Tuple of (provider request kwargs, prompt tokens per component)
+        """
+        system_tokens = count_tokens(system_prompt)
+        message_tokens = [
+            m["tokens"] if m.get("tokens") is not None else count_tokens(m["content"])
+            for m in messages
+        ]
+        if allocation is None:
+            allocation = self.budget.allocate({
+                "system": system_tokens,
+                "history": sum(message_tokens),
+                "completion": max_tokens or settings.COMPLETION_TOKENS
+            })
+        prompt_budget = allocation["system"] + allocation["rag"] + allocation["history"]
+        if system_tokens > prompt_budget:
+            raise PromptTooLargeError(system_tokens, self.budget.window)
+        
+        # Build context window with token management
+        context = build_context_window(messages, system_prompt, prompt_budget)
+        request = {
+            "model": self.model,
+            "messages": context,
+            "max_tokens": allocation["completion"],
+            "temperature": 0.7
+        }
+        spend = {
+            "system": system_tokens - rag_tokens,
+            "rag": rag_tokens,
+            "history": sum(message_tokens[len(messages) - len(context) + 1:])
+        }
+        return request, spend
+    
+    def _admit(self, estimate: int, priority: str, tried: List[Backend]) -> Backend:
+        """
+        Take the rate budget for a call, then a backend and a concurrency slot on it
+        
+        Every attempt counts against the rate limits; the budget is given
+        back when the call is not sent after all.
+        
+        Raises:
+            ProviderUnavailableError: If the budget, a backend or a slot
+                is not available in time
+        """
+        self.governor.acquire(estimate, priority)
+        try:
+            backend = self.pool.pick(exclude=tried)
+        except BaseException:
+            self.governor.refund(estimate)
+            raise
+        try:
+            backend.limiter.acquire()
+        except BaseException:
+            backend.breaker.abandon()
+            self.governor.refund(estimate)
+            raise
+        return backend
+    
+    async def _aadmit(self, estimate: int, priority: str, tried: List[Backend]) -> Backend:
+        """Async ``_admit``"""
+        await self.governor.aacquire(estimate, priority)
+        try:
+            backend = self.pool.pick(exclude=tried)
+        except BaseException:
+            self.governor.refund(estimate)
+            raise
+        try:
+            await backend.limiter.aacquire()
+        except BaseException:
+            backend.breaker.abandon()
+            self.governor.refund(estimate)
+            raise
+        return backend
+    
+    def _on_success(self, backend: Backend, seconds: float):
+        """Account for a successful call to ``backend`` that took ``seconds``"""
+        backend.limiter.release(latency=seconds)
+        backend.breaker.record_success()
+        backend.record_latency(seconds)
+    
+    def _on_abandon(self, backend: Backend):
+        """Account for a call given up before it ended (no verdict on the backend)"""
+        backend.limiter.release()
+        backend.breaker.abandon()
+    
+    def _on_failure(self, backend: Backend, error: Exception, attempt: int, tried: List[Backend]) -> float:
+        """
+        Account for a failed call to ``backend`` and decide whether to retry
+        
+        A retry goes to another backend when one can take it, at once;
+        otherwise it waits out the backoff (or the backend's Retry-After).
+        
+        Returns:
+            Seconds to wait before the next attempt
+        
+        Raises:
+            LLMAPIError: If the request was rejected (auth, validation) or
+                this was the last attempt
+            ProviderUnavailableError: If the provider asked for a longer
+                pause than ``max_retry_delay`` and no other backend is free
+        """
+        kind = classify_error(error)
+        # Any provider-side failure is a congestion signal for the limiter
+        backend.limiter.release(overloaded=kind != REJECTED)
+        backend.breaker.record_failure(kind)
+        backend.record_failure()
+        if kind == REJECTED:
+            raise LLMAPIError(f"LLM API rejected the request: {str(error)}")
+        if attempt == self.max_retries - 1:
+            raise LLMAPIError(f"LLM API failed after {self.max_retries} attempts: {str(error)}")
+        retry_after = retry_after_seconds(error)
+        if kind == RATE_LIMITED:
+            backend.cool_down(retry_after if retry_after is not None else self.retry_delay)
+        if self.pool.has_alternative(tried):
+            return 0.0
+        if retry_after is not None and retry_after > self.max_retry_delay:
+            raise ProviderUnavailableError(retry_after)
+        return backoff_delay(attempt, self.retry_delay, self.max_retry_delay, retry_after)
+    
+    def _on_stream_done(self, backend: Backend, error: Optional[BaseException], first_chunk_seconds: Optional[float]):
+        """Account for the end of a streamed call (see ``ResponseStream``)"""
+        if error is not None:
+            kind = classify_error(error)
+            backend.limiter.release(overloaded=kind != REJECTED)
+            backend.breaker.record_failure(kind)
+            backend.record_failure()
+        elif first_chunk_seconds is None:
+            self._on_abandon(backend)
+        else:
+            self._on_success(backend, first_chunk_seconds)
+    
+    async def _aget_cached(self, cache_key: str) -> Optional[Dict]:
+        """Look up the response cache, reading the persistent tier off the event loop"""
+        if self.response_cache.store is None:
+            return self.response_cache.get(cache_key)
+        return await run_in_threadpool(self.response_cache.get, cache_key)
+    
+    async def _aset_cached(self, cache_key: str, entry: Dict):
+        """Cache a response, writing the persistent tier off the event loop"""
+        if self.response_cache.store is None:
+            self.response_cache.set(cache_key, entry)
+        else:
+            await run_in_threadpool(self.response_cache.set, cache_key, entry)
+    
+    def _read_response(self, response, spend: Dict[str, int]) -> tuple[str, int]:
+        """Extract the reply and token usage, recording the spend"""
+        record_spend(dict(spend, completion=response.usage.completion_tokens))
+        return response.choices[0].message.content, response.usage.total_tokens
+    
+    def summarize(
+        self,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> str:
+        """
+        Fold conversation turns into a running summary
+        
+        Args:
+            previous_summary: Current summary (None for the first fold)
+            messages: Turns to fold in, oldest first, with 'role' and 'content'
+            max_tokens: Maximum tokens in the summary
+        
+        Returns:
+            Updated summary text
+        
+        Raises:
+            LLMAPIError: If API call fails after retries
+        """
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = (
+            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+            f"New turns:\n{transcript}"
+        )
+        summary, _ = self.generate_response(
+            [{"role": "user", "content": prompt}], SUMMARY_SYSTEM_PROMPT, max_tokens, priority=SUMMARY
+        )
+        return summary.strip()
     
     def generate_title(self, first_message: str) -> str:
         """
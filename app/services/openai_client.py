@@ -0,0 +1,179 @@
+"""
+Minimal client for OpenAI-compatible chat completion endpoints (vLLM,
+llama.cpp, Ollama, the local stand-in in ``fake_llm``)
+
+Mirrors the part of the provider SDKs ``LLMService`` uses,
+``client.chat.completions.create(...)`` (streamed or not), over one
+keep-alive ``httpx`` connection pool per client.
+"""
+import json
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import httpx
+
+
+class ProviderHTTPError(Exception):
+    """An error status from the endpoint (``status_code`` and ``response`` like the SDKs' errors)"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP {response.status_code}: {response.text[:200]}")
+        self.status_code = response.status_code
+        self.response = response
+
+
+def _namespace(value):
+    """JSON object to attribute access, like the SDKs' response models"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+def _completion(response: httpx.Response) -> SimpleNamespace:
+    if response.status_code >= 400:
+        raise ProviderHTTPError(response)
+    completion = _namespace(response.json())
+    completion.headers = response.headers
+    return completion
+
+
+def _chunk(line: str) -> Optional[SimpleNamespace]:
+    """Parse one server-sent event line into a chunk (None for other lines)"""
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if not data or data == "[DONE]":
+        return None
+    return _namespace(json.loads(data))
+
+
+class HTTPChunkStream:
+    """Chunks of a streamed completion, read as they arrive"""
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+        self.headers = response.headers
+
+    def __iter__(self):
+        try:
+            for line in self.response.iter_lines():
+                chunk = _chunk(line)
+                if chunk is not None:
+                    yield chunk
+        finally:
+            self.response.close()
+
+    def close(self):
+        self.response.close()
+
+
+class AsyncHTTPChunkStream(HTTPChunkStream):
+    """Async ``HTTPChunkStream``"""
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for line in self.response.aiter_lines():
+                chunk = _chunk(line)
+                if chunk is not None:
+                    yield chunk
+        finally:
+            await self.response.aclose()
+
+    async def close(self):
+        await self.response.aclose()
+
+
+class OpenAICompatibleClient:
+    """Blocking client; one instance per endpoint, shared by all threads"""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "",
+        timeout: float = 60.0,
+        keepalive_connections: int = 20,
+        transport: Optional[httpx.BaseTransport] = None
+    ):
+        """
+        Args:
+            base_url: API root, e.g. 'http://localhost:8001/v1'
+            api_key: Bearer token ('' for endpoints without auth)
+            timeout: Seconds before a request (or a stream read) times out
+            keepalive_connections: Idle connections kept open for reuse
+            transport: Custom transport (tests)
+        """
+        self.http = self._http_client(base_url, api_key, timeout, keepalive_connections, transport)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _http_client(self, base_url, api_key, timeout, keepalive_connections, transport):
+        return httpx.Client(
+            base_url=base_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=timeout,
+            limits=httpx.Limits(max_keepalive_connections=keepalive_connections, keepalive_expiry=60.0),
+            transport=transport
+        )
+
+    @staticmethod
+    def _payload(model: str, messages: List[Dict[str, str]], stream: bool, **kwargs) -> Dict:
+        return {"model": model, "messages": messages, "stream": stream, **kwargs}
+
+    def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        """Return a completion, or (``stream=True``) a chunk stream"""
+        payload = self._payload(model, messages, stream, **kwargs)
+        if not stream:
+            return _completion(self.http.post("/chat/completions", json=payload))
+        response = self.http.send(self.http.build_request("POST", "/chat/completions", json=payload), stream=True)
+        if response.status_code >= 400:
+            response.read()
+            raise ProviderHTTPError(response)
+        return HTTPChunkStream(response)
+
+    def ping(self):
+        """Raise if the endpoint is unreachable or failing"""
+        response = self.http.get("/models")
+        if response.status_code >= 500:
+            raise ProviderHTTPError(response)
+
+    def close(self):
+        self.http.close()
+
+
+class AsyncOpenAICompatibleClient(OpenAICompatibleClient):
+    """Async client; one instance per endpoint and event loop"""
+
+    def _http_client(self, base_url, api_key, timeout, keepalive_connections, transport):
+        return httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=timeout,
+            limits=httpx.Limits(max_keepalive_connections=keepalive_connections, keepalive_expiry=60.0),
+            transport=transport
+        )
+
+    async def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        """Return a completion, or (``stream=True``) a chunk stream"""
+        payload = self._payload(model, messages, stream, **kwargs)
+        if not stream:
+            return _completion(await self.http.post("/chat/completions", json=payload))
+        response = await self.http.send(
+            self.http.build_request("POST", "/chat/completions", json=payload), stream=True
+        )
+        if response.status_code >= 400:
+            await response.aread()
+            raise ProviderHTTPError(response)
+        return AsyncHTTPChunkStream(response)
+
+    async def ping(self):
+        """Raise if the endpoint is unreachable or failing"""
+        response = await self.http.get("/models")
+        if response.status_code >= 500:
+            raise ProviderHTTPError(response)
+
+    async def close(self):
+        await self.http.aclose()
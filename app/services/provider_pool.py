@@ -0,0 +1,371 @@
+"""
+Process-wide pool of LLM backends (API keys and OpenAI-compatible
+endpoints) with latency- and quota-aware routing
+"""
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from groq import AsyncGroq, Groq
+
+from app.config import settings
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.openai_client import AsyncOpenAICompatibleClient, OpenAICompatibleClient
+from app.utils.error_handler import ProviderUnavailableError
+from app.utils.resilience import AdaptiveLimiter, CircuitBreaker
+
+BACKEND_KINDS = ("groq", "openai", "fake")
+LLM_PROVIDERS = ("groq", "fake")  # single-backend shorthands for LLM_PROVIDER
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit reset header ('7.66s', '2m59.56s', '120ms', '30'), or None"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_int(headers, name: str) -> Optional[int]:
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class Backend:
+    """
+    One provider endpoint (an API key, or an OpenAI-compatible server)
+
+    Tracks what routing needs: an EWMA of call latency, the quota left as
+    reported by the ``x-ratelimit-*`` response headers, and a cool-down
+    after a 429. Each backend has its own circuit breaker (health) and
+    AIMD concurrency limit, since each key or server has its own limits.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client,
+        async_client,
+        model: Optional[str] = None,
+        kind: str = "openai",
+        breaker: Optional[CircuitBreaker] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        ewma_alpha: float = 0.3
+    ):
+        """
+        Args:
+            name: Label in logs and /metrics
+            client: Blocking client (``client.chat.completions.create``)
+            async_client: Async client with the same interface
+            model: Model to request here (None: the request's model)
+            kind: 'groq' (quota headers read through the SDK's raw
+                responses) or any other kind (headers on the response)
+            breaker: Health breaker (default from settings)
+            limiter: Concurrency limit (default from settings)
+            ewma_alpha: Weight of the newest latency sample
+        """
+        self.name = name
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.kind = kind
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            cooldown_seconds=settings.LLM_BREAKER_COOLDOWN_SECONDS
+        )
+        self.limiter = limiter or AdaptiveLimiter(
+            initial=settings.LLM_CONCURRENCY_INITIAL,
+            max_limit=settings.LLM_CONCURRENCY_MAX,
+            latency_target=settings.LLM_LATENCY_TARGET_SECONDS,
+            queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS
+        )
+        self.ewma_alpha = ewma_alpha
+        self.ewma_latency: Optional[float] = None
+        self.remaining_requests: Optional[int] = None
+        self.limit_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.limit_tokens: Optional[int] = None
+        self.quota_reset_at = 0.0  # when an exhausted request quota refills
+        self.cooldown_until = 0.0  # set by a 429
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _request(self, request: Dict) -> Dict:
+        return dict(request, model=self.model) if self.model else request
+
+    def complete(self, request: Dict):
+        """Send a request; return the provider's completion"""
+        if self.kind == "groq":
+            raw = self.client.chat.completions.with_raw_response.create(**self._request(request))
+            self.observe_headers(raw.headers)
+            return raw.parse()
+        response = self.client.chat.completions.create(**self._request(request))
+        self.observe_headers(getattr(response, "headers", None))
+        return response
+
+    async def acomplete(self, request: Dict):
+        """Async ``complete``"""
+        if self.kind == "groq":
+            raw = await self.async_client.chat.completions.with_raw_response.create(**self._request(request))
+            self.observe_headers(raw.headers)
+            return await raw.parse()
+        response = await self.async_client.chat.completions.create(**self._request(request))
+        self.observe_headers(getattr(response, "headers", None))
+        return response
+
+    async def astream(self, request: Dict):
+        """Open a streamed completion; return the provider's chunk stream"""
+        if self.kind == "groq":
+            raw = await self.async_client.chat.completions.with_raw_response.create(
+                **self._request(request), stream=True
+            )
+            self.observe_headers(raw.headers)
+            return await raw.parse()
+        stream = await self.async_client.chat.completions.create(**self._request(request), stream=True)
+        self.observe_headers(getattr(stream, "headers", None))
+        return stream
+
+    def ping(self):
+        """Raise if the backend is unreachable or failing (a cheap, unmetered call)"""
+        if self.kind == "groq":
+            self.client.models.list()
+        elif hasattr(self.client, "ping"):
+            self.client.ping()
+
+    def observe_headers(self, headers):
+        """Record the quota reported in ``x-ratelimit-*`` headers"""
+        if not headers:
+            return
+        with self._lock:
+            remaining = _header_int(headers, "x-ratelimit-remaining-requests")
+            if remaining is not None:
+                self.remaining_requests = remaining
+                self.limit_requests = _header_int(headers, "x-ratelimit-limit-requests") or self.limit_requests
+                reset = parse_reset(headers.get("x-ratelimit-reset-requests"))
+                if reset is not None:
+                    self.quota_reset_at = time.monotonic() + reset
+            remaining = _header_int(headers, "x-ratelimit-remaining-tokens")
+            if remaining is not None:
+                self.remaining_tokens = remaining
+                self.limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens") or self.limit_tokens
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.calls += 1
+            if self.ewma_latency is None:
+                self.ewma_latency = seconds
+            else:
+                self.ewma_latency += self.ewma_alpha * (seconds - self.ewma_latency)
+
+    def record_failure(self):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+
+    def cool_down(self, seconds: float):
+        """Route nothing here for ``seconds`` (the backend said it is rate limited)"""
+        with self._lock:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+    def ready_at(self, now: float) -> float:
+        """When the backend can take a call (``now`` or earlier: it can now)"""
+        ready = self.cooldown_until
+        if self.remaining_requests == 0:
+            ready = max(ready, self.quota_reset_at)
+        open_until = self.breaker.open_until()  # one locked read: the breaker may close meanwhile
+        if open_until is not None:
+            ready = max(ready, open_until)
+        return ready
+
+    def score(self, default_latency: float) -> float:
+        """
+        Expected cost of routing a call here (lower is better): latency,
+        scaled up by the share of the concurrency limit in use and by how
+        little of the quota is left
+        """
+        latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+        load = (self.limiter.in_flight + 1) / max(self.limiter.limit, 1.0)
+        quota = 1.0
+        if self.remaining_requests is not None and self.limit_requests:
+            quota = min(quota, self.remaining_requests / self.limit_requests)
+        if self.remaining_tokens is not None and self.limit_tokens:
+            quota = min(quota, self.remaining_tokens / self.limit_tokens)
+        return latency * load / max(quota, 0.01)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "calls": self.calls,
+                "failures": self.failures,
+                "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+                "remaining_requests": self.remaining_requests,
+                "remaining_tokens": self.remaining_tokens,
+                "cooling_down": self.cooldown_until > time.monotonic(),
+                "circuit": self.breaker.stats(),
+                "concurrency": self.limiter.stats()
+            }
+
+
+class ProviderPool:
+    """
+    Routes each LLM call to the backend with the lowest expected cost
+
+    Backends that are ejected (circuit open), cooling down after a 429 or
+    out of request quota are skipped; new backends start at the average
+    latency of the others, so they get tried. Optional health checks ping
+    every backend in a background thread, ejecting those that fail and
+    readmitting them once they answer again.
+    """
+
+    def __init__(self, backends: List[Backend]):
+        if not backends:
+            raise ValueError("An LLM provider pool needs at least one backend")
+        self.backends = backends
+        self.picks = 0
+        self._lock = threading.Lock()
+        self._health_stop: Optional[threading.Event] = None
+
+    def pick(self, exclude: Iterable[Backend] = ()) -> Backend:
+        """
+        Choose a backend for a call and admit the call through its breaker
+
+        Backends in ``exclude`` (e.g. ones that just failed this request)
+        are used only when no other backend can take the call.
+
+        Raises:
+            ProviderUnavailableError: If no backend can take a call now
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.picks += 1
+            rotation = self.picks
+        known = [b.ewma_latency for b in self.backends if b.ewma_latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        ready = [b for b in self.backends if b.ready_at(now) <= now]
+        excluded = set(exclude)
+        n = len(self.backends)
+        ranked = sorted(
+            ready,
+            key=lambda b: (
+                b in excluded,
+                b.score(default_latency),
+                (self.backends.index(b) - rotation) % n  # spreads ties
+            )
+        )
+        for backend in ranked:
+            try:
+                backend.breaker.before_call()
+            except ProviderUnavailableError:
+                continue  # its one half-open probe is already out
+            with backend._lock:
+                if backend.remaining_requests:
+                    backend.remaining_requests -= 1  # until the next headers say otherwise
+            return backend
+        soonest = min(b.ready_at(now) for b in self.backends)
+        raise ProviderUnavailableError(max(soonest - now, 1.0))
+
+    def has_alternative(self, exclude: Iterable[Backend]) -> bool:
+        """Whether a backend outside ``exclude`` could take a call now"""
+        now = time.monotonic()
+        excluded = set(exclude)
+        return any(b not in excluded and b.ready_at(now) <= now for b in self.backends)
+
+    def check_health(self):
+        """Ping every backend: eject the failing ones, readmit those that recovered"""
+        for backend in self.backends:
+            try:
+                backend.ping()
+            except Exception:
+                backend.breaker.trip()
+            else:
+                if backend.breaker.state != "closed":
+                    backend.breaker.record_success()
+
+    def start_health_checks(self, interval: float):
+        """Run ``check_health`` every ``interval`` seconds in a daemon thread"""
+        if interval <= 0 or self._health_stop is not None:
+            return
+        self._health_stop = stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.check_health()
+
+        threading.Thread(target=run, name="llm-health-checks", daemon=True).start()
+
+    def stop_health_checks(self):
+        if self._health_stop is not None:
+            self._health_stop.set()
+            self._health_stop = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backends": [backend.stats() for backend in self.backends]}
+
+
+def backend_from_spec(spec: Dict[str, Any], index: int = 0) -> Backend:
+    """
+    Build a backend from a settings entry
+
+    Args:
+        spec: {'kind': 'groq' | 'openai' | 'fake', 'name', 'api_key',
+            'base_url' (openai), 'model'}; missing keys get defaults
+        index: Position in the pool (for the default name)
+    """
+    kind = spec.get("kind", "groq")
+    name = spec.get("name") or f"{kind}-{index}"
+    model = spec.get("model")
+    if kind == "groq":
+        api_key = spec.get("api_key", settings.GROQ_API_KEY)
+        # Retries are LLMService's, not the SDK's; one client (and
+        # keep-alive connection pool) per key for the whole process
+        client = Groq(api_key=api_key, max_retries=0, timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS)
+        async_client = AsyncGroq(api_key=api_key, max_retries=0, timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS)
+    elif kind == "openai":
+        options = {
+            "base_url": spec["base_url"],
+            "api_key": spec.get("api_key", ""),
+            "timeout": settings.LLM_REQUEST_TIMEOUT_SECONDS,
+            "keepalive_connections": settings.LLM_KEEPALIVE_CONNECTIONS
+        }
+        client = OpenAICompatibleClient(**options)
+        async_client = AsyncOpenAICompatibleClient(**options)
+    elif kind == "fake":
+        client = FakeLLMClient(settings.FAKE_LLM_LATENCY_SECONDS, settings.FAKE_LLM_TOKEN_SECONDS)
+        async_client = AsyncFakeLLMClient(settings.FAKE_LLM_LATENCY_SECONDS, settings.FAKE_LLM_TOKEN_SECONDS)
+    else:
+        raise ValueError(f"Invalid LLM backend kind: {kind}. Must be one of {BACKEND_KINDS}")
+    return Backend(name, client, async_client, model=model, kind=kind, ewma_alpha=settings.LLM_EWMA_ALPHA)
+
+
+def provider_pool_from_settings() -> ProviderPool:
+    """
+    Build the pool configured in settings
+
+    ``LLM_BACKENDS`` lists the backends; without it, the pool has one
+    Groq backend per key in ``GROQ_API_KEYS`` (or ``GROQ_API_KEY``), or a
+    single fake backend when ``LLM_PROVIDER`` is 'fake'.
+    """
+    specs = list(settings.LLM_BACKENDS)
+    if not specs:
+        if settings.LLM_PROVIDER == "fake":
+            specs = [{"kind": "fake", "name": "fake"}]
+        elif settings.LLM_PROVIDER == "groq":
+            keys = settings.GROQ_API_KEYS or [settings.GROQ_API_KEY]
+            specs = [{"kind": "groq", "api_key": key} for key in keys]
+        else:
+            raise ValueError(f"Invalid LLM_PROVIDER: {settings.LLM_PROVIDER}. Must be one of {LLM_PROVIDERS}")
+    return ProviderPool([backend_from_spec(spec, i) for i, spec in enumerate(specs)])
@@ -1,10 +1,143 @@
 """
 RAG Service - Document retrieval and context augmentation
 """
-import re
-from typing import List, Dict
-from collections import Counter
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator
+import numpy as np
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import Session
 from app.config import settings
+from app.models import Document, DocumentChunk
+from app.utils.context_manager import count_tokens
+from app.utils.chunking import StreamingChunker, SentenceChunker
+from app.utils.inverted_index import tokenize, is_index_term, build_index
+from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix, ShardedMatrix, top_k_rows
+from app.utils.embeddings import HashingEmbedder, vectors_to_bytes, vectors_from_bytes
+from app.utils.ann_index import IVFIndex
+from app.utils.index_file import MappedChunkMatrix, index_file_path, open_index_file, write_index_file
+from app.utils.cache import LRUCache
+from app.utils.error_handler import DocumentVersionConflictError
+from app.utils.simhash import ChunkDeduplicator, simhash, hamming_distance, to_signed, from_signed
+
+RETRIEVAL_BACKENDS = ("keyword", "vector")
+CHUNKING_MODES = ("words", "tokens")
+
+# Retries when a document is updated while a query reads it
+SNAPSHOT_ATTEMPTS = 3
+
+# Process-wide so every service instance sees the same entries and
+# invalidations (API routers and services each create their own RAGService)
+retrieval_cache = LRUCache(
+    max_bytes=settings.RETRIEVAL_CACHE_MAX_BYTES,
+    ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS or None
+)
+
+
+# Chunk text as stored, or sliced out of the content for offset-only chunks
+# (needs a join with Document)
+CHUNK_TEXT = case(
+    (
+        DocumentChunk.text == "",
+        func.substr(
+            Document.content,
+            DocumentChunk.start_offset + 1,
+            DocumentChunk.end_offset - DocumentChunk.start_offset
+        )
+    ),
+    else_=DocumentChunk.text
+)
+
+
+def stored_chunk_text(chunk: Dict) -> str:
+    """
+    Text to store for a chunk: '' when its offsets locate it in the content
+    
+    Both chunkers emit text that is exactly the content slice at the
+    chunk's offsets, so the slice reproduces it. Offset-only chunks avoid
+    storing the content a second time (more, with overlap); their text is
+    materialized with ``CHUNK_TEXT`` or ``chunk_row_text`` when needed.
+    """
+    return "" if chunk.get("start") is not None and chunk.get("end") is not None else chunk["text"]
+
+
+def chunk_row_text(row, content: str) -> str:
+    """Text of a stored chunk row, given its document's content"""
+    return row.text or content[row.start_offset:row.end_offset]
+
+
+class RetrievedChunk(str):
+    """Retrieved chunk text that also carries its stored token count and SimHash"""
+    
+    def __new__(cls, text: str, token_count: Optional[int] = None, simhash: Optional[int] = None):
+        chunk = super().__new__(cls, text)
+        chunk.token_count = token_count
+        chunk.simhash = simhash
+        return chunk
+
+
+def chunk_token_count(chunk: str) -> int:
+    """Tokens in a chunk, from its stored count when it carries one"""
+    return getattr(chunk, "token_count", None) or count_tokens(chunk)
+
+
+def context_token_count(chunks: List[str]) -> int:
+    """Tokens of chunks joined as prompt context (one per separator)"""
+    return sum(chunk_token_count(chunk) for chunk in chunks) + max(len(chunks) - 1, 0)
+
+
+_retrieval_pool: Optional[ThreadPoolExecutor] = None
+_retrieval_pool_lock = threading.Lock()
+
+
+def get_retrieval_pool() -> ThreadPoolExecutor:
+    """
+    Return the shared shard-search thread pool, creating it on first use
+    
+    Threads suffice because shard scoring is NumPy work that releases
+    the GIL, and shards share the cached matrices without copying.
+    """
+    global _retrieval_pool
+    with _retrieval_pool_lock:
+        if _retrieval_pool is None:
+            _retrieval_pool = ThreadPoolExecutor(
+                max_workers=settings.RETRIEVAL_WORKERS, thread_name_prefix="retrieval"
+            )
+        return _retrieval_pool
+
+
+def shutdown_retrieval_pool():
+    """Stop the shard-search thread pool (called on application shutdown)"""
+    global _retrieval_pool
+    with _retrieval_pool_lock:
+        if _retrieval_pool is not None:
+            _retrieval_pool.shutdown(cancel_futures=True)
+            _retrieval_pool = None
+
+
+# Retrieval-time near-duplicate suppression counters (exposed at /metrics)
+dedup_stats = {"retrieved": 0, "suppressed": 0}
+_dedup_stats_lock = threading.Lock()
+
+
+def document_set_fingerprint(documents: List) -> Tuple[Tuple[int, int, int], ...]:
+    """
+    Identify a set of documents and the state of their contents
+
+    Args:
+        documents: Document models
+
+    Returns:
+        Sorted (id, version, chunk_count) triples; changes whenever a
+        document is added, removed, edited or finishes ingesting
+    """
+    return tuple(sorted(
+        (document.id, document.version or 1, document.chunk_count or 0)
+        for document in documents
+    ))
 
 
 class RAGService:
@@ -14,9 +147,35 @@ class RAGService:
         """Initialize RAG service"""
         self.chunk_size = settings.CHUNK_SIZE
         self.chunk_overlap = settings.CHUNK_OVERLAP
+        self.chunking_mode = settings.CHUNKING_MODE
+        if self.chunking_mode not in CHUNKING_MODES:
+            raise ValueError(
+                f"Invalid CHUNKING_MODE: {self.chunking_mode}. "
+                f"Must be one of {CHUNKING_MODES}"
+            )
+        self.chunk_tokens = settings.CHUNK_TOKENS
+        self.chunk_overlap_tokens = settings.CHUNK_OVERLAP_TOKENS
+        self.context_token_budget = settings.RAG_CONTEXT_TOKENS
+        self.dedup_distance = settings.DEDUP_SIMHASH_DISTANCE
         self.top_k = settings.TOP_K_CHUNKS
+        self.matrix_cache_size = settings.RETRIEVAL_MATRIX_CACHE_SIZE
+        self.pruning = settings.RETRIEVAL_PRUNING
+        self.shard_chunks = settings.RETRIEVAL_SHARD_CHUNKS
+        self._matrix_cache = OrderedDict()  # (document id, version) -> ChunkMatrix
+        self._cache_lock = threading.Lock()  # guards the matrix and ANN caches
+        self.index_dir = settings.INDEX_DIR
+        
+        self.retrieval_backend = settings.RETRIEVAL_BACKEND
+        if self.retrieval_backend not in RETRIEVAL_BACKENDS:
+            raise ValueError(
+                f"Invalid RETRIEVAL_BACKEND: {self.retrieval_backend}. "
+                f"Must be one of {RETRIEVAL_BACKENDS}"
+            )
+        self.embedder = HashingEmbedder(dim=settings.EMBEDDING_DIM)
+        self._ann_cache = OrderedDict()  # ordered (id, version, chunk_count) -> IVFIndex
+        self.retrieval_cache = retrieval_cache
     
-    def chunk_document(self, content: str) -> List[Dict[str, str]]:
+    def chunk_document(self, content: str) -> List[Dict]:
         """
         Split document into chunks with overlap
         
@@ -24,121 +183,666 @@ class RAGService:
             content: Document content
         
         Returns:
-            List of chunk dicts with 'text' and 'index'
+            List of chunk dicts with 'index', 'text' and the character
+            offsets 'start'/'end' of the chunk within ``content``
+            ('tokens' mode also sets 'token_count')
+        """
+        return list(self.iter_chunks([content]))
+    
+    def make_chunker(self):
+        """
+        Create an incremental chunker for the configured chunking mode
+        
+        'words' windows ``CHUNK_SIZE`` whitespace words; 'tokens' packs
+        whole sentences into ``CHUNK_TOKENS`` tokenizer tokens.
+        """
+        if self.chunking_mode == "tokens":
+            return SentenceChunker(self.chunk_tokens, self.chunk_overlap_tokens, count_tokens)
+        return StreamingChunker(self.chunk_size, self.chunk_overlap)
+    
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[Dict]:
+        """
+        Lazily chunk a document supplied as consecutive text pieces
+        
+        Args:
+            pieces: Document text, in order
+        
+        Yields:
+            Chunk dicts, as produced by ``chunk_document``
+        """
+        chunker = self.make_chunker()
+        for piece in pieces:
+            yield from chunker.feed(piece)
+        yield from chunker.close()
+    
+    def make_deduplicator(self, start_index: int = 0) -> ChunkDeduplicator:
+        """
+        Create a filter that fingerprints a document's chunks and collapses
+        near-duplicates (within ``DEDUP_SIMHASH_DISTANCE`` bits)
+        """
+        return ChunkDeduplicator(self.dedup_distance, start_index)
+    
+    def build_chunk_rows(self, chunks: List[Dict]) -> List[DocumentChunk]:
+        """
+        Build ``document_chunks`` rows with per-chunk metadata
+        
+        Args:
+            chunks: List of chunk dicts produced by ``chunk_document``
+        
+        Returns:
+            Unsaved DocumentChunk models
+        """
+        return [
+            DocumentChunk(
+                chunk_index=chunk["index"],
+                start_offset=chunk.get("start"),
+                end_offset=chunk.get("end"),
+                token_count=chunk["token_count"] if "token_count" in chunk else count_tokens(chunk["text"]),
+                simhash=to_signed(chunk["simhash"]) if "simhash" in chunk else None,
+                text=stored_chunk_text(chunk)
+            )
+            for chunk in chunks
+        ]
+    
+    def build_index(self, chunks: List[Dict[str, str]]) -> Dict:
+        """
+        Build the persistent BM25 inverted index for a document's chunks
+        
+        Args:
+            chunks: List of chunk dicts produced by ``chunk_document``
+        
+        Returns:
+            JSON-serializable inverted index
+        """
+        return build_index(chunk["text"] for chunk in chunks)
+    
+    def embed_chunks(self, chunks: List[Dict[str, str]]) -> bytes:
+        """
+        Compute the offline embedding vectors for a document's chunks
+        
+        Args:
+            chunks: List of chunk dicts produced by ``chunk_document``
+        
+        Returns:
+            Serialized float32 matrix with one row per chunk
         """
-        # Simple word-based chunking
-        words = content.split()
-        chunks = []
+        return vectors_to_bytes(self.embedder.embed([chunk["text"] for chunk in chunks]))
+    
+    def stage_index_file(self, index: Dict, chunks: List[Dict], embeddings: bytes) -> Optional[str]:
+        """
+        Write a new document's index file under a temporary name
+        
+        Lets ingestion workers build the file before the document has an
+        id; ``publish_staged_index`` moves it into place after the commit.
         
-        i = 0
-        chunk_index = 0
-        while i < len(words):
-            # Get chunk of words
-            chunk_words = words[i:i + self.chunk_size]
-            chunk_text = " ".join(chunk_words)
-            
-            chunks.append({
-                "index": chunk_index,
-                "text": chunk_text
-            })
-            
-            # Move forward with overlap
-            i += self.chunk_size - self.chunk_overlap
-            chunk_index += 1
+        Args:
+            index: Inverted index of the chunks
+            chunks: Chunk dicts (offsets are stored with the index)
+            embeddings: Serialized chunk vectors
         
-        return chunks
+        Returns:
+            Staged file path, or None when INDEX_DIR is not configured
+        """
+        if not self.index_dir:
+            return None
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.index_dir, prefix=".staged-", suffix=".idx")
+        os.close(fd)
+        write_index_file(
+            path,
+            index,
+            1,
+            [(chunk.get("start"), chunk.get("end")) for chunk in chunks],
+            self._index_vectors(embeddings, len(chunks))
+        )
+        return path
+    
+    def publish_staged_index(self, path: Optional[str], document_id: Optional[int]):
+        """Move a staged index file into place, or discard it if the document was not stored"""
+        if path is None:
+            return
+        if document_id is None:
+            os.remove(path)
+        else:
+            os.replace(path, index_file_path(self.index_dir, document_id))
+    
+    def publish_index(self, db: Session, document_id: int) -> Optional[MappedChunkMatrix]:
+        """
+        Rebuild a document's index file from the database and swap it in
+        
+        Args:
+            db: Database session
+            document_id: Document to publish
+        
+        Returns:
+            The mapped file, or None when INDEX_DIR is not configured or the
+            file could not be written (queries then rebuild it lazily)
+        """
+        if not self.index_dir:
+            return None
+        row = db.query(Document.term_index, Document.embeddings, Document.version).filter(
+            Document.id == document_id
+        ).one()
+        if not row.term_index:
+            return None
+        try:
+            return self._write_index_file(db, document_id, row.version or 1, row.term_index, row.embeddings)
+        except OSError:
+            return None
+    
+    def _write_index_file(
+        self,
+        db: Session,
+        document_id: int,
+        version: int,
+        index: Dict,
+        embeddings: Optional[bytes]
+    ) -> MappedChunkMatrix:
+        """Write (atomically replace) and map a document's index file"""
+        offsets = db.query(DocumentChunk.start_offset, DocumentChunk.end_offset).filter(
+            DocumentChunk.document_id == document_id
+        ).order_by(DocumentChunk.chunk_index).all()
+        os.makedirs(self.index_dir, exist_ok=True)
+        path = index_file_path(self.index_dir, document_id)
+        write_index_file(path, index, version, offsets, self._index_vectors(embeddings, len(offsets)))
+        return open_index_file(path)
+    
+    def _index_vectors(self, embeddings: Optional[bytes], n_chunks: int) -> Optional[np.ndarray]:
+        """Decode stored embeddings for an index file, None if missing or stale"""
+        dim = self.embedder.dim
+        if embeddings and len(embeddings) == n_chunks * dim * 4:
+            return vectors_from_bytes(embeddings, dim)
+        return None
     
     def retrieve_relevant_chunks(
         self,
         query: str,
-        chunks: List[Dict[str, str]]
-    ) -> List[str]:
+        chunks: List[Dict[str, str]],
+        index: Optional[Dict] = None
+    ) -> List[RetrievedChunk]:
         """
-        Retrieve most relevant chunks using keyword matching
+        Retrieve most relevant chunks with the configured backend
         
         Args:
             query: User query
             chunks: List of document chunks
+            index: Pre-built index for ``chunks`` (built on the fly if omitted)
         
         Returns:
             List of top-K relevant chunk texts
         """
-        # Extract keywords from query (simple approach)
-        query_keywords = self._extract_keywords(query)
+        k = self._candidate_count()
+        if self.retrieval_backend == "vector":
+            vectors = self.embedder.embed([chunk["text"] for chunk in chunks])
+            ranked = self._rank_vector(query, [len(chunks)], self._build_ann(vectors), k)
+        else:
+            if index is None:
+                index = self.build_index(chunks)
+            ranked = self._rank_keyword(
+                self._extract_keywords(query), [ChunkMatrix.from_index(index)], k
+            )
         
-        # Score each chunk
-        chunk_scores = []
-        for chunk in chunks:
-            score = self._calculate_relevance_score(query_keywords, chunk["text"])
-            chunk_scores.append((chunk["text"], score))
+        return self._suppress_duplicates([
+            RetrievedChunk(
+                chunks[chunk_id]["text"],
+                chunks[chunk_id].get("token_count"),
+                chunks[chunk_id].get("simhash")
+            )
+            for _, chunk_id in ranked
+        ])
+    
+    def retrieve_from_documents(
+        self,
+        db: Session,
+        query: str,
+        documents: List
+    ) -> List[RetrievedChunk]:
+        """
+        Retrieve most relevant chunks across several documents
+        
+        Keyword retrieval uses each document's persisted ``term_index``,
+        converted once into a sparse matrix and cached by document id.
+        Vector retrieval searches an ANN index over the documents' stored
+        embeddings, cached per document set. Only the top-K chunk rows are
+        loaded from ``document_chunks``.
+        
+        Results are cached by the query's normalized keywords and the
+        document set fingerprint, so repeated questions against the same
+        (unchanged) documents skip scoring and the chunk lookup entirely.
+        
+        Near-duplicate chunks (e.g. boilerplate repeated across documents)
+        are suppressed, so they do not take several of the top-K slots.
+        
+        Every read is checked against the documents' versions; if a
+        document is updated mid-query the documents are refreshed and the
+        query retried, so results always come from one version.
+        
+        Args:
+            db: Database session
+            query: User query
+            documents: Document models attached to the conversation
         
-        # Sort by score and get top-K
-        chunk_scores.sort(key=lambda x: x[1], reverse=True)
-        top_chunks = [text for text, score in chunk_scores[:self.top_k]]
+        Returns:
+            List of top-K relevant chunk texts
         
-        return top_chunks
+        Raises:
+            DocumentVersionConflictError: If documents keep changing
+        """
+        keywords = self._extract_keywords(query)
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            try:
+                return self._retrieve_snapshot(db, query, keywords, documents)
+            except DocumentVersionConflictError:
+                if attempt == SNAPSHOT_ATTEMPTS - 1:
+                    raise
+                for document in documents:
+                    db.refresh(document, ["version", "chunk_count"])
     
-    def _extract_keywords(self, text: str) -> List[str]:
+    def _retrieve_snapshot(
+        self,
+        db: Session,
+        query: str,
+        keywords: List[str],
+        documents: List
+    ) -> List[RetrievedChunk]:
         """
-        Extract keywords from text (simple approach)
+        Retrieve from the documents' current versions (see ``retrieve_from_documents``)
+        
+        Raises:
+            DocumentVersionConflictError: If a document's stored version no
+                longer matches the model
+        """
+        documents = [document for document in documents if document.chunk_count]
+        if not documents:
+            return []
+        
+        cache_key = self._retrieval_cache_key(keywords, documents)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+        
+        k = self._candidate_count()
+        if self.retrieval_backend == "vector":
+            ranked = self._rank_vector(
+                query,
+                [document.chunk_count for document in documents],
+                self._get_ann(db, documents),
+                k
+            )
+        else:
+            ranked = self._rank_keyword(
+                keywords, [self._get_matrix(db, document) for document in documents], k
+            )
+        
+        versions = {document.id: document.version or 1 for document in documents}
+        texts = self._suppress_duplicates(self._load_chunks(
+            db, [(documents[position].id, chunk_id) for position, chunk_id in ranked], versions
+        ))
+        self.retrieval_cache.set(cache_key, tuple(texts))
+        return texts
+    
+    def invalidate_documents(self, document_ids: Iterable[int]) -> int:
+        """
+        Drop cached retrieval results involving any of the given documents
+        
+        Fingerprints already change with a document's version, so this only
+        frees memory held by results that can no longer be hit.
         
         Args:
-            text: Input text
+            document_ids: Ids of changed or deleted documents
         
         Returns:
-            List of keywords
+            Number of cached results removed
+        """
+        document_ids = set(document_ids)
+        return self.retrieval_cache.invalidate(
+            lambda key: any(entry[0] in document_ids for entry in key[2])
+        )
+    
+    def _retrieval_cache_key(self, keywords: List[str], documents: List) -> Tuple:
         """
-        # Convert to lowercase and remove punctuation
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
+        Build the retrieval cache key for a query against a document set
         
-        # Split into words
-        words = text.split()
+        BM25 ignores repeated query terms, so keyword retrieval keys on the
+        distinct terms; the vector backend weights repeats and keeps them.
+        """
+        if self.retrieval_backend == "vector":
+            terms = tuple(sorted(keywords))
+        else:
+            terms = tuple(sorted(set(keywords)))
+        return (self.retrieval_backend, terms, document_set_fingerprint(documents))
+    
+    def _candidate_count(self) -> int:
+        """Chunks to rank: extra candidates replace suppressed near-duplicates"""
+        return self.top_k * 2 if self.dedup_distance >= 0 else self.top_k
+    
+    def _suppress_duplicates(self, chunks: List[RetrievedChunk]) -> List[RetrievedChunk]:
+        """
+        Keep the best-ranked chunk of each near-duplicate group, up to top-K
         
-        # Remove common stop words (simple list)
-        stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-            'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'were', 'be',
-            'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will',
-            'would', 'could', 'should', 'may', 'might', 'can', 'this', 'that',
-            'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they'
+        Args:
+            chunks: Candidate chunks, best first
+        
+        Returns:
+            Up to top-K chunks, best first
+        """
+        if self.dedup_distance < 0:
+            return chunks[:self.top_k]
+        
+        kept, fingerprints = [], []
+        suppressed = 0
+        for chunk in chunks:
+            fingerprint = chunk.simhash if chunk.simhash is not None else simhash(chunk)
+            if any(
+                hamming_distance(fingerprint, other) <= self.dedup_distance
+                for other in fingerprints
+            ):
+                suppressed += 1
+                continue
+            kept.append(chunk)
+            fingerprints.append(fingerprint)
+            if len(kept) == self.top_k:
+                break
+        with _dedup_stats_lock:
+            dedup_stats["suppressed"] += suppressed
+            dedup_stats["retrieved"] += len(kept)
+        return kept
+    
+    def _load_chunks(
+        self,
+        db: Session,
+        keys: List[Tuple[int, int]],
+        versions: Dict[int, int]
+    ) -> List[RetrievedChunk]:
+        """
+        Load the text, token count and SimHash of selected chunks in one query
+        
+        Offset-only chunks are sliced out of the content by the database, so
+        only the selected chunks' text is ever transferred.
+        
+        Args:
+            db: Database session
+            keys: (document_id, chunk_index) pairs in result order
+            versions: Document version the keys were ranked against, by id
+        
+        Returns:
+            Chunks in the order of ``keys``
+        
+        Raises:
+            DocumentVersionConflictError: If a document has moved on
+        """
+        if not keys:
+            return []
+        rows = db.query(
+            DocumentChunk.document_id,
+            DocumentChunk.chunk_index,
+            CHUNK_TEXT.label("text"),
+            DocumentChunk.token_count,
+            DocumentChunk.simhash,
+            Document.version
+        ).join(
+            Document, Document.id == DocumentChunk.document_id
+        ).filter(
+            tuple_(DocumentChunk.document_id, DocumentChunk.chunk_index).in_(keys)
+        ).all()
+        for row in rows:
+            if (row.version or 1) != versions[row.document_id]:
+                raise DocumentVersionConflictError(row.document_id)
+        chunks = {
+            (row.document_id, row.chunk_index): RetrievedChunk(
+                row.text,
+                row.token_count,
+                from_signed(row.simhash) if row.simhash is not None else None
+            )
+            for row in rows
         }
+        return [chunks[key] for key in keys if key in chunks]
+    
+    def _chunk_dicts(self, document) -> List[Dict]:
+        """Load a document's chunks as dicts (fallback for missing indexes)"""
+        return [
+            {"index": row.chunk_index, "text": chunk_row_text(row, document.content)}
+            for row in document.chunks
+        ]
+    
+    def _get_matrix(self, db: Session, document) -> ChunkMatrix:
+        """
+        Return the cached chunk matrix for a document version, building it if needed
+        
+        Raises:
+            DocumentVersionConflictError: If the stored version has moved on
+        """
+        key = (document.id, document.version or 1)
+        matrix = self._cache_get(self._matrix_cache, key)
+        if matrix is not None:
+            return matrix
+        
+        matrix = self._open_index_file(document.id, key[1]) if self.index_dir else None
+        if matrix is None:
+            # Read the index together with its version so the cache key matches it
+            row = db.query(Document.term_index, Document.embeddings, Document.version).filter(
+                Document.id == document.id
+            ).one()
+            if (row.version or 1) != key[1]:
+                raise DocumentVersionConflictError(document.id)
+            index = row.term_index or self.build_index(self._chunk_dicts(document))
+            if self.index_dir:
+                try:
+                    matrix = self._write_index_file(db, document.id, key[1], index, row.embeddings)
+                except OSError:
+                    matrix = None  # e.g. read-only or full disk: keep serving from memory
+            if matrix is None:
+                matrix = ChunkMatrix.from_index(index)
+        self._cache_put(self._matrix_cache, key, matrix)
+        return matrix
+    
+    def _cache_get(self, cache: OrderedDict, key):
+        """Look up an entry of an LRU cache, marking it recently used (None if absent)"""
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+    
+    def _cache_put(self, cache: OrderedDict, key, value):
+        """Store an entry in an LRU cache, evicting the least recently used ones"""
+        with self._cache_lock:
+            cache[key] = value
+            while len(cache) > self.matrix_cache_size:
+                cache.popitem(last=False)
+    
+    def _open_index_file(self, document_id: int, version: int) -> Optional[MappedChunkMatrix]:
+        """
+        Map a document's index file if it exists and matches ``version``
+        
+        Raises:
+            DocumentVersionConflictError: If the file is already newer
+        """
+        try:
+            matrix = open_index_file(index_file_path(self.index_dir, document_id))
+        except (OSError, ValueError):
+            return None  # missing, or written by another format version: rebuild
+        if matrix.version > version:
+            raise DocumentVersionConflictError(document_id)
+        return matrix if matrix.version == version else None
+    
+    def _get_ann(self, db: Session, documents: List) -> IVFIndex:
+        """
+        Return the cached ANN index for a document set, building it if needed
         
-        keywords = [word for word in words if word not in stop_words and len(word) > 2]
-        return keywords
+        Raises:
+            DocumentVersionConflictError: If a stored version has moved on
+        """
+        # Ordered: ANN row ids map back to positions in ``documents``
+        key = tuple(
+            (document.id, document.version or 1, document.chunk_count) for document in documents
+        )
+        cached = self._cache_get(self._ann_cache, key)
+        if cached is not None:
+            return cached
+        
+        if self.index_dir:
+            # Mapped index files carry the vectors of their version
+            matrices = [self._get_matrix(db, document) for document in documents]
+            vectors = [getattr(matrix, "vectors", None) for matrix in matrices]
+            if all(vector is not None for vector in vectors):
+                return self._cache_ann(key, self._build_ann(np.vstack(vectors)))
+        
+        rows = db.query(Document.id, Document.embeddings, Document.version).filter(
+            Document.id.in_([document.id for document in documents])
+        ).all()
+        stored_versions = {row.id: row.version or 1 for row in rows}
+        embeddings = {row.id: row.embeddings for row in rows}
+        for document in documents:
+            if stored_versions.get(document.id) != (document.version or 1):
+                raise DocumentVersionConflictError(document.id)
+        
+        dim = self.embedder.dim
+        vectors = []
+        for document in documents:
+            stored = embeddings[document.id]
+            if stored and len(stored) == document.chunk_count * dim * 4:
+                vectors.append(vectors_from_bytes(stored, dim))
+            else:
+                texts = [chunk["text"] for chunk in self._chunk_dicts(document)]
+                vectors.append(self.embedder.embed(texts))
+        
+        return self._cache_ann(key, self._build_ann(np.vstack(vectors)))
+    
+    def _cache_ann(self, key: Tuple, ann: IVFIndex) -> IVFIndex:
+        """Store an ANN index, evicting the least recently used ones"""
+        self._cache_put(self._ann_cache, key, ann)
+        return ann
     
-    def _calculate_relevance_score(self, keywords: List[str], chunk: str) -> float:
+    def _build_ann(self, vectors: np.ndarray) -> IVFIndex:
+        """Build an IVF index with the configured search parameters"""
+        return IVFIndex(
+            vectors,
+            nprobe=settings.ANN_NPROBE,
+            min_ivf_size=settings.ANN_MIN_IVF_SIZE
+        )
+    
+    def _rank_vector(
+        self,
+        query: str,
+        chunk_counts: List[int],
+        ann: IVFIndex,
+        k: int
+    ) -> List[Tuple[int, int]]:
         """
-        Calculate relevance score using keyword matching
+        Rank chunks by embedding similarity to the query
         
         Args:
-            keywords: List of query keywords
-            chunk: Chunk text
+            query: User query
+            chunk_counts: Chunk count per document, in stacking order
+            ann: ANN index over the stacked chunk vectors
+            k: Number of chunks to return
         
         Returns:
-            Relevance score
+            Top-k (document position, chunk id) pairs, best first
+        """
+        offsets = np.cumsum([0] + list(chunk_counts))
+        rows, _ = ann.search(self.embedder.embed_query(query), k)
+        
+        ranked = []
+        for row in rows:
+            position = int(np.searchsorted(offsets, row, side="right")) - 1
+            ranked.append((position, int(row - offsets[position])))
+        return ranked
+    
+    def _rank_keyword(
+        self,
+        keywords: List[str],
+        matrices: List[ChunkMatrix],
+        k: int
+    ) -> List[Tuple[int, int]]:
         """
-        chunk_lower = chunk.lower()
+        Rank chunks by BM25, scoring the stacked corpus in one pass
+        
+        Chunks with no matching terms fill any remaining slots in document
+        order, so a query always gets up to k chunks of context. With
+        pruning enabled, MaxScore skips postings that cannot reach the
+        top-k; the result is identical either way. Corpora of at least two
+        ``RETRIEVAL_SHARD_CHUNKS`` shards are searched shard-parallel on the
+        retrieval pool, again with identical results.
         
-        # Count keyword occurrences
-        score = 0
-        for keyword in keywords:
-            score += chunk_lower.count(keyword)
+        Args:
+            keywords: Query keywords from ``_extract_keywords``
+            matrices: Per-document chunk matrices
+            k: Number of chunks to return
         
-        return score
+        Returns:
+            Top-k (document position, chunk id) pairs, best first
+        """
+        if sum(matrix.n_chunks for matrix in matrices) >= 2 * self.shard_chunks:
+            sharded = ShardedMatrix(matrices, self.shard_chunks)
+            rows = sharded.top_k(keywords, k, get_retrieval_pool(), self.pruning)
+            return [sharded.locate(row) for row in rows]
+        
+        stacked = StackedMatrix(matrices)
+        if self.pruning:
+            rows = stacked.top_k(keywords, k)
+        else:
+            rows = top_k_rows(stacked.score(keywords), k)
+        return [stacked.locate(row) for row in rows]
+    
+    def _extract_keywords(self, text: str) -> List[str]:
+        """
+        Extract keywords from text (simple approach)
+        
+        Args:
+            text: Input text
+        
+        Returns:
+            List of keywords
+        """
+        # Lowercase, strip punctuation and drop stop words / short words
+        return [word for word in tokenize(text) if is_index_term(word)]
     
-    def build_rag_prompt(self, query: str, retrieved_chunks: List[str]) -> str:
+    def pack_chunks(self, chunks: List[str], max_tokens: int) -> List[str]:
+        """
+        Select chunks, best first, that fit within a token budget
+        
+        Stored token counts (``RetrievedChunk.token_count``) are used when
+        available, so retrieved chunks are not re-tokenized. A chunk that
+        does not fit is skipped in favour of smaller lower-ranked ones.
+        
+        Args:
+            chunks: Chunks in rank order
+            max_tokens: Token budget, including one token per separator
+        
+        Returns:
+            Packed chunks, in rank order
+        """
+        packed = []
+        used = 0
+        for chunk in chunks:
+            cost = chunk_token_count(chunk) + (1 if packed else 0)
+            if used + cost <= max_tokens:
+                packed.append(chunk)
+                used += cost
+        return packed
+    
+    def build_rag_prompt(
+        self,
+        query: str,
+        retrieved_chunks: List[str],
+        max_tokens: Optional[int] = None
+    ) -> str:
         """
         Build system prompt with retrieved context
         
         Args:
             query: User query
-            retrieved_chunks: Retrieved document chunks
+            retrieved_chunks: Retrieved document chunks, best first
+            max_tokens: Token budget for the context (default from settings)
         
         Returns:
             System prompt with context
         """
-        context = "\n\n".join(retrieved_chunks)
+        if max_tokens is None:
+            max_tokens = self.context_token_budget
+        context = "\n\n".join(self.pack_chunks(retrieved_chunks, max_tokens))
         
         prompt = f"""You are a helpful AI assistant. Answer the user's question based on the following context from the provided documents.
 
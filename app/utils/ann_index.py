@@ -0,0 +1,103 @@
+"""
+Approximate nearest-neighbour search (inverted file index) in NumPy
+"""
+from typing import Tuple
+import numpy as np
+
+# Assign vectors to centroids in batches to bound the score matrix size
+_ASSIGN_BATCH = 65536
+
+
+class IVFIndex:
+    """
+    Inverted file (IVF) index for cosine similarity over unit vectors
+
+    Vectors are clustered with spherical k-means into ``sqrt(n)`` lists.
+    A query scores the centroids, then only the vectors in the ``nprobe``
+    closest lists, so search cost grows with ``sqrt(n)`` instead of ``n``.
+    Small collections are searched exactly.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        nprobe: int = 8,
+        min_ivf_size: int = 2048,
+        n_iter: int = 10,
+        seed: int = 0
+    ):
+        """
+        Args:
+            vectors: L2-normalized float32 matrix of shape (n, dim)
+            nprobe: Number of lists scanned per query
+            min_ivf_size: Below this many vectors, search exhaustively
+            n_iter: k-means iterations
+            seed: Random seed for centroid initialization
+        """
+        self.n = len(vectors)
+        self.nprobe = nprobe
+        self.centroids = None
+
+        if self.n < max(min_ivf_size, 1):
+            self.vectors = vectors
+            self.ids = np.arange(self.n)
+            return
+
+        n_lists = int(np.sqrt(self.n))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(self.n, size=min(self.n, 64 * n_lists), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            nonempty = norms[:, 0] > 0
+            centroids[nonempty] = sums[nonempty] / norms[nonempty]
+
+        assign = np.concatenate([
+            np.argmax(vectors[start:start + _ASSIGN_BATCH] @ centroids.T, axis=1)
+            for start in range(0, self.n, _ASSIGN_BATCH)
+        ])
+
+        # Store each list contiguously so a probe is a single slice
+        order = np.argsort(assign, kind="stable")
+        self.centroids = centroids
+        self.ids = order
+        self.vectors = vectors[order]
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=self.list_offsets[1:])
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the approximate top-k vectors by cosine similarity
+
+        Args:
+            query: L2-normalized query vector
+            k: Number of neighbours
+
+        Returns:
+            Tuple of (row ids, similarities) ordered best first
+        """
+        if self.n == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if self.centroids is None:
+            positions = np.arange(self.n)
+        else:
+            n_lists = len(self.centroids)
+            nprobe = min(self.nprobe, n_lists)
+            probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            positions = np.concatenate([
+                np.arange(self.list_offsets[p], self.list_offsets[p + 1]) for p in probe
+            ])
+
+        similarities = self.vectors[positions] @ query
+        if k < len(positions):
+            best = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            best = np.arange(len(positions))
+        best = best[np.lexsort((self.ids[positions[best]], -similarities[best]))]
+        return self.ids[positions[best]], similarities[best]
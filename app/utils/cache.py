@@ -0,0 +1,127 @@
+"""
+In-process caching utilities
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Roughly estimate the memory held by a value, in bytes
+
+    Follows tuples, lists, sets and dicts; other objects count with
+    ``sys.getsizeof``.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by estimated memory, with optional TTL
+
+    Entries are evicted least-recently-used first once their total
+    estimated size exceeds ``max_bytes``; values larger than the whole
+    budget are not cached. Expired entries are dropped on access.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_seconds: Optional[float] = None,
+        sizeof: Callable[[Any], int] = estimate_size
+    ):
+        """
+        Args:
+            max_bytes: Memory budget for keys and values
+            ttl_seconds: Entry lifetime (None: no expiry)
+            sizeof: Size estimator for keys and values
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Insert or replace an entry, evicting older entries as needed"""
+        size = self.sizeof(key) + self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Remove every entry whose key matches a predicate
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        """Remove all entries (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: Hashable):
+        """Drop an entry (lock must be held)"""
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
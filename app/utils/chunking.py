@@ -0,0 +1,304 @@
+"""
+Chunking utilities for splitting (possibly streamed) document text
+"""
+import re
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional
+
+_WORD_RE = re.compile(r'\S+')
+
+# End of a sentence (terminal punctuation plus closing quotes/brackets,
+# followed by whitespace) or a blank line between paragraphs
+_BOUNDARY_RE = re.compile(r'[.!?]+["\'\)\]]*(?=\s)|\n[ \t]*\n')
+
+
+class StreamingChunker:
+    """
+    Word-window chunker that accepts text incrementally
+
+    Produces the same chunks as splitting the full text on whitespace and
+    taking ``chunk_size``-word windows every ``chunk_size - chunk_overlap``
+    words, but only keeps the current window in memory. Each chunk carries
+    its character offsets into the full text, and its text is the original
+    slice between them (whitespace kept as written), so stored offsets
+    reproduce it exactly.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.step = chunk_size - chunk_overlap
+        self._window = deque()  # (word, start, end) for words not yet fully emitted
+        self._carry = ""  # trailing partial word from the previous piece
+        self._offset = 0  # character offset of the start of ``_carry``
+        self._buffer = ""  # document text from offset ``_base`` on
+        self._base = 0
+        self._index = 0
+
+    def resume(self, offset: int, index: int, overlap_end: Optional[int] = None):
+        """
+        Continue chunking a document from the start of an existing chunk
+
+        Call before feeding; text is then fed from ``offset`` on. Word
+        windows restart cleanly at any chunk start, so ``overlap_end`` is
+        not needed (it is accepted for parity with ``SentenceChunker``).
+
+        Args:
+            offset: Character offset of the chunk's start
+            index: Index to give the next chunk
+            overlap_end: End offset of the preceding chunk
+        """
+        self._offset = self._base = offset
+        self._index = index
+
+    def feed(self, text: str) -> Iterator[Dict]:
+        """
+        Add text and yield every chunk that is now complete
+
+        Args:
+            text: Next piece of the document
+
+        Yields:
+            Chunk dicts with 'index', 'text', 'start' and 'end'
+        """
+        self._buffer += text
+        text = self._carry + text
+        base = self._offset
+        matches = list(_WORD_RE.finditer(text))
+
+        # A word touching the end of the piece may continue in the next one
+        if matches and matches[-1].end() == len(text):
+            partial = matches.pop()
+            self._carry = partial.group()
+            self._offset = base + partial.start()
+        else:
+            self._carry = ""
+            self._offset = base + len(text)
+
+        for match in matches:
+            self._window.append((match.group(), base + match.start(), base + match.end()))
+            if len(self._window) == self.chunk_size:
+                yield self._emit()
+        self._trim()
+
+    def close(self) -> Iterator[Dict]:
+        """
+        Flush the remaining words at the end of the document
+
+        Yields:
+            The final chunk dicts
+        """
+        if self._carry:
+            self._window.append((self._carry, self._offset, self._offset + len(self._carry)))
+            self._offset += len(self._carry)
+            self._carry = ""
+        while self._window:
+            yield self._emit()
+        self._trim()
+
+    def _emit(self) -> Dict:
+        """Build a chunk from the window, then slide it forward by one step"""
+        words = list(self._window)[:self.chunk_size]
+        start, end = words[0][1], words[-1][2]
+        chunk = {
+            "index": self._index,
+            "text": self._buffer[start - self._base:end - self._base],
+            "start": start,
+            "end": end
+        }
+        self._index += 1
+        for _ in range(min(self.step, len(self._window))):
+            self._window.popleft()
+        return chunk
+
+    def _trim(self):
+        """Release buffered text no longer needed for chunk text"""
+        keep_from = self._window[0][1] if self._window else self._offset
+        if keep_from > self._base:
+            self._buffer = self._buffer[keep_from - self._base:]
+            self._base = keep_from
+
+
+class SentenceChunker:
+    """
+    Token-budget chunker that breaks only between sentences
+
+    Sentences are packed into chunks of up to ``max_tokens`` tokenizer
+    tokens (summed per sentence); a chunk also ends at a paragraph break
+    once it is at least half full. Consecutive chunks share trailing
+    sentences worth up to ``overlap_tokens``. A sentence longer than the
+    budget is split between words. Like ``StreamingChunker`` it accepts
+    text incrementally; chunk text is the original slice of the document,
+    and each chunk records its exact token count.
+    """
+
+    def __init__(self, max_tokens: int, overlap_tokens: int, count_tokens: Callable[[str], int]):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("chunk overlap must be smaller than the chunk size")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = count_tokens
+        self._buffer = ""  # document text from offset ``_base`` on
+        self._base = 0
+        self._scan = 0  # offset where the next sentence starts
+        self._window = deque()  # (start, end, tokens) of the current chunk's sentences
+        self._window_tokens = 0
+        self._fresh = 0  # sentences in the window not yet part of an emitted chunk
+        self._paragraph_break = False
+        self._overlap_end = None
+        self._index = 0
+
+    def resume(self, offset: int, index: int, overlap_end: Optional[int] = None):
+        """
+        Continue chunking a document from the start of an existing chunk
+
+        Call before feeding; text is then fed from ``offset`` on. Sentences
+        ending by ``overlap_end`` (the preceding chunk's end) are treated
+        as overlap carried from that chunk, which reproduces the state the
+        chunker had when it originally reached ``offset``.
+
+        Args:
+            offset: Character offset of the chunk's start
+            index: Index to give the next chunk
+            overlap_end: End offset of the preceding chunk
+        """
+        self._base = self._scan = offset
+        self._index = index
+        self._overlap_end = overlap_end
+
+    def feed(self, text: str) -> Iterator[Dict]:
+        """
+        Add text and yield every chunk that is now complete
+
+        Args:
+            text: Next piece of the document
+
+        Yields:
+            Chunk dicts with 'index', 'text', 'start', 'end' and 'token_count'
+        """
+        self._buffer += text
+        for match in _BOUNDARY_RE.finditer(self._buffer, self._scan - self._base):
+            paragraph = match.group().startswith("\n")
+            end = self._base + (match.start() if paragraph else match.end())
+            yield from self._add_sentence(self._scan, end)
+            self._scan = self._base + match.end()
+            self._paragraph_break = self._paragraph_break or paragraph
+        self._trim()
+
+    def close(self) -> Iterator[Dict]:
+        """
+        Flush the last sentence and chunk at the end of the document
+
+        Yields:
+            The final chunk dicts
+        """
+        yield from self._add_sentence(self._scan, self._base + len(self._buffer))
+        if self._fresh:
+            yield self._emit()
+        self._scan = self._base + len(self._buffer)
+        self._window.clear()
+        self._window_tokens = 0
+        self._trim()
+
+    def _add_sentence(self, start: int, end: int) -> Iterator[Dict]:
+        """Add the sentence in ``[start, end)``, splitting it if oversized"""
+        segment = self._buffer[start - self._base:end - self._base]
+        stripped = segment.strip()
+        if not stripped:
+            return
+        start += len(segment) - len(segment.lstrip())
+        end = start + len(stripped)
+
+        tokens = self.count_tokens(stripped)
+        if tokens <= self.max_tokens:
+            yield from self._push(start, end, tokens)
+            return
+
+        # Oversized sentence: greedy runs of whole words
+        piece_start, piece_end, piece_tokens = None, None, 0
+        for match in _WORD_RE.finditer(stripped):
+            word_tokens = self.count_tokens(match.group())
+            if piece_start is not None and piece_tokens + word_tokens > self.max_tokens:
+                yield from self._push(piece_start, piece_end, piece_tokens)
+                piece_start, piece_tokens = None, 0
+            if piece_start is None:
+                piece_start = start + match.start()
+            piece_end = start + match.end()
+            piece_tokens += word_tokens
+        yield from self._push(piece_start, piece_end, piece_tokens)
+
+    def _push(self, start: int, end: int, tokens: int) -> Iterator[Dict]:
+        """Append a sentence to the window, emitting a chunk first if it is full"""
+        if self._overlap_end is not None and end <= self._overlap_end:
+            self._window.append((start, end, tokens))
+            self._window_tokens += tokens
+            self._paragraph_break = False
+            return
+        if self._fresh and (
+            self._window_tokens + tokens > self.max_tokens
+            or (self._paragraph_break and 2 * self._window_tokens >= self.max_tokens)
+        ):
+            yield self._emit()
+        self._paragraph_break = False
+
+        # Overlap sentences give way when they leave no room
+        while self._window and self._window_tokens + tokens > self.max_tokens:
+            self._window_tokens -= self._window.popleft()[2]
+        self._window.append((start, end, tokens))
+        self._window_tokens += tokens
+        self._fresh += 1
+
+    def _emit(self) -> Dict:
+        """Build a chunk from the window, keeping trailing sentences as overlap"""
+        start, end = self._window[0][0], self._window[-1][1]
+        text = self._buffer[start - self._base:end - self._base]
+        chunk = {
+            "index": self._index,
+            "text": text,
+            "start": start,
+            "end": end,
+            "token_count": self.count_tokens(text)
+        }
+        self._index += 1
+        self._fresh = 0
+
+        overlap = deque()
+        overlap_tokens = 0
+        for sentence in reversed(self._window):
+            if overlap_tokens + sentence[2] > self.overlap_tokens:
+                break
+            overlap.appendleft(sentence)
+            overlap_tokens += sentence[2]
+        self._window, self._window_tokens = overlap, overlap_tokens
+        return chunk
+
+    def _trim(self):
+        """Release buffered text no longer needed for chunk text"""
+        keep_from = self._window[0][0] if self._window else self._scan
+        if keep_from > self._base:
+            self._buffer = self._buffer[keep_from - self._base:]
+            self._base = keep_from
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences at the same boundaries ``SentenceChunker`` uses
+
+    Args:
+        text: Input text
+
+    Returns:
+        Non-empty, stripped sentences in order
+    """
+    sentences = []
+    start = 0
+    for match in _BOUNDARY_RE.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
@@ -1,15 +1,18 @@
 """
 Context management utilities for handling LLM token limits
 """
-import tiktoken
 from typing import List, Dict
 from app.config import settings
+from app.utils.tokenizer import DEFAULT_MODEL, get_token_counter
 
 
-def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
     """
     Count tokens in a text string using tiktoken
     
+    The encoder is resolved once per model and counts are cached by
+    content hash (see ``app.utils.tokenizer``).
+    
     Args:
         text: Text to count tokens for
         model: Model name for tokenizer (default: gpt-3.5-turbo)
@@ -17,17 +20,25 @@ def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
     Returns:
         Number of tokens
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        # Fallback to cl100k_base encoding for unknown models
-        encoding = tiktoken.get_encoding("cl100k_base")
+    return get_token_counter(model).count(text)
+
+
+def count_tokens_batch(texts: List[str], model: str = DEFAULT_MODEL) -> List[int]:
+    """
+    Count tokens in many texts at once, encoding uncached ones in threads
+    
+    Args:
+        texts: Texts to count tokens for
+        model: Model name for tokenizer (default: gpt-3.5-turbo)
     
-    return len(encoding.encode(text))
+    Returns:
+        Token counts in the order of ``texts``
+    """
+    return get_token_counter(model).count_batch(texts)
 
 
 def build_context_window(
-    messages: List[Dict[str, str]],
+    messages: List[Dict],
     system_prompt: str,
     max_tokens: int = None
 ) -> List[Dict[str, str]]:
@@ -35,36 +46,39 @@ def build_context_window(
     Build context window with sliding window strategy
     
     Keeps the most recent messages that fit within token budget.
-    Always includes system prompt.
+    Always includes system prompt. Messages carrying a stored 'tokens'
+    count are not re-tokenized.
     
     Args:
-        messages: List of message dicts with 'role' and 'content'
+        messages: List of message dicts with 'role', 'content' and
+            optionally 'tokens'
         system_prompt: System prompt to always include
         max_tokens: Maximum tokens allowed (default from settings)
     
     Returns:
-        List of messages that fit within token budget
+        List of messages ('role' and 'content') that fit within token budget
     """
     if max_tokens is None:
         max_tokens = settings.MAX_CONTEXT_TOKENS
     
-    # Start with system prompt
-    context = [{"role": "system", "content": system_prompt}]
     total_tokens = count_tokens(system_prompt)
     
     # Add messages from newest to oldest
+    selected = []
     for msg in reversed(messages):
-        msg_tokens = count_tokens(msg["content"])
+        msg_tokens = msg.get("tokens")
+        if msg_tokens is None:
+            msg_tokens = count_tokens(msg["content"])
         
         # Check if adding this message would exceed limit
         if total_tokens + msg_tokens > max_tokens:
             break
         
-        # Insert after system prompt (to maintain chronological order)
-        context.insert(1, msg)
+        selected.append({"role": msg["role"], "content": msg["content"]})
         total_tokens += msg_tokens
     
-    return context
+    # System prompt first, then the kept messages in chronological order
+    return [{"role": "system", "content": system_prompt}] + selected[::-1]
 
 
 def truncate_context(
@@ -0,0 +1,97 @@
+"""
+Offline text embeddings using feature hashing and sparse random projection
+"""
+import hashlib
+from collections import Counter
+from functools import lru_cache
+from typing import List, Tuple
+import numpy as np
+from app.utils.inverted_index import tokenize, is_index_term
+
+# Non-zero entries per token in the (implicit) random projection matrix
+PROJECTION_DENSITY = 4
+
+
+@lru_cache(maxsize=200000)
+def _token_projection(token: str, dim: int, seed: int) -> Tuple[Tuple[int, ...], Tuple[float, ...]]:
+    """
+    Return the token's row of the random projection matrix
+
+    The row is derived from a keyed hash of the token, so the matrix never
+    has to be materialized and identical tokens always land on the same
+    dimensions with the same signs.
+    """
+    digest = hashlib.blake2b(
+        token.encode("utf-8"),
+        digest_size=4 * PROJECTION_DENSITY,
+        key=seed.to_bytes(8, "little")
+    ).digest()
+    dims, signs = [], []
+    for i in range(PROJECTION_DENSITY):
+        value = int.from_bytes(digest[4 * i:4 * i + 4], "little")
+        dims.append((value >> 1) % dim)
+        signs.append(1.0 if value & 1 else -1.0)
+    return tuple(dims), tuple(signs)
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder that needs no model or network"""
+
+    def __init__(self, dim: int = 256, seed: int = 0):
+        """
+        Args:
+            dim: Output vector dimension
+            seed: Hash key; vectors are only comparable for the same seed
+        """
+        self.dim = dim
+        self.seed = seed
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts into L2-normalized float32 vectors
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Array of shape (len(texts), dim)
+        """
+        # Collect (row, token, weight) triples, then scatter them all at once
+        rows, dims, signs, tfs = [], [], [], []
+        for row, text in enumerate(texts):
+            counts = Counter(token for token in tokenize(text) if is_index_term(token))
+            for token, tf in counts.items():
+                token_dims, token_signs = _token_projection(token, self.dim, self.seed)
+                rows.append(row)
+                dims.append(token_dims)
+                signs.append(token_signs)
+                tfs.append(tf)
+
+        flat = np.zeros(len(texts) * self.dim, dtype=np.float64)
+        if rows:
+            positions = np.asarray(rows)[:, None] * self.dim + np.asarray(dims)
+            weights = 1.0 + np.log(np.asarray(tfs, dtype=np.float64))
+            flat = np.bincount(
+                positions.ravel(),
+                weights=(np.asarray(signs) * weights[:, None]).ravel(),
+                minlength=len(texts) * self.dim
+            )
+        vectors = flat.reshape(len(texts), self.dim).astype(np.float32)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query into a 1-D vector"""
+        return self.embed([text])[0]
+
+
+def vectors_to_bytes(vectors: np.ndarray) -> bytes:
+    """Serialize a float32 matrix for storage"""
+    return np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+
+
+def vectors_from_bytes(data: bytes, dim: int) -> np.ndarray:
+    """Deserialize a float32 matrix stored by ``vectors_to_bytes``"""
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, dim)
@@ -22,6 +22,15 @@ class DocumentNotFoundError(HTTPException):
         )
 
 
+class DocumentVersionConflictError(HTTPException):
+    """Raised when a document changed since the version the caller saw"""
+    def __init__(self, document_id: int):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Document with id {document_id} was modified concurrently; retry"
+        )
+
+
 class LLMAPIError(HTTPException):
     """Raised when LLM API call fails"""
     def __init__(self, message: str = "LLM API request failed"):
@@ -38,3 +47,25 @@ class InvalidModeError(HTTPException):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Invalid conversation mode: {mode}. Must be 'open' or 'rag'"
         )
+
+
+class PromptTooLargeError(HTTPException):
+    """Raised when the mandatory part of a prompt leaves no room for a response"""
+    def __init__(self, prompt_tokens: int, window: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=(
+                f"System prompt needs {prompt_tokens} tokens; the model's "
+                f"{window}-token window leaves too little for a response"
+            )
+        )
+
+
+class ProviderUnavailableError(HTTPException):
+    """Raised when the LLM provider is known to be down or saturated, without calling it"""
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="LLM provider is unavailable; retry later",
+            headers={"Retry-After": str(max(int(retry_after + 0.999), 1))}
+        )
@@ -0,0 +1,271 @@
+"""
+Memory-mapped binary retrieval index files
+
+One file per document holds its term dictionary, postings, chunk offsets
+and (optionally) chunk vectors in a flat layout that is read through a
+read-only ``mmap`` without copying. Every worker process that opens the
+file shares the same page-cache pages instead of building its own
+matrices from the JSON index.
+
+Layout (little-endian):
+    header      ``_HEADER``: magic, format version, integer widths, counts
+    sections    ``len(_SECTIONS)`` x (offset, length) pairs, in bytes
+    data        each section aligned to 8 bytes:
+        term_offsets    uint32[n_terms + 1], into term_blob
+        term_blob       UTF-8 terms, sorted bytewise
+        indptr          int64[n_terms + 1], column bounds in chunk_ids / tfs
+        chunk_ids       uint{8,16,32}[nnz], delta-encoded within each column
+        tfs             uint{8,16,32}[nnz]
+        max_tfs         float32[n_terms]
+        min_lengths     float32[n_terms]
+        doc_lengths     float32[n_chunks]
+        chunk_offsets   int64[n_chunks, 2], (start, end) or -1 if unknown
+        vectors         float32[n_chunks, dim], absent when dim is 0
+"""
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+import numpy as np
+from app.utils.sparse_scoring import ChunkMatrix
+
+MAGIC = b"BGPTIDX\0"
+FORMAT_VERSION = 1
+
+# magic, format version, chunk id width, tf width, n_terms, n_chunks, nnz,
+# total chunk length, vector dim, document version
+_HEADER = struct.Struct("<8sHBBIIQdIq")
+_SECTION = struct.Struct("<QQ")
+_SECTIONS = (
+    "term_offsets", "term_blob", "indptr", "chunk_ids", "tfs",
+    "max_tfs", "min_lengths", "doc_lengths", "chunk_offsets", "vectors"
+)
+_ALIGN = 8
+
+
+def _uint_dtype(max_value: int) -> np.dtype:
+    """Narrowest unsigned dtype holding ``max_value``"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"Value {max_value} does not fit in 32 bits")
+
+
+def write_index_file(
+    path: str,
+    index: Dict,
+    version: int,
+    offsets: Optional[Sequence[Tuple[Optional[int], Optional[int]]]] = None,
+    vectors: Optional[np.ndarray] = None
+):
+    """
+    Write a document's index file, atomically replacing any existing one
+
+    The file is written under a temporary name in the same directory and
+    moved into place with ``os.replace``, so readers see the old or the
+    new file, never a partial one; processes that already mapped the old
+    file keep reading it until they reopen.
+
+    Args:
+        path: Destination path
+        index: Inverted index (see ``build_index``)
+        version: Document version the index belongs to
+        offsets: (start, end) character offsets per chunk
+        vectors: float32 chunk vectors, one row per chunk
+    """
+    entries = sorted(
+        ((term.encode("utf-8"), entry) for term, entry in index["postings"].items()),
+        key=lambda item: item[0]
+    )
+    terms = [term for term, _ in entries]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+    np.cumsum([len(term) for term in terms], out=term_offsets[1:])
+
+    indptr = np.zeros(len(entries) + 1, dtype=np.int64)
+    np.cumsum([len(entry[0]) for _, entry in entries], out=indptr[1:])
+    chunk_ids = np.fromiter(
+        (chunk_id for _, entry in entries for chunk_id in entry[0]), dtype=np.int64, count=int(indptr[-1])
+    )
+    tfs = np.fromiter((tf for _, entry in entries for tf in entry[1]), dtype=np.int64, count=len(chunk_ids))
+    doc_lengths = np.asarray(index["doc_lengths"], dtype=np.float32)
+
+    # Chunk ids ascend within a column: store the first, then the gaps
+    starts = indptr[:-1]
+    deltas = np.diff(chunk_ids, prepend=0)
+    if len(chunk_ids):
+        deltas[starts] = chunk_ids[starts]
+        max_tfs = np.maximum.reduceat(tfs, starts).astype(np.float32)
+        min_lengths = np.minimum.reduceat(doc_lengths[chunk_ids], starts)
+    else:
+        max_tfs = min_lengths = np.zeros(0, dtype=np.float32)
+
+    n_chunks = len(doc_lengths)
+    chunk_offsets = np.full((n_chunks, 2), -1, dtype=np.int64)
+    if offsets is not None:
+        for row, (start, end) in enumerate(offsets):
+            if start is not None and end is not None:
+                chunk_offsets[row] = (start, end)
+    if vectors is None:
+        vectors = np.zeros((n_chunks, 0), dtype=np.float32)
+
+    id_dtype = _uint_dtype(int(deltas.max()) if len(deltas) else 0)
+    tf_dtype = _uint_dtype(int(tfs.max()) if len(tfs) else 0)
+    sections = [
+        term_offsets, b"".join(terms), indptr, deltas.astype(id_dtype), tfs.astype(tf_dtype),
+        max_tfs, min_lengths, doc_lengths, chunk_offsets, np.ascontiguousarray(vectors, dtype=np.float32)
+    ]
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, id_dtype.itemsize, tf_dtype.itemsize, len(terms), n_chunks,
+        len(chunk_ids), float(doc_lengths.sum(dtype=np.float64)), vectors.shape[1], version
+    )
+    position = -(-(len(header) + _SECTION.size * len(_SECTIONS)) // _ALIGN) * _ALIGN
+    table = []
+    for section in sections:
+        length = len(section) if isinstance(section, bytes) else section.nbytes
+        table.append((position, length))
+        position = -(-(position + length) // _ALIGN) * _ALIGN
+
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fileobj:
+            fileobj.write(header)
+            for offset, length in table:
+                fileobj.write(_SECTION.pack(offset, length))
+            for section, (offset, _) in zip(sections, table):
+                fileobj.write(b"\0" * (offset - fileobj.tell()))
+                fileobj.write(section if isinstance(section, bytes) else section.tobytes())
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TermDictionary(Mapping):
+    """
+    Read-only term -> column mapping over a file's sorted term table
+
+    Lookups binary-search the mapped bytes, so opening a file does not
+    build a Python dict of its vocabulary.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def _term(self, col: int) -> bytes:
+        return bytes(self._blob[self._offsets[col]:self._offsets[col + 1]])
+
+    def __getitem__(self, term: str) -> int:
+        key = term.encode("utf-8")
+        col = bisect_left(range(len(self)), key, key=self._term)
+        if col == len(self) or self._term(col) != key:
+            raise KeyError(term)
+        return col
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __iter__(self) -> Iterator[str]:
+        for col in range(len(self)):
+            yield self._term(col).decode("utf-8")
+
+
+class MappedChunkMatrix(ChunkMatrix):
+    """
+    ``ChunkMatrix`` whose arrays are views into a mapped index file
+
+    ``chunk_ids`` holds the delta-encoded postings; columns are decoded on
+    access, so only the query's terms are ever expanded.
+    """
+
+    __slots__ = ("version", "chunk_offsets", "vectors", "file_size")
+
+    def column_at(self, col: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (chunk_ids, tfs) of a column, decoding its deltas"""
+        start, end = self.indptr[col], self.indptr[col + 1]
+        return np.cumsum(self.chunk_ids[start:end], dtype=np.int32), self.tfs[start:end].astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the mapped file (shared between processes)"""
+        return self.file_size
+
+
+def open_index_file(path: str) -> MappedChunkMatrix:
+    """
+    Map an index file read-only
+
+    Args:
+        path: Index file path
+
+    Returns:
+        Matrix backed by the mapping; its ``version`` is the document
+        version the file was written for
+
+    Raises:
+        OSError: If the file cannot be opened
+        ValueError: If it is not an index file of a supported format version
+    """
+    with open(path, "rb") as fileobj:
+        buffer = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buffer) < _HEADER.size + _SECTION.size * len(_SECTIONS):
+        raise ValueError(f"{path}: truncated index file")
+    (
+        magic, format_version, id_width, tf_width, n_terms, n_chunks,
+        nnz, total_length, dim, version
+    ) = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not an index file")
+    if format_version != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported index format version {format_version}")
+
+    table = {}
+    for i, name in enumerate(_SECTIONS):
+        offset, length = _SECTION.unpack_from(buffer, _HEADER.size + i * _SECTION.size)
+        if offset + length > len(buffer):
+            raise ValueError(f"{path}: truncated index file")
+        table[name] = (offset, length)
+
+    def section(name: str, dtype, shape) -> np.ndarray:
+        offset, length = table[name]
+        count = int(np.prod(shape))
+        if length != count * np.dtype(dtype).itemsize:
+            raise ValueError(f"{path}: corrupt section {name}")
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+    id_dtype = np.dtype(f"<u{id_width}")
+    tf_dtype = np.dtype(f"<u{tf_width}")
+    blob_offset, blob_length = table["term_blob"]
+
+    matrix = MappedChunkMatrix.__new__(MappedChunkMatrix)
+    matrix.columns = TermDictionary(
+        section("term_offsets", np.uint32, (n_terms + 1,)),
+        memoryview(buffer)[blob_offset:blob_offset + blob_length]
+    )
+    matrix.indptr = section("indptr", np.int64, (n_terms + 1,))
+    matrix.chunk_ids = section("chunk_ids", id_dtype, (nnz,))
+    matrix.tfs = section("tfs", tf_dtype, (nnz,))
+    matrix.max_tfs = section("max_tfs", np.float32, (n_terms,))
+    matrix.min_lengths = section("min_lengths", np.float32, (n_terms,))
+    matrix.doc_lengths = section("doc_lengths", np.float32, (n_chunks,))
+    matrix.n_chunks = n_chunks
+    matrix.total_length = total_length
+    matrix.chunk_offsets = section("chunk_offsets", np.int64, (n_chunks, 2))
+    matrix.vectors = section("vectors", np.float32, (n_chunks, dim)) if dim else None
+    matrix.version = version
+    matrix.file_size = len(buffer)
+    return matrix
+
+
+def index_file_path(directory: str, document_id: int) -> str:
+    """Path of a document's index file"""
+    return os.path.join(directory, f"document-{document_id}.idx")
@@ -0,0 +1,155 @@
+"""
+Inverted index utilities for BM25 keyword retrieval
+"""
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import List, Dict, Iterable
+
+# BM25 parameters (standard Okapi defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Common stop words (never indexed, never queried)
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'were', 'be',
+    'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will',
+    'would', 'could', 'should', 'may', 'might', 'can', 'this', 'that',
+    'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
+    'what', 'how', 'why', 'when', 'where', 'which', 'who'
+})
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Normalize text into whole-word tokens
+
+    Args:
+        text: Input text
+
+    Returns:
+        List of lowercase tokens with punctuation removed
+    """
+    return _PUNCTUATION_RE.sub('', text.lower()).split()
+
+
+def is_index_term(token: str) -> bool:
+    """Return True if a token is worth indexing/querying"""
+    return len(token) > 2 and token not in STOP_WORDS
+
+
+class IndexBuilder:
+    """
+    Incrementally build an inverted index, one chunk at a time
+
+    Postings are accumulated in compact ``array`` buffers (4 bytes per
+    entry instead of a boxed int); the ``CompactJSON`` column type in
+    ``app.models.types`` writes them out as plain lists.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, List[array]] = {}
+        self.doc_lengths = array('I')
+
+    def add(self, text: str) -> int:
+        """
+        Index the next chunk
+
+        Args:
+            text: Chunk text
+
+        Returns:
+            The chunk id assigned to the text
+        """
+        chunk_id = len(self.doc_lengths)
+        tokens = tokenize(text)
+        self.doc_lengths.append(len(tokens))
+
+        term_counts = Counter(token for token in tokens if is_index_term(token))
+        for term, tf in term_counts.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = [array('I'), array('I')]
+            entry[0].append(chunk_id)
+            entry[1].append(tf)
+        return chunk_id
+
+    def build(self) -> Dict:
+        """Return the JSON-serializable index (see ``build_index``)"""
+        return {
+            "chunk_count": len(self.doc_lengths),
+            "doc_lengths": self.doc_lengths,
+            "total_length": sum(self.doc_lengths),
+            "postings": self.postings
+        }
+
+
+def build_index(texts: Iterable[str]) -> Dict:
+    """
+    Build an inverted index over a document's chunks
+
+    The index is JSON-serializable so it can be persisted alongside
+    the document. Postings are stored column-wise per term as
+    ``[[chunk_ids...], [term_frequencies...]]`` in ascending chunk order.
+
+    Args:
+        texts: Chunk texts in chunk-index order
+
+    Returns:
+        Index dict with postings and chunk length statistics
+    """
+    builder = IndexBuilder()
+    for text in texts:
+        builder.add(text)
+    return builder.build()
+
+
+def patch_index(index: Dict, start: int, stop: int, texts: Iterable[str]) -> Dict:
+    """
+    Replace a run of chunks in an index without re-tokenizing the others
+
+    Chunks ``start:stop`` are removed, ``texts`` are indexed in their
+    place, and later chunk ids shift by the difference in length. The
+    result equals ``build_index`` over the patched chunk list.
+
+    Args:
+        index: Index produced by ``build_index`` (not modified)
+        start: First replaced chunk id
+        stop: Chunk id after the last replaced one
+        texts: Replacement chunk texts
+
+    Returns:
+        The patched index
+    """
+    inserted = build_index(texts)
+    shift = inserted["chunk_count"] - (stop - start)
+    new_postings = inserted["postings"]
+
+    postings = {}
+    for term in set(index["postings"]) | set(new_postings):
+        ids, tfs = index["postings"].get(term, ((), ()))
+        lo, hi = bisect_left(ids, start), bisect_left(ids, stop)
+        patched_ids = array('I', ids[:lo])
+        patched_tfs = array('I', tfs[:lo])
+        if term in new_postings:
+            patched_ids.extend(chunk_id + start for chunk_id in new_postings[term][0])
+            patched_tfs.extend(new_postings[term][1])
+        patched_ids.extend(chunk_id + shift for chunk_id in ids[hi:])
+        patched_tfs.extend(tfs[hi:])
+        if patched_ids:
+            postings[term] = [patched_ids, patched_tfs]
+
+    doc_lengths = array('I', index["doc_lengths"][:start])
+    doc_lengths.extend(inserted["doc_lengths"])
+    doc_lengths.extend(index["doc_lengths"][stop:])
+    return {
+        "chunk_count": len(doc_lengths),
+        "doc_lengths": doc_lengths,
+        "total_length": sum(doc_lengths),
+        "postings": postings
+    }
+
@@ -0,0 +1,298 @@
+"""
+Client-side rate governor: keeps provider calls within requests-per-minute
+and tokens-per-minute limits, queueing calls by priority instead of
+sending ones the provider would reject
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.utils.error_handler import ProviderUnavailableError
+
+# Priorities, most urgent first (see ``RateGovernor``)
+INTERACTIVE = "interactive"  # a user waiting on a chat turn
+TITLE = "title"  # conversation title generation
+SUMMARY = "summary"  # history summarization
+BATCH = "batch"  # offline and bulk jobs
+PRIORITIES = (INTERACTIVE, TITLE, SUMMARY, BATCH)
+
+
+class TokenBucket:
+    """
+    A per-minute budget refilled continuously
+
+    Holds at most a minute's worth (``per_minute``) and starts full, like
+    a provider's rolling one-minute window. The level can go below zero
+    when usage turns out higher than was taken up front.
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        Args:
+            per_minute: Refill rate and capacity (0 means unlimited)
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def limited(self) -> bool:
+        return self.capacity > 0
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """Time until ``amount`` is available (0 if it is now; call after ``refill``)"""
+        if not self.limited or self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.limited:
+            self.level -= amount
+
+    def give(self, amount: float):
+        if self.limited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    """A call queued for admission, woken by whichever thread changes the queue"""
+
+    def __init__(self, priority: str, tokens: int, loop: Optional[asyncio.AbstractEventLoop]):
+        self.priority = priority
+        self.tokens = tokens
+        self.loop = loop
+        self.event = threading.Event() if loop is None else asyncio.Event()
+        self.granted = False
+        self.cancelled = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class RateGovernor:
+    """
+    Admit provider calls within RPM and TPM budgets, shared by threads and
+    event loops
+
+    Each call takes one request and its estimated prompt tokens from two
+    token buckets; the tokens are corrected with ``settle`` once the
+    provider reports the actual usage. A call that does not fit waits in a
+    priority queue: the most urgent priority goes first, first come first
+    served within a priority, and a later small call does not slip past a
+    large one waiting for the token budget to refill. Calls that wait
+    longer than ``queue_timeout`` fail with 503.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, queue_timeout: float = 30.0):
+        """
+        Args:
+            requests_per_minute: Request budget (0 means unlimited)
+            tokens_per_minute: Token budget (0 means unlimited)
+            queue_timeout: Longest wait for admission, in seconds
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.queue_timeout = queue_timeout
+        self._queue = []  # heap of (priority rank, arrival, waiter)
+        self._arrivals = itertools.count()
+        self._head: Optional[_Waiter] = None
+        self._lock = threading.Lock()
+        self._counts = {
+            priority: {"admitted": 0, "timeouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for priority in PRIORITIES
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests.limited or self.tokens.limited
+
+    def acquire(self, tokens: int, priority: str = INTERACTIVE):
+        """
+        Wait (blocking) until a call with ``tokens`` estimated prompt tokens fits the budgets
+
+        Raises:
+            ProviderUnavailableError: If it is not admitted within ``queue_timeout``
+        """
+        if not self.enabled:
+            return
+        waiter, deadline = self._enqueue(tokens, priority, None)
+        started = time.monotonic()
+        try:
+            while True:
+                timeout = self._next_wait(waiter, deadline)
+                if timeout is None:
+                    break
+                waiter.event.wait(timeout)
+                self._dispatch()
+        except BaseException:
+            self._leave(waiter)
+            raise
+        self._record_wait(priority, time.monotonic() - started)
+
+    async def aacquire(self, tokens: int, priority: str = INTERACTIVE):
+        """Wait for admission without blocking the event loop (raises like ``acquire``)"""
+        if not self.enabled:
+            return
+        waiter, deadline = self._enqueue(tokens, priority, asyncio.get_running_loop())
+        started = time.monotonic()
+        try:
+            while True:
+                timeout = self._next_wait(waiter, deadline)
+                if timeout is None:
+                    break
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._dispatch()
+        except BaseException:
+            self._leave(waiter)  # also when cancelled, e.g. the client went away
+            raise
+        self._record_wait(priority, time.monotonic() - started)
+
+    def settle(self, estimated: int, actual: int):
+        """Correct the token budget once a call's actual usage is known"""
+        if not self.tokens.limited or actual == estimated:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            if actual > estimated:
+                self.tokens.take(actual - estimated)
+            else:
+                self.tokens.give(estimated - actual)
+        self._dispatch()
+
+    def refund(self, tokens: int):
+        """Give back the budget of an admitted call that was not sent after all"""
+        if not self.enabled:
+            return
+        if self.tokens.limited:
+            tokens = min(tokens, int(self.tokens.capacity))
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self.requests.give(1)
+            self.tokens.give(tokens)
+        self._dispatch()
+
+    def _enqueue(self, tokens: int, priority: str, loop) -> tuple[_Waiter, float]:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority: {priority}. Must be one of {PRIORITIES}")
+        # A request larger than the whole budget would never fit: it waits for a full bucket
+        if self.tokens.limited:
+            tokens = min(tokens, int(self.tokens.capacity))
+        waiter = _Waiter(priority, tokens, loop)
+        with self._lock:
+            heapq.heappush(self._queue, (PRIORITIES.index(priority), next(self._arrivals), waiter))
+        self._dispatch()
+        return waiter, time.monotonic() + self.queue_timeout
+
+    def _next_wait(self, waiter: _Waiter, deadline: float) -> Optional[float]:
+        """
+        Seconds to wait before checking again (None: admitted)
+
+        The head of the queue sleeps until the budgets refill enough for
+        it; the others sleep until they are woken (admitted, or promoted
+        to the head) or time out.
+
+        Raises:
+            ProviderUnavailableError: If the deadline has passed
+        """
+        with self._lock:
+            if waiter.granted:
+                return None
+            now = time.monotonic()
+            if now >= deadline:
+                waiter.cancelled = True
+                self._counts[waiter.priority]["timeouts"] += 1
+                retry_after = self._seconds_until(waiter, now)
+                timed_out = True
+            else:
+                timed_out = False
+                waiter.event.clear()
+                timeout = deadline - now
+                if waiter is self._head:
+                    timeout = min(timeout, self._seconds_until(waiter, now))
+        if timed_out:
+            self._dispatch()  # a timed-out head lets the next in line move up
+            raise ProviderUnavailableError(max(retry_after, 1.0))
+        return timeout
+
+    def _seconds_until(self, waiter: _Waiter, now: float) -> float:
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.seconds_until(1), self.tokens.seconds_until(waiter.tokens))
+
+    def _dispatch(self):
+        """Admit queued calls in order while the budgets allow; wake a new head"""
+        with self._lock:
+            now = time.monotonic()
+            while self._queue:
+                waiter = self._queue[0][2]
+                if waiter.cancelled:
+                    heapq.heappop(self._queue)
+                    continue
+                if self._seconds_until(waiter, now) > 0:
+                    if waiter is not self._head:
+                        self._head = waiter
+                        waiter.wake()  # to sleep until the budgets have room for it
+                    return
+                heapq.heappop(self._queue)
+                self.requests.take(1)
+                self.tokens.take(waiter.tokens)
+                waiter.granted = True
+                waiter.wake()
+            self._head = None
+
+    def _leave(self, waiter: _Waiter):
+        """Drop a waiter that gave up, returning its budget if it was admitted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                self.requests.give(1)
+                self.tokens.give(waiter.tokens)
+            waiter.cancelled = True
+        self._dispatch()
+
+    def _record_wait(self, priority: str, seconds: float):
+        with self._lock:
+            counts = self._counts[priority]
+            counts["admitted"] += 1
+            counts["wait_seconds"] += seconds
+            counts["max_wait_seconds"] = max(counts["max_wait_seconds"], seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            depth = {priority: 0 for priority in PRIORITIES}
+            for _, _, waiter in self._queue:
+                if not waiter.cancelled and not waiter.granted:
+                    depth[waiter.priority] += 1
+            return {
+                "requests_available": round(self.requests.level, 1) if self.requests.limited else None,
+                "tokens_available": round(self.tokens.level) if self.tokens.limited else None,
+                "queue_depth": sum(depth.values()),
+                "priorities": {
+                    priority: {
+                        "waiting": depth[priority],
+                        "admitted": counts["admitted"],
+                        "timeouts": counts["timeouts"],
+                        "mean_wait_ms": round(counts["wait_seconds"] / counts["admitted"] * 1000, 1)
+                        if counts["admitted"] else 0.0,
+                        "max_wait_ms": round(counts["max_wait_seconds"] * 1000, 1)
+                    }
+                    for priority, counts in self._counts.items()
+                }
+            }
@@ -0,0 +1,315 @@
+"""
+Failure handling around an upstream provider: error classification,
+backoff, circuit breaking and an adaptive concurrency limit
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+import httpx
+from groq import APIConnectionError, APITimeoutError
+from app.utils.error_handler import ProviderUnavailableError
+
+# Error kinds (see ``classify_error``)
+RATE_LIMITED = "rate_limited"  # retry after a pause; the provider is up but saturated
+UNAVAILABLE = "unavailable"  # retry; counts against the provider's health
+REJECTED = "rejected"  # the request itself is wrong (auth, validation): never retry
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Sort a provider call failure into RATE_LIMITED, UNAVAILABLE or REJECTED
+
+    HTTP errors are told apart by status code (429, then 408/409/5xx are
+    transient); connection errors and timeouts mean the provider is
+    unreachable. Anything else (an invalid request, an unexpected
+    response) would fail the same way again.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code == 429:
+        return RATE_LIMITED
+    if status_code in (408, 409) or (status_code is not None and status_code >= 500):
+        return UNAVAILABLE
+    if isinstance(error, (APIConnectionError, APITimeoutError, httpx.TransportError, ConnectionError, TimeoutError)):
+        return UNAVAILABLE
+    return REJECTED
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Seconds the provider asked to wait (``Retry-After`` header, in
+    seconds or as an HTTP date), or None if it did not say
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    Seconds to wait before retry number ``attempt`` (0-based)
+
+    Full jitter: uniform between 0 and the exponential step (capped at
+    ``cap``), so clients that failed together do not retry together. A
+    ``Retry-After`` from the provider is a floor.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the provider is down
+
+    Closed: calls go through, consecutive UNAVAILABLE failures are
+    counted. After ``failure_threshold`` of them the breaker opens and
+    rejects calls for ``cooldown_seconds``; then it is half-open and lets
+    a single probe call through: success closes it, failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open the breaker
+            cooldown_seconds: How long an open breaker rejects calls
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False  # a half-open probe is in flight
+        self.rejected = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open' or 'half_open'"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def open_until(self) -> Optional[float]:
+        """When an open breaker starts admitting a probe (None: it is not open)"""
+        with self._lock:
+            if self.opened_at is None:
+                return None
+            until = self.opened_at + self.cooldown_seconds
+            return until if until > time.monotonic() else None
+
+    def before_call(self):
+        """
+        Admit a call
+
+        Raises:
+            ProviderUnavailableError: If the breaker is open, or half-open
+                with its probe already in flight
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return
+            self.rejected += 1
+            retry_after = self.cooldown_seconds - (time.monotonic() - self.opened_at)
+        raise ProviderUnavailableError(max(retry_after, 1.0))
+
+    def trip(self):
+        """Open the breaker now (e.g. a health check failed)"""
+        with self._lock:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def abandon(self):
+        """Forget an admitted call that ended without a verdict (e.g. cancelled)"""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self, kind: str):
+        """Count a failed call (only UNAVAILABLE failures count against it)"""
+        with self._lock:
+            if kind != UNAVAILABLE:
+                self.probing = False
+                return
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent provider calls, shared by threads and
+    event loops
+
+    Each call holds a slot. A call that succeeds within
+    ``latency_target`` raises the limit by 1/limit (about one slot per
+    round of calls); a 429 or a slower call halves it. Calls beyond the
+    limit wait for a slot, up to ``queue_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        initial: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_target: float = 30.0,
+        queue_timeout: float = 30.0
+    ):
+        """
+        Args:
+            initial: Starting limit
+            min_limit: Lowest the limit can fall
+            max_limit: Highest the limit can grow
+            latency_target: Call duration (seconds) above which the limit shrinks
+            queue_timeout: Longest wait for a slot, in seconds
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.decreases = 0
+        self.timeouts = 0
+        self.waiting = 0  # threads and coroutines waiting for a slot
+        self._condition = threading.Condition()
+        self._async_waiters = deque()  # (loop, future) per waiting coroutine
+
+    def _free(self) -> bool:
+        return self.in_flight < max(int(self.limit), self.min_limit)
+
+    def _take(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def acquire(self):
+        """
+        Wait for a slot (blocking)
+
+        Raises:
+            ProviderUnavailableError: If no slot frees up within ``queue_timeout``
+        """
+        with self._condition:
+            self.waiting += 1
+            try:
+                free = self._condition.wait_for(self._free, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+            if not free:
+                self.timeouts += 1
+                raise ProviderUnavailableError(self.queue_timeout)
+            self._take()
+
+    async def aacquire(self):
+        """Wait for a slot without blocking the event loop (raises like ``acquire``)"""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if self._free() and not self._async_waiters:
+                self._take()
+                return
+            future = loop.create_future()
+            self._async_waiters.append((loop, future))
+            self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except BaseException as e:
+            with self._condition:
+                self.waiting -= 1
+                granted = future.done() and not future.cancelled()
+                if not granted:
+                    future.cancel()  # skipped when slots are handed out
+            if granted:
+                self.release()  # the slot arrived as the wait gave up
+            if isinstance(e, asyncio.TimeoutError):
+                with self._condition:
+                    self.timeouts += 1
+                raise ProviderUnavailableError(self.queue_timeout)
+            raise
+        with self._condition:
+            self.waiting -= 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """
+        Free a slot and adapt the limit
+
+        Args:
+            latency: Duration of the call (None: do not adapt, e.g. the
+                call failed for reasons unrelated to load)
+            overloaded: The provider pushed back (429): halve the limit
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded or (latency is not None and latency > self.latency_target):
+                self.limit = max(self.limit / 2, self.min_limit)
+                self.decreases += 1
+            elif latency is not None:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            self._hand_out()
+
+    def _hand_out(self):
+        """Give free slots to waiting coroutines first, then wake waiting threads"""
+        while self._async_waiters and self._free():
+            loop, future = self._async_waiters.popleft()
+            if future.done():
+                continue
+            self._take()
+            loop.call_soon_threadsafe(self._grant, future)
+        self._condition.notify_all()
+
+    def _grant(self, future: asyncio.Future):
+        """Wake a coroutine with its slot (on its own loop)"""
+        if future.done():
+            self.release()  # it gave up in the meantime
+        else:
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "waiting": self.waiting,
+                "decreases": self.decreases,
+                "queue_timeouts": self.timeouts
+            }
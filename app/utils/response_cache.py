@@ -0,0 +1,148 @@
+"""
+Cache of LLM responses keyed by the exact request sent to the provider
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.utils.cache import LRUCache
+
+
+def response_cache_key(request: Dict[str, Any]) -> str:
+    """
+    Fingerprint of a provider request
+
+    Covers everything that shapes the response: the model, the final
+    context messages, temperature and max_tokens.
+    """
+    payload = json.dumps(
+        {field: request[field] for field in ("model", "messages", "temperature", "max_tokens")},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+class FileResponseStore:
+    """
+    Persistent cache tier: one JSON file per key, shared by every worker
+    process and kept across restarts
+
+    Files are written to a temporary name and moved into place with
+    ``os.replace``, so readers never see a partial entry. Entries older
+    than the TTL (by file modification time) are treated as missing and
+    removed when read.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            directory: Directory of the entries (created if missing)
+            ttl_seconds: Entry lifetime (None: no expiry)
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored entry, or None if missing, expired or unreadable"""
+        path = self._path(key)
+        try:
+            if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as fileobj:
+                return json.load(fileobj)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store an entry, replacing any previous one"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fileobj:
+                json.dump(value, fileobj, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class ResponseCache:
+    """
+    Two-tier LLM response cache: an in-process LRU in front of an optional
+    persistent store
+
+    Entries are dicts with the response 'content' and the 'seconds' the
+    provider took to generate it, which is what a hit saves.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float] = None, store: Optional[FileResponseStore] = None):
+        """
+        Args:
+            max_bytes: Memory budget of the in-process tier (0 disables it)
+            ttl_seconds: Entry lifetime in the in-process tier (None: no expiry)
+            store: Persistent tier (None: memory only)
+        """
+        self.memory = LRUCache(max_bytes, ttl_seconds)
+        self.store = store
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.max_bytes > 0 or self.store is not None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry from either tier, or None on a miss"""
+        entry = self.memory.get(key)
+        from_store = False
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                from_store = True
+                self.memory.set(key, entry)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.store_hits += from_store
+                self.seconds_saved += entry.get("seconds", 0.0)
+        return entry
+
+    def set(self, key: str, entry: Dict[str, Any]):
+        """Cache an entry in both tiers"""
+        self.memory.set(key, entry)
+        if self.store is not None:
+            try:
+                self.store.set(key, entry)
+            except OSError:
+                pass  # the in-process tier still has it
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, provider time saved and in-process tier usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "latency_saved_seconds": round(self.seconds_saved, 3),
+                "memory": self.memory.stats(),
+                "persistent": self.store is not None
+            }
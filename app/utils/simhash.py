@@ -0,0 +1,166 @@
+"""
+SimHash fingerprints for near-duplicate chunk detection
+"""
+import hashlib
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+from app.utils.inverted_index import tokenize
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3  # consecutive words per feature
+
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+@lru_cache(maxsize=200000)
+def _token_hash(token: str) -> int:
+    """Stable 64-bit hash of a token (``hash()`` varies between processes)"""
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer, so combined shingle hashes have independent bits"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def simhash(text: str) -> int:
+    """
+    Compute the 64-bit SimHash of a text over word shingles
+
+    Texts sharing most of their shingles get fingerprints that differ in
+    only a few bits.
+
+    Args:
+        text: Input text
+
+    Returns:
+        Unsigned 64-bit fingerprint (0 for text without words)
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return 0
+    hashes = np.fromiter((_token_hash(token) for token in tokens), dtype=np.uint64, count=len(tokens))
+
+    n_shingles = len(hashes) - SHINGLE_SIZE + 1
+    if n_shingles > 0:
+        shingles = hashes[:n_shingles].copy()
+        for i in range(1, SHINGLE_SIZE):
+            shingles = shingles * _SHINGLE_MULTIPLIER + hashes[i:i + n_shingles]
+        hashes = _mix(shingles)
+
+    # Majority vote per bit position across all features
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(-1, FINGERPRINT_BITS)
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return int(np.packbits(votes).view(np.uint64)[0])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two fingerprints"""
+    return bin(a ^ b).count("1")
+
+
+def to_signed(fingerprint: int) -> int:
+    """Map an unsigned fingerprint into the signed 64-bit range for storage"""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def from_signed(value: int) -> int:
+    """Inverse of ``to_signed``"""
+    return value + (1 << 64) if value < 0 else value
+
+
+class SimHashIndex:
+    """
+    Find stored fingerprints within a Hamming distance of a query
+
+    The 64 bits are split into ``max_distance + 1`` bands; by pigeonhole,
+    two fingerprints within ``max_distance`` bits agree exactly on at least
+    one band, so only fingerprints sharing a band are compared.
+    """
+
+    def __init__(self, max_distance: int):
+        """
+        Args:
+            max_distance: Largest Hamming distance counted as a match
+        """
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        width = FINGERPRINT_BITS // n_bands
+        self._bands = [
+            (i * width, FINGERPRINT_BITS if i == n_bands - 1 else (i + 1) * width)
+            for i in range(n_bands)
+        ]
+        self._buckets: Dict[tuple, List[int]] = {}
+
+    def _keys(self, fingerprint: int) -> Iterator[tuple]:
+        for band, (low, high) in enumerate(self._bands):
+            yield band, (fingerprint >> low) & ((1 << (high - low)) - 1)
+
+    def add(self, fingerprint: int):
+        """Store a fingerprint"""
+        for key in self._keys(fingerprint):
+            self._buckets.setdefault(key, []).append(fingerprint)
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """Return a stored fingerprint within ``max_distance``, or None"""
+        for key in self._keys(fingerprint):
+            for candidate in self._buckets.get(key, ()):
+                if hamming_distance(fingerprint, candidate) <= self.max_distance:
+                    return candidate
+        return None
+
+
+class ChunkDeduplicator:
+    """
+    Collapse near-duplicate chunks of one document as they are produced
+
+    Every chunk gets a 'simhash' fingerprint; a chunk within
+    ``max_distance`` bits of an earlier kept chunk is dropped, and kept
+    chunks are renumbered so chunk indexes stay contiguous. A negative
+    ``max_distance`` only fingerprints chunks.
+    """
+
+    def __init__(self, max_distance: int, start_index: int = 0):
+        """
+        Args:
+            max_distance: Largest Hamming distance treated as a duplicate
+            start_index: Index given to the first kept chunk
+        """
+        self.index = SimHashIndex(max_distance) if max_distance >= 0 else None
+        self.next_index = start_index
+        self.seen = 0
+        self.collapsed = 0
+
+    def seed(self, fingerprints: Iterable[int]):
+        """Register fingerprints of chunks kept earlier (e.g. before an edit)"""
+        if self.index is not None:
+            for fingerprint in fingerprints:
+                self.index.add(fingerprint)
+
+    def filter(self, chunks: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Pass through the chunks that are not near-duplicates
+
+        Args:
+            chunks: Chunk dicts in document order
+
+        Yields:
+            Kept chunk dicts, renumbered, with a 'simhash' key
+        """
+        for chunk in chunks:
+            self.seen += 1
+            fingerprint = simhash(chunk["text"])
+            if self.index is not None:
+                if self.index.find(fingerprint) is not None:
+                    self.collapsed += 1
+                    continue
+                self.index.add(fingerprint)
+            chunk["index"] = self.next_index
+            chunk["simhash"] = fingerprint
+            self.next_index += 1
+            yield chunk
@@ -0,0 +1,110 @@
+"""
+Single-flight execution: concurrent calls with the same key share one run
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class _Call:
+    """A blocking call in flight, awaited by its followers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls
+
+    The first caller of a key (the leader) runs the function; callers of
+    the same key arriving while it runs (followers) wait for it and get
+    its result, or its exception raised again. Once the run finishes the
+    key is free, so later callers start a new run.
+
+    Blocking (``do``) and async (``ado``) calls are coalesced separately.
+    """
+
+    def __init__(self):
+        self.leaders = 0  # calls that ran the function
+        self.followers = 0  # calls that shared a run instead
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run ``fn``, or wait for the run of ``key`` already in flight
+
+        Returns:
+            Tuple of (result, shared), ``shared`` being True for followers
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Async ``do``: await ``fn()``, or the run of ``key`` already in flight
+
+        The run is a task of its own, so a caller that is cancelled (e.g.
+        its client disconnected) stops waiting without cancelling the run
+        the others wait for.
+
+        Returns:
+            Tuple of (result, shared), ``shared`` being True for followers
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None or task.get_loop() is not loop
+            if leader:
+                task = self._tasks[key] = loop.create_task(fn())
+                task.add_done_callback(lambda done: self._finish(key, done))
+                self.leaders += 1
+            else:
+                self.followers += 1
+        return await asyncio.shield(task), not leader
+
+    def _finish(self, key: str, task: asyncio.Task):
+        """Free the key of a finished run"""
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # retrieved even when every waiter was cancelled
+
+    def stats(self) -> Dict[str, Any]:
+        """Leader/follower counts and calls in flight"""
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "coalesced_rate": self.followers / calls if calls else 0.0,
+                "in_flight": len(self._calls) + len(self._tasks)
+            }
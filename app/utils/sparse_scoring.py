@@ -0,0 +1,474 @@
+"""
+Vectorized sparse BM25 scoring with NumPy
+"""
+import heapq
+from concurrent.futures import Executor
+from itertools import islice
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from app.utils.inverted_index import BM25_K1, BM25_B
+
+# Relative slack on pruning comparisons, so float rounding in the upper
+# bounds can never drop a chunk that exhaustive scoring would return
+_BOUND_SLACK = 1e-6
+
+
+class ChunkMatrix:
+    """
+    Sparse chunk x term frequency matrix for one document
+
+    Stored column-compressed (one column per term) so a query only touches
+    the columns of its own terms: ``indptr[col]:indptr[col + 1]`` slices
+    ``chunk_ids`` / ``tfs`` for that term. Per-column maximum tf and
+    minimum chunk length bound each term's BM25 contribution for pruning.
+    """
+
+    __slots__ = (
+        "columns", "indptr", "chunk_ids", "tfs", "doc_lengths", "n_chunks",
+        "total_length", "max_tfs", "min_lengths"
+    )
+
+    def __init__(
+        self,
+        columns: Dict[str, int],
+        indptr: np.ndarray,
+        chunk_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_lengths: np.ndarray
+    ):
+        self.columns = columns
+        self.indptr = indptr
+        self.chunk_ids = chunk_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.n_chunks = len(doc_lengths)
+        self.total_length = float(doc_lengths.sum(dtype=np.float64))
+
+        # Columns are never empty, so reduceat sees one segment per column
+        if len(indptr) > 1 and len(chunk_ids):
+            starts = indptr[:-1]
+            self.max_tfs = np.maximum.reduceat(tfs, starts)
+            self.min_lengths = np.minimum.reduceat(doc_lengths[chunk_ids], starts)
+        else:
+            self.max_tfs = np.zeros(0, dtype=np.float32)
+            self.min_lengths = np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def from_index(cls, index: Dict) -> "ChunkMatrix":
+        """Build a matrix from a persisted inverted index (see ``build_index``)"""
+        postings = index["postings"]
+        columns = {term: col for col, term in enumerate(postings)}
+
+        lengths = [len(entry[0]) for entry in postings.values()]
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+
+        nnz = int(indptr[-1])
+        chunk_ids = np.empty(nnz, dtype=np.int32)
+        tfs = np.empty(nnz, dtype=np.float32)
+        for col, entry in enumerate(postings.values()):
+            start, end = indptr[col], indptr[col + 1]
+            chunk_ids[start:end] = entry[0]
+            tfs[start:end] = entry[1]
+
+        return cls(
+            columns,
+            indptr,
+            chunk_ids,
+            tfs,
+            np.asarray(index["doc_lengths"], dtype=np.float32)
+        )
+
+    def column(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (chunk_ids, tfs) for a term, empty if absent"""
+        col = self.columns.get(term)
+        if col is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        return self.column_at(col)
+
+    def column_at(self, col: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (chunk_ids, tfs) of a column, chunk ids ascending"""
+        start, end = self.indptr[col], self.indptr[col + 1]
+        return self.chunk_ids[start:end], self.tfs[start:end]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the matrix arrays"""
+        return (
+            self.indptr.nbytes + self.chunk_ids.nbytes
+            + self.tfs.nbytes + self.doc_lengths.nbytes
+            + self.max_tfs.nbytes + self.min_lengths.nbytes
+        )
+
+
+class CorpusStats:
+    """
+    BM25 corpus statistics over a set of chunk matrices
+
+    Shared by every shard of a corpus so each shard scores with the
+    global idf and average chunk length.
+    """
+
+    def __init__(self, matrices: List[ChunkMatrix]):
+        self.matrices = matrices
+        self.n_chunks = sum(m.n_chunks for m in matrices)
+        total_length = sum(m.total_length for m in matrices)
+        self.avg_doc_length = total_length / self.n_chunks if self.n_chunks else 0.0
+        self._doc_freqs: Dict[str, int] = {}
+
+    def doc_freq(self, term: str) -> int:
+        """Number of chunks containing a term"""
+        doc_freq = self._doc_freqs.get(term)
+        if doc_freq is None:
+            doc_freq = 0
+            for matrix in self.matrices:
+                col = matrix.columns.get(term)
+                if col is not None:
+                    doc_freq += int(matrix.indptr[col + 1] - matrix.indptr[col])
+            self._doc_freqs[term] = doc_freq
+        return doc_freq
+
+    def idf(self, term: str) -> float:
+        """BM25 idf of a term over the corpus"""
+        doc_freq = self.doc_freq(term)
+        return np.log1p((self.n_chunks - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+class StackedMatrix:
+    """
+    Several documents' chunk matrices stacked row-wise into one corpus
+
+    Rows are numbered globally: document ``i``'s chunks occupy
+    ``offsets[i]:offsets[i + 1]``. Scoring a query is a single sparse
+    matrix-vector product restricted to the query's term columns.
+
+    ``postings_total`` / ``postings_scored`` record how many postings the
+    last query touched. Passing the ``stats`` of a larger corpus scores
+    these documents as one shard of it.
+    """
+
+    def __init__(self, matrices: List[ChunkMatrix], stats: Optional[CorpusStats] = None):
+        self.matrices = matrices
+        self.stats = stats if stats is not None else CorpusStats(matrices)
+        self.offsets = np.zeros(len(matrices) + 1, dtype=np.int64)
+        np.cumsum([m.n_chunks for m in matrices], out=self.offsets[1:])
+        self.n_chunks = int(self.offsets[-1])
+        self.doc_lengths = (
+            np.concatenate([m.doc_lengths for m in matrices])
+            if matrices else np.zeros(0, dtype=np.float32)
+        )
+        self.avg_doc_length = self.stats.avg_doc_length
+        self.postings_total = 0
+        self.postings_scored = 0
+
+    def query_columns(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the stacked (global_rows, tfs) column for a term"""
+        rows, tfs = [], []
+        for matrix, offset in zip(self.matrices, self.offsets):
+            chunk_ids, term_tfs = matrix.column(term)
+            if len(chunk_ids):
+                rows.append(chunk_ids.astype(np.int64) + offset)
+                tfs.append(term_tfs)
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(rows), np.concatenate(tfs)
+
+    def score(self, query_terms: List[str]) -> np.ndarray:
+        """
+        BM25 score every chunk against the query
+
+        Args:
+            query_terms: Normalized query keywords
+
+        Returns:
+            Dense float64 score vector of length ``n_chunks``
+        """
+        self.postings_total = self.postings_scored = 0
+        if self.n_chunks == 0 or self.avg_doc_length == 0:
+            return np.zeros(self.n_chunks, dtype=np.float64)
+
+        # Gather the query's columns with their BM25 weights, then sum per row
+        all_rows, all_weights = [], []
+        for term in set(query_terms):
+            rows, tfs = self.query_columns(term)
+            if not len(rows):
+                continue
+            all_rows.append(rows)
+            all_weights.append(self._weights(self.stats.idf(term), tfs, self.doc_lengths[rows]))
+            self.postings_total += len(rows)
+        self.postings_scored = self.postings_total
+
+        if not all_rows:
+            return np.zeros(self.n_chunks, dtype=np.float64)
+        return np.bincount(
+            np.concatenate(all_rows),
+            weights=np.concatenate(all_weights),
+            minlength=self.n_chunks
+        )
+
+    def top_k(self, query_terms: List[str], k: int) -> np.ndarray:
+        """
+        Select the top-k rows with MaxScore dynamic pruning
+
+        Returns exactly ``top_k_rows(self.score(query_terms), k)``, but
+        terms whose combined upper bounds cannot reach the current k-th
+        best score are "non-essential": chunks matching only those terms
+        are never considered, and those terms' postings are looked up
+        (binary search) only for surviving candidates instead of scored
+        in full.
+
+        Args:
+            query_terms: Normalized query keywords
+            k: Number of rows to select
+
+        Returns:
+            Row indices ordered best first
+        """
+        return self.top_k_with_scores(query_terms, k)[0]
+
+    def top_k_with_scores(self, query_terms: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Like ``top_k``, also returning the selected rows' scores
+
+        Returns:
+            (rows, scores), best first
+        """
+        self.postings_total = self.postings_scored = 0
+        if k <= 0 or self.n_chunks == 0 or self.avg_doc_length == 0:
+            return _dense_top_k(np.zeros(self.n_chunks, dtype=np.float64), k)
+
+        # Per term (in the same order as ``score``): column slices, idf, bound
+        terms = []
+        for term in set(query_terms):
+            slices, doc_freq, max_tf, min_length = [], 0, 0.0, np.inf
+            for matrix, offset in zip(self.matrices, self.offsets):
+                col = matrix.columns.get(term)
+                if col is None:
+                    continue
+                chunk_ids, tfs = matrix.column_at(col)
+                slices.append((offset, matrix.n_chunks, chunk_ids, tfs))
+                doc_freq += len(chunk_ids)
+                max_tf = max(max_tf, float(matrix.max_tfs[col]))
+                min_length = min(min_length, float(matrix.min_lengths[col]))
+            if doc_freq:
+                # BM25 weight grows with tf and shrinks with chunk length
+                idf = self.stats.idf(term)
+                bound = float(self._weights(
+                    idf,
+                    np.array([max_tf], dtype=np.float32),
+                    np.array([min_length], dtype=self.doc_lengths.dtype)
+                )[0])
+                terms.append({"slices": slices, "idf": idf, "bound": bound, "rows": None})
+                self.postings_total += doc_freq
+        if not terms:
+            return _dense_top_k(np.zeros(self.n_chunks, dtype=np.float64), k)
+
+        # Seed the threshold with the k-th best score of the strongest term alone
+        first = max(terms, key=lambda t: t["bound"])
+        self._score_term(first)
+        threshold = 0.0
+        if len(first["weights"]) >= k:
+            threshold = float(np.partition(first["weights"], -k)[-k])
+
+        # Longest prefix (by ascending bound) whose bounds sum below the threshold
+        cutoff = threshold * (1 - _BOUND_SLACK)
+        non_essential, non_essential_bound = [], 0.0
+        for term in sorted(terms, key=lambda t: t["bound"]):
+            if term is first or non_essential_bound + term["bound"] >= cutoff:
+                break
+            non_essential.append(term)
+            non_essential_bound += term["bound"]
+        non_essential_ids = {id(term) for term in non_essential}
+        essential = [term for term in terms if id(term) not in non_essential_ids]
+
+        # Candidates: every row matching an essential term
+        for term in essential:
+            if term["rows"] is None:
+                self._score_term(term)
+        candidates = np.unique(np.concatenate([term["rows"] for term in essential]))
+        contributions = {}
+        partial = np.zeros(len(candidates), dtype=np.float64)
+        for term in essential:
+            values = np.zeros(len(candidates), dtype=np.float64)
+            values[np.searchsorted(candidates, term["rows"])] = term["weights"]
+            contributions[id(term)] = values
+            partial += values
+
+        # Drop candidates that cannot reach the k-th best partial score
+        if len(partial) >= k:
+            threshold = max(threshold, float(np.partition(partial, -k)[-k]))
+        if non_essential:
+            keep = partial + non_essential_bound >= threshold * (1 - _BOUND_SLACK)
+            candidates = candidates[keep]
+            for term in essential:
+                contributions[id(term)] = contributions[id(term)][keep]
+            for term in non_essential:
+                contributions[id(term)] = self._probe_term(term, candidates)
+
+        if threshold <= 0:
+            # Fewer than k matches: defer to the dense path for padding
+            scores = np.zeros(self.n_chunks, dtype=np.float64)
+            for term in terms:
+                scores[candidates] += contributions[id(term)]
+            return _dense_top_k(scores, k)
+
+        # Same summation order as ``score`` so ties resolve identically
+        final = np.zeros(len(candidates), dtype=np.float64)
+        for term in terms:
+            final += contributions[id(term)]
+        order = np.lexsort((candidates, -final))[:k]
+        return candidates[order], final[order]
+
+    def _weights(self, idf: float, tfs: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """BM25 term weights for postings with the given tfs and chunk lengths"""
+        tfs = tfs.astype(np.float64)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self.avg_doc_length)
+        return idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+
+    def _score_term(self, term: Dict):
+        """Score all of a term's postings, storing its rows and weights"""
+        rows = np.concatenate([
+            chunk_ids.astype(np.int64) + offset for offset, _, chunk_ids, _ in term["slices"]
+        ])
+        tfs = np.concatenate([tfs for _, _, _, tfs in term["slices"]])
+        term["rows"] = rows
+        term["weights"] = self._weights(term["idf"], tfs, self.doc_lengths[rows])
+        self.postings_scored += len(rows)
+
+    def _probe_term(self, term: Dict, candidates: np.ndarray) -> np.ndarray:
+        """Look up a term's weights at sorted candidate rows only (0 if absent)"""
+        values = np.zeros(len(candidates), dtype=np.float64)
+        for offset, n_chunks, chunk_ids, tfs in term["slices"]:
+            lo, hi = np.searchsorted(candidates, [offset, offset + n_chunks])
+            if lo == hi:
+                continue
+            local = candidates[lo:hi] - offset
+            positions = np.searchsorted(chunk_ids, local)
+            found = positions < len(chunk_ids)
+            found[found] = chunk_ids[positions[found]] == local[found]
+            if not found.any():
+                continue
+            rows = candidates[lo:hi][found]
+            values[lo:hi][found] = self._weights(
+                term["idf"], tfs[positions[found]], self.doc_lengths[rows]
+            )
+            self.postings_scored += int(found.sum())
+        return values
+
+    def locate(self, row: int) -> Tuple[int, int]:
+        """Map a global row to (document position, chunk id)"""
+        position = int(np.searchsorted(self.offsets, row, side="right")) - 1
+        return position, int(row - self.offsets[position])
+
+
+class ShardedMatrix:
+    """
+    A corpus split into shards of consecutive documents, searched in parallel
+
+    Each shard is a ``StackedMatrix`` scored with the corpus-wide
+    statistics, so per-shard scores equal the unsharded ones; per-shard
+    top-k lists are merged with a heap. Row numbering is the same as
+    ``StackedMatrix`` over all matrices, and results are identical to it.
+    """
+
+    def __init__(self, matrices: List[ChunkMatrix], shard_chunks: int):
+        """
+        Args:
+            matrices: Per-document chunk matrices, in stacking order
+            shard_chunks: Target chunks per shard (documents are never split)
+        """
+        self.stats = CorpusStats(matrices)
+        self.offsets = np.zeros(len(matrices) + 1, dtype=np.int64)
+        np.cumsum([m.n_chunks for m in matrices], out=self.offsets[1:])
+        self.n_chunks = int(self.offsets[-1])
+
+        self.shards: List[Tuple[int, StackedMatrix]] = []
+        start = 0
+        for end in range(1, len(matrices) + 1):
+            if end == len(matrices) or self.offsets[end] - self.offsets[start] >= shard_chunks:
+                shard = StackedMatrix(matrices[start:end], self.stats)
+                self.shards.append((int(self.offsets[start]), shard))
+                start = end
+        self.postings_total = 0
+        self.postings_scored = 0
+
+    def top_k(
+        self,
+        query_terms: List[str],
+        k: int,
+        executor: Optional[Executor] = None,
+        prune: bool = True
+    ) -> np.ndarray:
+        """
+        Select the top-k rows across all shards
+
+        Args:
+            query_terms: Normalized query keywords
+            k: Number of rows to select
+            executor: Pool to search shards on (inline if None)
+            prune: Use MaxScore within each shard
+
+        Returns:
+            Row indices ordered best first
+        """
+        def search(shard: Tuple[int, StackedMatrix]) -> List[Tuple[float, int]]:
+            row_offset, matrix = shard
+            if prune:
+                rows, scores = matrix.top_k_with_scores(query_terms, k)
+            else:
+                rows, scores = _dense_top_k(matrix.score(query_terms), k)
+            return list(zip((-scores).tolist(), (rows + row_offset).tolist()))
+
+        if executor is not None and len(self.shards) > 1:
+            results = list(executor.map(search, self.shards))
+        else:
+            results = [search(shard) for shard in self.shards]
+        self.postings_total = sum(matrix.postings_total for _, matrix in self.shards)
+        self.postings_scored = sum(matrix.postings_scored for _, matrix in self.shards)
+
+        # Each list is ordered by (-score, row), like ``top_k_rows``
+        best = islice(heapq.merge(*results), k)
+        return np.array([row for _, row in best], dtype=np.int64)
+
+    def locate(self, row: int) -> Tuple[int, int]:
+        """Map a global row to (document position, chunk id)"""
+        position = int(np.searchsorted(self.offsets, row, side="right")) - 1
+        return position, int(row - self.offsets[position])
+
+
+def _dense_top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """``top_k_rows`` plus the selected scores"""
+    rows = top_k_rows(scores, k)
+    return rows, scores[rows]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Select the top-k rows by score without a full sort
+
+    Ties are broken by ascending row so results are deterministic.
+
+    Args:
+        scores: Score vector
+        k: Number of rows to select
+
+    Returns:
+        Row indices ordered best first
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        candidates = np.arange(n)
+    else:
+        # k-th largest score; keep every row that reaches it so ties resolve by row
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        if threshold > 0:
+            candidates = np.flatnonzero(scores >= threshold)
+        else:
+            # Fewer than k matches: pad with the first unmatched rows
+            matched = np.flatnonzero(scores > 0)
+            padding = np.flatnonzero(scores <= 0)[:k - len(matched)]
+            candidates = np.concatenate([matched, padding])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
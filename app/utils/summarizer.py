@@ -0,0 +1,48 @@
+"""
+Local extractive summarization (no LLM call)
+"""
+import math
+from collections import Counter
+from typing import Callable, List
+from app.utils.chunking import split_sentences
+from app.utils.inverted_index import is_index_term, tokenize
+
+
+def extractive_summary(
+    texts: List[str],
+    max_tokens: int,
+    count_tokens: Callable[[str], int]
+) -> str:
+    """
+    Summarize texts by their most representative sentences
+
+    Sentences are scored by the mean log frequency of their index terms
+    across all texts, picked best first while they fit the budget and
+    returned in their original order.
+
+    Args:
+        texts: Texts to summarize, oldest first
+        max_tokens: Token budget of the summary
+        count_tokens: Token counter for the budget
+
+    Returns:
+        Selected sentences joined by spaces ('' if none fit)
+    """
+    sentences = [sentence for text in texts for sentence in split_sentences(text)]
+    terms = [[t for t in tokenize(sentence) if is_index_term(t)] for sentence in sentences]
+    frequencies = Counter(t for sentence_terms in terms for t in sentence_terms)
+
+    def score(position: int) -> float:
+        unique = set(terms[position])
+        if not unique:
+            return 0.0
+        return sum(math.log1p(frequencies[t]) for t in unique) / math.sqrt(len(unique))
+
+    selected = []
+    used = 0
+    for position in sorted(range(len(sentences)), key=lambda p: (-score(p), p)):
+        tokens = count_tokens(sentences[position])
+        if used + tokens <= max_tokens:
+            selected.append(position)
+            used += tokens
+    return " ".join(sentences[p] for p in sorted(selected))
@@ -0,0 +1,171 @@
+"""
+Token budget allocation across the parts of an LLM request
+"""
+import threading
+from typing import Dict, List, Optional
+from app.config import settings
+from app.utils.error_handler import PromptTooLargeError
+
+COMPONENTS = ("system", "rag", "history", "completion")
+BUDGET_POLICIES = ("fixed", "proportional", "priority")
+
+# Components the policies divide; the system prompt is always kept whole
+SHARED_COMPONENTS = ("rag", "history", "completion")
+
+# Tokens spent per component over all requests (exposed at /metrics)
+budget_stats = {"requests": 0, **{component: 0 for component in COMPONENTS}}
+_budget_stats_lock = threading.Lock()
+
+
+class TokenBudget:
+    """
+    Split a model's context window between the system prompt, retrieved
+    context, conversation history and the reserved completion
+
+    The system prompt is always allotted in full. The rest of the window,
+    less ``reserve`` tokens for chat formatting and tokenizer differences,
+    is divided between retrieved context, history and completion:
+
+    - fixed: each component up to its cap in ``caps``
+    - proportional: each component up to its share in ``shares``, shares
+      a component does not need going to the others
+    - priority: components served in ``priority`` order, each up to its
+      demand
+
+    No component gets more than it asks for, the completion never gets
+    less than ``min_completion`` (unless it asks for less), the prompt
+    never exceeds ``max_prompt`` and the total never exceeds the window:
+    over-commitment is cut from the lowest-priority components first.
+    """
+
+    def __init__(
+        self,
+        window: int,
+        policy: str = "fixed",
+        reserve: int = 0,
+        min_completion: int = 1,
+        max_prompt: Optional[int] = None,
+        caps: Optional[Dict[str, int]] = None,
+        shares: Optional[Dict[str, float]] = None,
+        priority: Optional[List[str]] = None
+    ):
+        """
+        Args:
+            window: Model context window (prompt plus completion), in tokens
+            policy: 'fixed', 'proportional' or 'priority'
+            reserve: Tokens held back from every request
+            min_completion: Smallest completion allotment
+            max_prompt: Upper bound of system prompt + context + history
+            caps: Per-component caps for the fixed policy (missing: no cap)
+            shares: Per-component weights for the proportional policy
+            priority: Shared components, most important first
+        """
+        if policy not in BUDGET_POLICIES:
+            raise ValueError(f"Invalid TOKEN_BUDGET_POLICY: {policy}. Must be one of {BUDGET_POLICIES}")
+        priority = list(priority or SHARED_COMPONENTS)
+        if sorted(priority) != sorted(SHARED_COMPONENTS):
+            raise ValueError(f"TOKEN_BUDGET_PRIORITY must order exactly {SHARED_COMPONENTS}")
+        self.window = window
+        self.policy = policy
+        self.reserve = reserve
+        self.min_completion = min_completion
+        self.max_prompt = max_prompt
+        self.caps = dict(caps or {})
+        self.shares = {component: (shares or {}).get(component, 0.0) for component in SHARED_COMPONENTS}
+        self.priority = priority
+
+    def allocate(self, demands: Dict[str, int]) -> Dict[str, int]:
+        """
+        Allot tokens to each component of a request
+
+        Args:
+            demands: Tokens each component asks for ('system' is the
+                instructions without retrieved context; missing: 0)
+
+        Returns:
+            Tokens allotted per component, for all of ``COMPONENTS``
+
+        Raises:
+            PromptTooLargeError: If the system prompt leaves no room for
+                the minimum completion
+        """
+        system = demands.get("system", 0)
+        available = self.window - self.reserve - system
+        floor = min(self.min_completion, max(demands.get("completion", 0), 0))
+        if available < floor or (self.max_prompt is not None and system > self.max_prompt):
+            raise PromptTooLargeError(system, self.window)
+        wanted = {component: max(demands.get(component, 0), 0) for component in SHARED_COMPONENTS}
+
+        if self.policy == "fixed":
+            allotted = {
+                component: min(tokens, self.caps.get(component, tokens))
+                for component, tokens in wanted.items()
+            }
+        elif self.policy == "proportional":
+            allotted = self._proportional(wanted, available)
+        else:
+            allotted = {}
+            remaining = available
+            for component in self.priority:
+                allotted[component] = min(wanted[component], remaining)
+                remaining -= allotted[component]
+        allotted["completion"] = max(allotted["completion"], floor)
+
+        # Cut over-commitment from the least important components
+        limits = [(available, SHARED_COMPONENTS)]
+        if self.max_prompt is not None:
+            limits.insert(0, (self.max_prompt - system, ("rag", "history")))
+        for limit, components in limits:
+            excess = sum(allotted[component] for component in components) - limit
+            for component in reversed(self.priority):
+                if excess <= 0:
+                    break
+                if component not in components:
+                    continue
+                keep = floor if component == "completion" else 0
+                cut = min(excess, allotted[component] - keep)
+                allotted[component] -= cut
+                excess -= cut
+
+        allotted["system"] = system
+        return {component: allotted[component] for component in COMPONENTS}
+
+    def _proportional(self, wanted: Dict[str, int], available: int) -> Dict[str, int]:
+        """Water-fill ``available`` by share; satisfied components free their rest"""
+        allotted = {component: 0 for component in wanted}
+        active = [c for c in wanted if wanted[c] > 0 and self.shares[c] > 0]
+        remaining = available
+        while active and remaining > 0:
+            total_share = sum(self.shares[c] for c in active)
+            grants = {c: int(remaining * self.shares[c] / total_share) for c in active}
+            for c in active:
+                give = min(grants[c], wanted[c] - allotted[c])
+                allotted[c] += give
+                remaining -= give
+            satisfied = [c for c in active if allotted[c] >= wanted[c]]
+            if not satisfied:
+                break
+            active = [c for c in active if c not in satisfied]
+        return allotted
+
+
+def token_budget_from_settings() -> TokenBudget:
+    """Build the token budget configured in settings"""
+    return TokenBudget(
+        window=settings.MODEL_CONTEXT_WINDOW,
+        policy=settings.TOKEN_BUDGET_POLICY,
+        reserve=settings.TOKEN_BUDGET_RESERVE,
+        min_completion=settings.MIN_COMPLETION_TOKENS,
+        max_prompt=settings.MAX_CONTEXT_TOKENS,
+        caps={"rag": settings.RAG_CONTEXT_TOKENS, "completion": settings.COMPLETION_TOKENS},
+        shares=settings.TOKEN_BUDGET_SHARES,
+        priority=settings.TOKEN_BUDGET_PRIORITY
+    )
+
+
+def record_spend(spend: Dict[str, int]):
+    """Add one request's tokens per component to ``budget_stats``"""
+    with _budget_stats_lock:
+        budget_stats["requests"] += 1
+        for component in COMPONENTS:
+            budget_stats[component] += spend.get(component, 0)
@@ -0,0 +1,117 @@
+"""
+Tokenizer subsystem: encoders resolved once per model, cached token counts
+"""
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+import tiktoken
+from app.config import settings
+from app.utils.cache import LRUCache
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# Fewer uncached texts than this are encoded inline rather than in threads
+_BATCH_MIN_TEXTS = 8
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Resolve the tokenizer encoding for a model (once per model)
+
+    Unknown models fall back to cl100k_base. Failures (e.g. the encoding
+    file cannot be downloaded) are not cached, so a later call retries.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _content_key(text: str) -> bytes:
+    """Fixed-size cache key for a text, so long texts are not kept alive"""
+    return hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+
+
+class TokenCounter:
+    """
+    Count tokens with one encoder and a bounded content-hash -> count cache
+
+    Special-token markers in the text (e.g. ``<|endoftext|>``) are counted
+    as ordinary text rather than rejected.
+    """
+
+    def __init__(self, encoding: tiktoken.Encoding, cache_bytes: int, num_threads: Optional[int] = None):
+        """
+        Args:
+            encoding: Tokenizer encoding
+            cache_bytes: Memory budget of the count cache (0 disables it)
+            num_threads: Threads for batch encoding (None: one per CPU)
+        """
+        self.encoding = encoding
+        self.cache = LRUCache(cache_bytes)
+        self.num_threads = num_threads or os.cpu_count() or 1
+
+    def count(self, text: str) -> int:
+        """Number of tokens in a text"""
+        key = _content_key(text)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            tokens = len(self.encoding.encode_ordinary(text))
+            self.cache.set(key, tokens)
+        return tokens
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """
+        Number of tokens in each of several texts
+
+        Uncached texts are encoded together, in threads when there are
+        enough of them and more than one thread; repeated texts are
+        encoded once.
+
+        Returns:
+            Token counts in the order of ``texts``
+        """
+        keys = [_content_key(text) for text in texts]
+        counts: List[Optional[int]] = [self.cache.get(key) for key in keys]
+
+        missing: Dict[bytes, str] = {}
+        for key, text, tokens in zip(keys, texts, counts):
+            if tokens is None:
+                missing.setdefault(key, text)
+        if missing:
+            pending = list(missing.values())
+            if len(pending) >= _BATCH_MIN_TEXTS and self.num_threads > 1:
+                encoded = self.encoding.encode_ordinary_batch(pending, num_threads=self.num_threads)
+            else:
+                encoded = [self.encoding.encode_ordinary(text) for text in pending]
+            fresh = {key: len(tokens) for key, tokens in zip(missing, encoded)}
+            for key, tokens in fresh.items():
+                self.cache.set(key, tokens)
+            counts = [fresh[key] if tokens is None else tokens for key, tokens in zip(keys, counts)]
+        return counts
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str = DEFAULT_MODEL) -> TokenCounter:
+    """Return the shared token counter for a model, creating it on first use"""
+    counter = _counters.get(model)
+    if counter is None:
+        encoding = get_encoding(model)
+        with _counters_lock:
+            counter = _counters.get(model)
+            if counter is None:
+                counter = _counters[model] = TokenCounter(
+                    encoding, settings.TOKEN_COUNT_CACHE_MAX_BYTES, settings.TOKENIZER_THREADS
+                )
+    return counter
+
+
+def token_counter_stats() -> Dict[str, Dict]:
+    """Count-cache statistics of every token counter created so far, by model"""
+    return {model: counter.cache.stats() for model, counter in list(_counters.items())}
@@ -0,0 +1,127 @@
+"""
+Benchmark: concurrent message turns through the blocking (threadpool)
+endpoint vs. the async endpoint, against the local fake LLM provider
+
+Every turn waits ``--latency`` seconds for its completion. The blocking
+endpoint holds a threadpool worker (40 by default) for the whole call, so
+its concurrency is capped there; the async endpoint only borrows workers
+for the database work around the call.
+
+Usage:
+    python -m benchmarks.bench_async_load [--concurrency 40 200 800] [--latency 0.5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.database import Base, get_db
+from app.models import Conversation, User
+from app.schemas.message import MessageCreate
+from app.services.conversation_service import ConversationService
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.resilience import AdaptiveLimiter
+from app.utils.response_cache import ResponseCache
+from benchmarks.bench_tokenizer import resolve_encoding
+
+
+def blocking_app(service: ConversationService) -> FastAPI:
+    """The message endpoint as it was: a sync handler on the threadpool"""
+    legacy = FastAPI()
+
+    @legacy.post("/api/v1/conversations/{conversation_id}/messages", status_code=201)
+    def add_message(conversation_id: int, message_data: MessageCreate, db: Session = Depends(get_db)):
+        _, assistant_message = service.add_message(db, conversation_id, message_data.content)
+        return {"content": assistant_message.content}
+
+    return legacy
+
+
+async def run(app: FastAPI, concurrency: int, first_id: int) -> float:
+    """Send ``concurrency`` turns at once; return the wall time in seconds"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post(f"/api/v1/conversations/{first_id + i}/messages", json={"content": f"turn {i}"})
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    assert all(response.status_code == 201 for response in responses), responses[0].text
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[40, 200, 800])
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    resolve_encoding()  # local encoding when the real one cannot be downloaded
+    settings.LLM_PROVIDER = "fake"
+    settings.FAKE_LLM_LATENCY_SECONDS = args.latency
+    from app.api.messages import conversation_service  # noqa: E402  (after the provider is set)
+    from app.main import app
+    legacy = blocking_app(conversation_service)
+    # Every turn must reach the provider (blocking and async turns repeat
+    # the same messages), and the adaptive provider limit would cap both
+    # sides alike
+    llm = conversation_service.llm_service
+    llm.response_cache = ResponseCache(0)
+    backend = Backend(
+        "fake", FakeLLMClient(args.latency), AsyncFakeLLMClient(args.latency),
+        limiter=AdaptiveLimiter(initial=max(args.concurrency), max_limit=max(args.concurrency))
+    )
+    llm.pool = ProviderPool([backend])
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(directory, 'load.db')}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(bind=engine)
+        total = 2 * sum(args.concurrency)
+        with engine.begin() as connection:
+            connection.execute(insert(User), [{"id": 1, "username": "u", "email": "u@example.com"}])
+            connection.execute(insert(Conversation), [
+                {"id": i, "user_id": 1, "mode": "open"} for i in range(1, total + 1)
+            ])
+        SessionLocal = sessionmaker(bind=engine)
+
+        def bench_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        for target in (app, legacy):
+            target.dependency_overrides[get_db] = bench_db
+
+        print(f"fake provider latency {args.latency:.2f} s")
+        print(
+            f"{'concurrent':>10} {'blocking s':>11} {'turns/s':>8} {'in flight':>10}"
+            f" {'async s':>8} {'turns/s':>8} {'in flight':>10}"
+        )
+        next_id = 1
+        for concurrency in args.concurrency:
+            backend.client.peak_in_flight = backend.async_client.peak_in_flight = 0
+            blocking_s = asyncio.run(run(legacy, concurrency, next_id))
+            async_s = asyncio.run(run(app, concurrency, next_id + concurrency))
+            next_id += 2 * concurrency
+            print(
+                f"{concurrency:>10} {blocking_s:>11.2f} {concurrency / blocking_s:>8.0f}"
+                f" {backend.client.peak_in_flight:>10} {async_s:>8.2f} {concurrency / async_s:>8.0f}"
+                f" {backend.async_client.peak_in_flight:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: blocking LLM calls during a provider outage, with and without
+the circuit breaker, against a local fake provider that fails with 503
+for the first ``--outage`` seconds
+
+Without the breaker every request retries through the outage, holding
+its worker thread in backoff sleeps; with it, requests fail fast with 503
+once the circuit opens, and a probe closes it again after recovery.
+Reports how long requests sent during the outage took to get an answer
+(a reply or an error).
+
+Usage:
+    python -m benchmarks.bench_brownout [--workers 40] [--outage 3] [--duration 6]
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.fake_llm import FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.error_handler import LLMAPIError, ProviderUnavailableError
+from app.utils.resilience import AdaptiveLimiter, CircuitBreaker
+from app.utils.response_cache import ResponseCache
+from benchmarks.bench_tokenizer import resolve_encoding
+
+
+class OutageError(Exception):
+    status_code = 503
+
+
+class BrownoutClient(FakeLLMClient):
+    """Fake client that answers 503 (after its latency) until ``recovers_at``"""
+
+    def __init__(self, latency: float, recovers_at: float):
+        super().__init__(latency)
+        self.recovers_at = recovers_at
+        self.failed_calls = 0
+
+    def create(self, **kwargs):
+        if time.perf_counter() < self.recovers_at:
+            with self._lock:
+                self.calls += 1
+                self.failed_calls += 1
+            time.sleep(self.latency)
+            raise OutageError("service unavailable")
+        return super().create(**kwargs)
+
+
+def run(breaker: CircuitBreaker, workers: int, outage: float, duration: float, latency: float) -> dict:
+    """Let ``workers`` threads send requests back to back for ``duration`` seconds"""
+    from app.services.llm_service import LLMService
+    llm = LLMService()
+    llm.response_cache = ResponseCache(0)
+    llm.coalesce = False
+    started = time.perf_counter()
+    client = BrownoutClient(latency, started + outage)
+    llm.pool = ProviderPool([Backend(
+        "fake", client, None, breaker=breaker, limiter=AdaptiveLimiter(initial=workers, max_limit=workers)
+    )])
+    outcomes = []  # (started at, seconds taken, succeeded) per request
+    lock = threading.Lock()
+
+    def worker(i):
+        n = 0
+        while time.perf_counter() - started < duration:
+            n += 1
+            t0 = time.perf_counter()
+            try:
+                llm.generate_response([{"role": "user", "content": f"worker {i} request {n}"}])
+                ok = True
+            except (LLMAPIError, ProviderUnavailableError):
+                ok = False
+            with lock:
+                outcomes.append((t0 - started, time.perf_counter() - t0, ok))
+            if not ok:
+                time.sleep(0.05)  # the client waits a little before trying again
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, range(workers)))
+    during = [seconds for at, seconds, _ in outcomes if at < outage]
+    return {
+        "requests": len(during),
+        "median_ms": statistics.median(during) * 1000,
+        "upstream_failed_calls": client.failed_calls,
+        "first_success_s": min((at + seconds for at, seconds, ok in outcomes if ok), default=float("nan"))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=40)
+    parser.add_argument("--outage", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=6.0)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    resolve_encoding()  # local encoding when the real one cannot be downloaded
+
+    print(f"{args.workers} workers, {args.outage:.1f} s outage, {args.latency:.2f} s provider latency")
+    print(f"{'':>12} {'requests in outage':>19} {'median answer ms':>17} {'upstream 503s':>14} {'first ok s':>11}")
+    for name, breaker in (
+        ("no breaker", CircuitBreaker(failure_threshold=10 ** 9)),
+        ("breaker", CircuitBreaker(failure_threshold=5, cooldown_seconds=1.0))
+    ):
+        result = run(breaker, args.workers, args.outage, args.duration, args.latency)
+        print(
+            f"{name:>12} {result['requests']:>19} {result['median_ms']:>17.0f}"
+            f" {result['upstream_failed_calls']:>14} {result['first_success_s']:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
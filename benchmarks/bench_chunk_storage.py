@@ -0,0 +1,97 @@
+"""
+Benchmark: storage of chunk text copies vs. offset-only chunks
+
+Stores the same corpus twice in SQLite (chunk text copied into every row,
+and chunks as offsets into the document content), then compares database
+size, the payload returned by ingestion workers and the cost of loading
+the top-K chunks' text.
+
+Usage:
+    python -m benchmarks.bench_chunk_storage [--documents 200] [--words 20000]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import tracemalloc
+
+import numpy as np
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+import app.models  # noqa: F401  (register tables)
+from app.database import Base
+from app.models import Document, DocumentChunk
+from app.services.rag_service import RAGService, stored_chunk_text
+from benchmarks.bench_retrieval import TOP_K, timed
+
+
+def store(path: str, corpus, offsets_only: bool):
+    """Write the corpus to a new SQLite database and return a session on it"""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for document_id, (content, chunks) in enumerate(corpus, start=1):
+            connection.execute(insert(Document), [{
+                "id": document_id, "title": str(document_id), "content": content, "chunk_count": len(chunks)
+            }])
+            connection.execute(insert(DocumentChunk), [
+                {
+                    "document_id": document_id,
+                    "chunk_index": chunk["index"],
+                    "start_offset": chunk["start"],
+                    "end_offset": chunk["end"],
+                    "token_count": 0,
+                    "text": stored_chunk_text(chunk) if offsets_only else chunk["text"]
+                }
+                for chunk in chunks
+            ])
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    return sessionmaker(bind=engine)()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--words", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocab = np.array([f"term{i}" for i in range(20000)])
+    service = RAGService()
+    corpus = []
+    for _ in range(args.documents):
+        content = " ".join(vocab[(rng.zipf(1.2, size=args.words) - 1) % len(vocab)])
+        corpus.append((content, service.chunk_document(content)))
+    content_mb = sum(len(content) for content, _ in corpus) / 2**20
+
+    # Ingestion workers ship prepared chunks back to the parent process
+    copies = pickle.dumps([chunks for _, chunks in corpus])
+    offsets = pickle.dumps([
+        [{key: value for key, value in chunk.items() if key != "text"} for chunk in chunks]
+        for _, chunks in corpus
+    ])
+
+    keys = [(int(d), int(c)) for d, c in zip(
+        rng.integers(1, args.documents + 1, TOP_K * 2), rng.integers(0, 10, TOP_K * 2)
+    )]
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{args.documents} documents, {content_mb:.1f} MB of content")
+        print(f"{'layout':>8} {'db MB':>8} {'worker payload MB':>18} {'top-k load ms':>14} {'top-k KB':>9}")
+        for name, offsets_only, payload in (("copies", False, copies), ("offsets", True, offsets)):
+            db = store(os.path.join(directory, f"{name}.db"), corpus, offsets_only)
+            size = os.path.getsize(os.path.join(directory, f"{name}.db"))
+            versions = {document_id: 1 for document_id, _ in keys}
+            load_ms = timed(lambda: service._load_chunks(db, keys, versions), repeat=5)
+            tracemalloc.start()
+            loaded = service._load_chunks(db, keys, versions)
+            held, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert len(loaded) == len(keys)
+            db.close()
+            print(f"{name:>8} {size / 2**20:>8.1f} {len(payload) / 2**20:>18.1f} {load_ms:>14.2f} {held / 2**10:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
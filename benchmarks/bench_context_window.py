@@ -0,0 +1,72 @@
+"""
+Benchmark: context-window selection cost as a conversation grows
+
+Compares loading the whole history through ``Conversation.messages``
+(and re-tokenizing it, when the tokenizer is available offline) with the
+windowed query over stored per-message token counts.
+
+Usage:
+    python -m benchmarks.bench_context_window [--messages 100 1000 10000]
+"""
+import argparse
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import app.models  # noqa: F401  (register tables)
+from app.database import Base
+from app.models import Conversation, Message, User
+from app.services.conversation_service import ConversationService
+from app.utils.context_manager import count_tokens
+from benchmarks.bench_retrieval import timed
+
+MESSAGE = "Could you explain how the retrieval pipeline ranks chunks for this question? " * 3
+
+
+def tokenizer_available() -> bool:
+    try:
+        count_tokens("probe")
+        return True
+    except Exception:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    service = ConversationService()
+    tokens = len(MESSAGE.split())  # stands in for the stored count
+    retokenize = tokenizer_available()
+
+    print(f"{'messages':>9} {'load all ms':>12} {'+ tokenize ms':>14} {'windowed ms':>12} {'loaded':>7}")
+    for n_messages in args.messages:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        db.add(User(id=1, username="u", email="u@example.com"))
+        db.add(Conversation(id=1, user_id=1, mode="open"))
+        db.execute(insert(Message), [
+            {"conversation_id": 1, "role": "user", "content": MESSAGE, "prompt_tokens": tokens}
+            for _ in range(n_messages)
+        ])
+        db.commit()
+
+        def load_all():
+            db.expire_all()
+            return [(m.role, m.content) for m in db.get(Conversation, 1).messages]
+
+        load_ms = timed(load_all)
+        tokenize = (
+            f"{timed(lambda: [count_tokens(content) for _, content in load_all()]):>14.1f}"
+            if retokenize else f"{'n/a':>14}"
+        )
+        windowed_ms = timed(lambda: service._load_history(db, 1))
+        loaded = len(service._load_history(db, 1))
+        print(f"{n_messages:>9} {load_ms:>12.1f} {tokenize} {windowed_ms:>12.2f} {loaded:>7}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
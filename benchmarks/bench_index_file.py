@@ -0,0 +1,65 @@
+"""
+Benchmark: per-worker cold start and private memory of a document index,
+loaded from the JSON column vs. mapped from a binary index file
+
+Usage:
+    python -m benchmarks.bench_index_file [--chunks 100000]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app.models.types import dumps_compact
+from app.utils.index_file import open_index_file, write_index_file
+from app.utils.inverted_index import build_index
+from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix
+from benchmarks.bench_retrieval import QUERY, TOP_K, make_corpus
+
+
+def measure(load):
+    """Load time (ms), private bytes held afterwards, and first-query time (ms)"""
+    # Separate runs: tracing allocations slows the load itself down
+    tracemalloc.start()
+    matrix = load()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del matrix
+
+    start = time.perf_counter()
+    matrix = load()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    rows = list(StackedMatrix([matrix]).top_k(QUERY, TOP_K))
+    return load_ms, held, (time.perf_counter() - start) * 1000, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=100000)
+    args = parser.parse_args()
+
+    _, texts = make_corpus(args.chunks)
+    index = build_index(texts)
+    stored = str(dumps_compact(index))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document.idx")
+        write_index_file(path, index, 1)
+        file_size = os.path.getsize(path)
+
+        json_result = measure(lambda: ChunkMatrix.from_index(json.loads(stored)))
+        mapped_result = measure(lambda: open_index_file(path))
+        assert json_result[3] == mapped_result[3]
+
+    print(f"{args.chunks} chunks; JSON index {len(stored) / 2**20:.1f} MB, index file {file_size / 2**20:.1f} MB")
+    print(f"{'loader':>8} {'cold start ms':>14} {'private MB':>11} {'first query ms':>15}")
+    for name, (load_ms, held, query_ms, _) in (("json", json_result), ("mmap", mapped_result)):
+        print(f"{name:>8} {load_ms:>14.1f} {held / 2**20:>11.2f} {query_ms:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
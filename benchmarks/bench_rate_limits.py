@@ -0,0 +1,134 @@
+"""
+Benchmark: blocking LLM calls against a rate-limited fake provider, with
+and without the client-side rate governor
+
+The provider allows ``--rpm`` requests per minute (its minute's budget is
+already spent when the run starts) and answers 429 with ``Retry-After``
+beyond that. Half of the workers send chat turns (one every ``--think``
+seconds), half send background (batch) requests back to back. Without
+the governor every request is sent and the rejected ones back off and
+retry; with it, requests wait client-side and chat turns go first.
+
+Usage:
+    python -m benchmarks.bench_rate_limits [--workers 20] [--rpm 1200] [--think 1] [--duration 5]
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.fake_llm import FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.error_handler import LLMAPIError, ProviderUnavailableError
+from app.utils.rate_governor import BATCH, INTERACTIVE, RateGovernor, TokenBucket
+from app.utils.resilience import AdaptiveLimiter, CircuitBreaker
+from app.utils.response_cache import ResponseCache
+from benchmarks.bench_tokenizer import resolve_encoding
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("rate limit exceeded")
+        self.response = type("Response", (), {"headers": {"retry-after": f"{retry_after:.3f}"}})()
+
+
+class RateLimitedClient(FakeLLMClient):
+    """Fake client that rejects requests beyond ``rpm`` per minute with 429"""
+
+    def __init__(self, latency: float, rpm: int):
+        super().__init__(latency)
+        self.bucket = TokenBucket(rpm)
+        self.bucket.level = 0
+        self.rejected = 0
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.bucket.refill(time.monotonic())
+            wait = self.bucket.seconds_until(1)
+            if wait > 0:
+                self.calls += 1
+                self.rejected += 1
+            else:
+                self.bucket.take(1)
+        if wait > 0:
+            raise RateLimitError(wait)
+        return super().create(**kwargs)
+
+
+def run(governed: bool, workers: int, rpm: int, think: float, duration: float, latency: float) -> dict:
+    """Let ``workers`` threads send chat and batch requests for ``duration`` seconds"""
+    from app.services.llm_service import LLMService
+    llm = LLMService()
+    llm.response_cache = ResponseCache(0)
+    llm.coalesce = False
+    llm.retry_delay = 0.1
+    client = RateLimitedClient(latency, rpm)
+    llm.pool = ProviderPool([Backend(
+        "fake", client, None,
+        breaker=CircuitBreaker(failure_threshold=10 ** 9),
+        limiter=AdaptiveLimiter(initial=workers, max_limit=workers)
+    )])
+    llm.governor = RateGovernor(requests_per_minute=rpm if governed else 0, queue_timeout=duration)
+    if governed:
+        llm.governor.requests.level = 0
+    started = time.perf_counter()
+    outcomes = {INTERACTIVE: [], BATCH: []}  # (seconds taken, succeeded) per request
+    lock = threading.Lock()
+
+    def worker(i):
+        priority = INTERACTIVE if i % 2 == 0 else BATCH
+        n = 0
+        while time.perf_counter() - started < duration:
+            n += 1
+            t0 = time.perf_counter()
+            try:
+                llm.generate_response([{"role": "user", "content": f"worker {i} request {n}"}], priority=priority)
+                ok = True
+            except (LLMAPIError, ProviderUnavailableError):
+                ok = False
+            with lock:
+                outcomes[priority].append((time.perf_counter() - t0, ok))
+            if priority == INTERACTIVE:
+                time.sleep(think)
+            elif not ok:
+                time.sleep(0.05)  # the client waits a little before trying again
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, range(workers)))
+    median_ms = lambda results: statistics.median(s for s, ok in results if ok) * 1000 if any(
+        ok for _, ok in results
+    ) else float("nan")
+    return {
+        "answered": sum(ok for results in outcomes.values() for _, ok in results),
+        "failed": sum(not ok for results in outcomes.values() for _, ok in results),
+        "rejected": client.rejected,
+        "chat_ms": median_ms(outcomes[INTERACTIVE]),
+        "batch_ms": median_ms(outcomes[BATCH])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--rpm", type=int, default=1200)
+    parser.add_argument("--think", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    resolve_encoding()  # local encoding when the real one cannot be downloaded
+
+    print(f"{args.workers} workers, provider limit {args.rpm} requests/min, {args.duration:.0f} s")
+    print(f"{'':>12} {'answered':>9} {'failed':>7} {'upstream 429s':>14} {'chat median ms':>15} {'batch median ms':>16}")
+    for name, governed in (("no governor", False), ("governor", True)):
+        result = run(governed, args.workers, args.rpm, args.think, args.duration, args.latency)
+        print(
+            f"{name:>12} {result['answered']:>9} {result['failed']:>7} {result['rejected']:>14}"
+            f" {result['chat_ms']:>15.0f} {result['batch_ms']:>16.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark: per-chunk Python keyword scan vs. vectorized sparse BM25 scoring,
+exhaustive and with MaxScore pruning
+
+Usage:
+    python -m benchmarks.bench_retrieval [--sizes 10000 100000 1000000]
+"""
+import argparse
+import time
+import numpy as np
+
+from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix, top_k_rows
+
+VOCAB_SIZE = 20000
+CHUNK_LENGTH = 30
+CHUNKS_PER_DOCUMENT = 10000
+TOP_K = 3
+QUERY = ["term17", "term421", "term3000"]
+
+
+def make_corpus(n_chunks: int, seed: int = 0):
+    """Generate Zipf-distributed token ids and the matching chunk texts"""
+    rng = np.random.default_rng(seed)
+    token_ids = (rng.zipf(1.2, size=(n_chunks, CHUNK_LENGTH)) - 1) % VOCAB_SIZE
+    vocab = np.array([f"term{i}" for i in range(VOCAB_SIZE)])
+    texts = [" ".join(row) for row in vocab[token_ids]]
+    return token_ids, texts
+
+
+def build_matrix(token_ids: np.ndarray) -> ChunkMatrix:
+    """Build a ChunkMatrix straight from token ids (skips tokenization)"""
+    n_chunks, length = token_ids.shape
+    rows = np.repeat(np.arange(n_chunks), length)
+    pairs, tfs = np.unique(
+        token_ids.ravel().astype(np.int64) * n_chunks + rows, return_counts=True
+    )
+    terms, chunk_ids = np.divmod(pairs, n_chunks)
+    present = np.unique(terms)
+    indptr = np.zeros(len(present) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.searchsorted(present, terms)), out=indptr[1:])
+    return ChunkMatrix(
+        {f"term{t}": col for col, t in enumerate(present)},
+        indptr,
+        chunk_ids.astype(np.int32),
+        tfs.astype(np.float32),
+        np.full(n_chunks, length, dtype=np.float32)
+    )
+
+
+def legacy_retrieve(texts, keywords):
+    """The original loop: lowercase + str.count per keyword, then full sort"""
+    chunk_scores = []
+    for text in texts:
+        lower = text.lower()
+        chunk_scores.append((text, sum(lower.count(k) for k in keywords)))
+    chunk_scores.sort(key=lambda x: x[1], reverse=True)
+    return [text for text, _ in chunk_scores[:TOP_K]]
+
+
+def timed(fn, repeat: int = 3) -> float:
+    """Best wall time of several runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(
+        f"{'chunks':>10} {'legacy ms':>12} {'sparse ms':>12} {'speedup':>9}"
+        f" {'pruned ms':>12} {'postings':>10} {'skipped':>8}"
+    )
+    for n_chunks in args.sizes:
+        token_ids, texts = make_corpus(n_chunks)
+        matrices = [
+            build_matrix(token_ids[start:start + CHUNKS_PER_DOCUMENT])
+            for start in range(0, n_chunks, CHUNKS_PER_DOCUMENT)
+        ]
+
+        def sparse():
+            stacked = StackedMatrix(matrices)
+            return top_k_rows(stacked.score(QUERY), TOP_K)
+
+        def pruned():
+            stacked = StackedMatrix(matrices)
+            return stacked.top_k(QUERY, TOP_K), stacked
+
+        legacy_ms = timed(lambda: legacy_retrieve(texts, QUERY))
+        sparse_ms = timed(sparse)
+        pruned_ms = timed(pruned)
+        rows, stacked = pruned()
+        assert list(rows) == list(sparse())
+        skipped = 1 - stacked.postings_scored / max(stacked.postings_total, 1)
+        print(
+            f"{n_chunks:>10} {legacy_ms:>12.1f} {sparse_ms:>12.2f} {legacy_ms / sparse_ms:>8.0f}x"
+            f" {pruned_ms:>12.2f} {stacked.postings_total:>10} {skipped:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
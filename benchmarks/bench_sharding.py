@@ -0,0 +1,45 @@
+"""
+Benchmark: BM25 top-k latency against shard count
+
+Usage:
+    python -m benchmarks.bench_sharding [--chunks 1000000] [--shards 1 2 4 8 16]
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.sparse_scoring import ShardedMatrix, StackedMatrix
+from benchmarks.bench_retrieval import (
+    CHUNKS_PER_DOCUMENT, QUERY, TOP_K, build_matrix, make_corpus, timed
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=1000000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    token_ids, _ = make_corpus(args.chunks)
+    matrices = [
+        build_matrix(token_ids[start:start + CHUNKS_PER_DOCUMENT])
+        for start in range(0, args.chunks, CHUNKS_PER_DOCUMENT)
+    ]
+    expected = list(StackedMatrix(matrices).top_k(QUERY, TOP_K))
+
+    print(f"{args.chunks} chunks, {len(matrices)} documents, {args.workers} worker threads")
+    print(f"{'shards':>7} {'exhaustive ms':>14} {'pruned ms':>10}")
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for n_shards in args.shards:
+            shard_chunks = -(-args.chunks // n_shards)
+            sharded = ShardedMatrix(matrices, shard_chunks)
+            assert list(sharded.top_k(QUERY, TOP_K, executor)) == expected
+
+            exhaustive_ms = timed(lambda: sharded.top_k(QUERY, TOP_K, executor, prune=False), repeat=5)
+            pruned_ms = timed(lambda: sharded.top_k(QUERY, TOP_K, executor), repeat=5)
+            print(f"{len(sharded.shards):>7} {exhaustive_ms:>14.2f} {pruned_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
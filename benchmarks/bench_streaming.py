@@ -0,0 +1,103 @@
+"""
+Benchmark: time to first byte of a reply, buffered vs. streamed (SSE),
+against the local fake LLM provider
+
+The app is driven at the ASGI level so the moment the first body byte is
+sent can be timed (HTTP test clients buffer whole responses).
+
+Usage:
+    python -m benchmarks.bench_streaming [--latency 0.3] [--token-ms 20] [--words 10 100 400]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.database import Base, get_db
+from app.models import Conversation, User
+from benchmarks.bench_tokenizer import resolve_encoding
+
+
+async def first_and_last_byte(app, path: str, payload: dict) -> tuple[float, float]:
+    """POST ``payload`` to ``path``; return seconds to the first and the last body byte"""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json"), (b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80)
+    }
+    done = asyncio.Event()
+    times = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 201, message
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                times.append(time.perf_counter())
+            if not message.get("more_body"):
+                done.set()
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return times[0] - started, times[-1] - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds to the first token")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="milliseconds per further token")
+    parser.add_argument("--words", type=int, nargs="+", default=[10, 100, 400])
+    args = parser.parse_args()
+
+    resolve_encoding()  # local encoding when the real one cannot be downloaded
+    settings.LLM_PROVIDER = "fake"
+    settings.FAKE_LLM_LATENCY_SECONDS = args.latency
+    settings.FAKE_LLM_TOKEN_SECONDS = args.token_ms / 1000
+    from app.main import app  # noqa: E402  (after the provider is set)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(directory, 'stream.db')}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            connection.execute(insert(User), [{"id": 1, "username": "u", "email": "u@example.com"}])
+            connection.execute(insert(Conversation), [{"id": 1, "user_id": 1, "mode": "open"}])
+        SessionLocal = sessionmaker(bind=engine)
+
+        def bench_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = bench_db
+
+        print(f"fake provider: {args.latency:.2f} s to first token, {args.token_ms:.0f} ms per token")
+        print(f"{'reply words':>11} {'buffered ttfb ms':>17} {'streamed ttfb ms':>17} {'streamed total ms':>18}")
+        for words in args.words:
+            # The fake provider echoes the message back
+            payload = {"content": " ".join(["word"] * words)}
+            buffered, _ = asyncio.run(first_and_last_byte(app, "/api/v1/conversations/1/messages", payload))
+            streamed, total = asyncio.run(first_and_last_byte(app, "/api/v1/conversations/1/messages/stream", payload))
+            print(f"{words:>11} {buffered * 1000:>17.0f} {streamed * 1000:>17.0f} {total * 1000:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: token counting and context-window assembly, per-call encoder
+resolution and list inserts vs. the cached, batched tokenizer
+
+Uses the real cl100k_base encoding when it can be loaded, otherwise a
+local byte-level encoding (absolute times then differ from production,
+the relative costs of resolution, caching and assembly do not).
+
+Usage:
+    python -m benchmarks.bench_tokenizer [--sizes 10 100 1000]
+"""
+import argparse
+
+import tiktoken
+import tiktoken.registry
+
+from app.utils import tokenizer
+from app.utils.context_manager import build_context_window
+from app.utils.tokenizer import DEFAULT_MODEL, TokenCounter
+from benchmarks.bench_retrieval import timed
+
+MESSAGE = "The quick brown fox asks how retrieval ranks chunks, message {i}. " * 4
+
+
+def resolve_encoding():
+    """Return (per-call resolver as the old code used it, encoding name)"""
+    try:
+        tiktoken.encoding_for_model(DEFAULT_MODEL)
+        return (lambda: tiktoken.encoding_for_model(DEFAULT_MODEL)), "cl100k_base"
+    except Exception:
+        encoding = tiktoken.Encoding(
+            "bench_bytes",
+            pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\w+| ?\d+| ?[^\s\w]+|\s+""",
+            mergeable_ranks={bytes([i]): i for i in range(256)},
+            special_tokens={}
+        )
+        tiktoken.registry.ENCODINGS["bench_bytes"] = encoding
+        # Same registry lookup encoding_for_model ends in
+        tokenizer._counters[DEFAULT_MODEL] = TokenCounter(encoding, 8 << 20)
+        return (lambda: tiktoken.get_encoding("bench_bytes")), "local byte-level"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    resolve, name = resolve_encoding()
+    counter = tokenizer.get_token_counter(DEFAULT_MODEL)
+
+    def legacy_count(text):
+        return len(resolve().encode(text))
+
+    def legacy_window(messages, system_prompt, max_tokens):
+        context = [{"role": "system", "content": system_prompt}]
+        total_tokens = legacy_count(system_prompt)
+        for msg in reversed(messages):
+            msg_tokens = legacy_count(msg["content"])
+            if total_tokens + msg_tokens > max_tokens:
+                break
+            context.insert(1, msg)
+            total_tokens += msg_tokens
+        return context
+
+    def cold_window(messages):
+        counter.cache.clear()
+        return build_context_window(messages, "You are helpful.", 10**9)
+
+    print(f"encoding: {name}")
+    print(
+        f"{'messages':>9} {'legacy ms':>10} {'cold ms':>8} {'cached ms':>10} {'stored ms':>10}"
+        f" {'bulk loop ms':>13} {'bulk batch ms':>14}"
+    )
+    for size in args.sizes:
+        messages = [{"role": "user", "content": MESSAGE.format(i=i)} for i in range(size)]
+        stored = [dict(message, tokens=counter.count(message["content"])) for message in messages]
+        texts = [message["content"] for message in messages]
+        assert legacy_window(messages, "You are helpful.", 10**9) == cold_window(messages)
+
+        legacy_ms = timed(lambda: legacy_window(messages, "You are helpful.", 10**9))
+        cold_ms = timed(lambda: cold_window(messages))
+        cached_ms = timed(lambda: build_context_window(messages, "You are helpful.", 10**9))
+        stored_ms = timed(lambda: build_context_window(stored, "You are helpful.", 10**9))
+        loop_ms = timed(lambda: [legacy_count(text) for text in texts])
+
+        def batch():
+            counter.cache.clear()
+            return counter.count_batch(texts)
+
+        batch_ms = timed(batch)
+        print(
+            f"{size:>9} {legacy_ms:>10.2f} {cold_ms:>8.2f} {cached_ms:>10.2f} {stored_ms:>10.2f}"
+            f" {loop_ms:>13.2f} {batch_ms:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -84,3 +84,227 @@ def test_delete_nonexistent_conversation():
     """Test deleting a conversation that doesn't exist"""
     response = client.delete("/api/v1/conversations/99999")
     assert response.status_code == 404
+
+
+def test_stream_document_upload(monkeypatch):
+    """Test uploading a document as a streamed (chunked) request body"""
+    from app.models import Document
+    from app.services.rag_service import RAGService, chunk_row_text
+    
+    # Keep the test offline: tiktoken downloads its encodings on first use
+    monkeypatch.setattr("app.services.rag_service.count_tokens", lambda text: len(text.split()))
+    
+    content = " ".join(f"wörd{i}" for i in range(2000))
+    encoded = content.encode("utf-8")
+    
+    def body():
+        # Odd block size splits multi-byte characters across blocks
+        for start in range(0, len(encoded), 999):
+            yield encoded[start:start + 999]
+    
+    response = client.post("/api/v1/documents/stream?title=Streamed", content=body())
+    assert response.status_code == 201
+    assert response.json()["chunk_count"] == len(RAGService().chunk_document(content))
+    
+    db = TestingSessionLocal()
+    document = db.get(Document, response.json()["id"])
+    assert document.content == content
+    assert document.term_index["chunk_count"] == document.chunk_count
+    # Chunks are stored as offsets into the content, not as copies of it
+    assert document.chunks[1].text == ""
+    assert chunk_row_text(document.chunks[1], document.content) == RAGService().chunk_document(content)[1]["text"]
+    db.close()
+
+
+def test_bulk_document_upload(monkeypatch):
+    """Test bulk ingestion with per-document statuses"""
+    monkeypatch.setattr(
+        "app.services.document_service.count_tokens_batch", lambda texts: [len(text.split()) for text in texts]
+    )
+    monkeypatch.setattr("app.config.settings.BULK_INGEST_WORKERS", 2)
+    
+    response = client.post(
+        "/api/v1/documents/bulk",
+        json={
+            "documents": [
+                {"title": "First", "content": "Machine learning is a subset of AI"},
+                {"title": "Blank", "content": "   "},
+                {"title": "Second", "content": " ".join(["python"] * 1200)}
+            ]
+        }
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert data["created"] == 2
+    assert data["failed"] == 1
+    assert [result["status"] for result in data["results"]] == ["created", "failed", "created"]
+    # Repetitive windows collapse to one chunk
+    assert data["results"][2]["chunk_count"] == 1
+    assert data["results"][2]["duplicate_chunk_count"] == 2
+    assert data["results"][0]["id"] is not None
+
+
+def test_document_response_counts_duplicates(monkeypatch):
+    """Test that single-document uploads report collapsed chunks and the version"""
+    monkeypatch.setattr("app.services.rag_service.count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(
+        "app.services.document_service.count_tokens_batch", lambda texts: [len(text.split()) for text in texts]
+    )
+    content = " ".join(["python"] * 1200)
+    
+    for response in (
+        client.post("/api/v1/documents", json={"title": "Repeated", "content": content}),
+        client.post("/api/v1/documents/stream?title=Repeated", content=content)
+    ):
+        assert response.status_code == 201
+        assert response.json()["chunk_count"] == 1
+        assert response.json()["duplicate_chunk_count"] == 2
+        assert response.json()["version"] == 1
+
+
+def test_archive_document_upload(monkeypatch):
+    """Test bulk ingestion from a zip archive"""
+    import io
+    import zipfile
+    
+    monkeypatch.setattr(
+        "app.services.document_service.count_tokens_batch", lambda texts: [len(text.split()) for text in texts]
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("docs/a.txt", "Neural networks are used in deep learning")
+        archive.writestr("docs/b.md", "Python is a popular programming language")
+    
+    response = client.post(
+        "/api/v1/documents/bulk/archive",
+        files={"archive": ("docs.zip", buffer.getvalue(), "application/zip")}
+    )
+    assert response.status_code == 201
+    assert [result["title"] for result in response.json()["results"]] == ["a.txt", "b.md"]
+    
+    response = client.post(
+        "/api/v1/documents/bulk/archive",
+        files={"archive": ("docs.zip", b"not an archive", "application/zip")}
+    )
+    assert response.status_code == 400
+
+
+def test_incremental_document_update(monkeypatch):
+    """Test that an edit re-chunks only the edited region and bumps the version"""
+    import json
+    from app.models import Document
+    from app.services.rag_service import RAGService, chunk_row_text
+    
+    monkeypatch.setattr("app.services.rag_service.count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(
+        "app.services.document_service.count_tokens_batch", lambda texts: [len(text.split()) for text in texts]
+    )
+    
+    words = [f"term{i}" for i in range(3000)]
+    response = client.post("/api/v1/documents/stream?title=Editable", content=" ".join(words))
+    document_id = response.json()["id"]
+    assert response.json()["version"] == 1
+    
+    # Word windows realign after an edit that keeps the word count
+    words[1500] = "edited"
+    content = " ".join(words)
+    response = client.put(f"/api/v1/documents/{document_id}", json={"content": content, "expected_version": 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["version"] == 2
+    assert data["incremental"] is True
+    assert data["chunks_reused"] > data["chunks_rechunked"]
+    
+    # Same chunks, offsets and index as chunking the new content from scratch
+    service = RAGService()
+    expected = service.chunk_document(content)
+    db = TestingSessionLocal()
+    document = db.get(Document, document_id)
+    assert [chunk_row_text(chunk, content) for chunk in document.chunks] == [chunk["text"] for chunk in expected]
+    assert [chunk.start_offset for chunk in document.chunks] == [chunk["start"] for chunk in expected]
+    assert document.term_index == json.loads(json.dumps(service.build_index(expected), default=list))
+    db.close()
+    
+    # Line breaks and repeated spaces: stored chunks still match re-chunked ones
+    lines = [" ".join(words[i:i + 100]) for i in range(0, len(words), 100)]
+    content = "\n".join(line.replace(" ", "  ", 1) for line in lines)
+    response = client.put(f"/api/v1/documents/{document_id}", json={"content": content})
+    assert response.json()["incremental"] is True
+    content = content.replace("term500", "changed", 1)
+    response = client.put(f"/api/v1/documents/{document_id}", json={"content": content})
+    data = response.json()
+    assert data["chunks_reused"] > data["chunks_rechunked"]
+    db = TestingSessionLocal()
+    document = db.get(Document, document_id)
+    assert [chunk_row_text(chunk, content) for chunk in document.chunks] == [
+        chunk["text"] for chunk in service.chunk_document(content)
+    ]
+    assert all(chunk.token_count == len(chunk_row_text(chunk, content).split()) for chunk in document.chunks)
+    db.close()
+    
+    # Collapsed near-duplicates are recounted for the edited region
+    from app.services.document_service import prepare_document
+    repeated = " ".join(words[:1000] + ["python"] * 1200 + words[2200:])
+    for content in (repeated, repeated.replace("term2500", "other", 1), " ".join(words)):
+        data = client.put(f"/api/v1/documents/{document_id}", json={"content": content}).json()
+        assert data["incremental"] is True
+        assert data["duplicate_chunk_count"] == prepare_document(content)["duplicate_chunk_count"]
+    assert data["duplicate_chunk_count"] == 0
+    
+    # A stale expected_version is rejected
+    response = client.put(f"/api/v1/documents/{document_id}", json={"content": "stale", "expected_version": 1})
+    assert response.status_code == 409
+    assert client.put("/api/v1/documents/99999", json={"content": "missing"}).status_code == 404
+
+
+def test_stream_message(monkeypatch):
+    """Test that a streamed reply arrives as token events and is then stored"""
+    import json
+    from app.api.messages import conversation_service
+    from app.models import Conversation, Message, User
+    from app.services.fake_llm import AsyncFakeLLMClient
+    from app.services.provider_pool import Backend, ProviderPool
+    
+    words = lambda text: len(text.split())
+    for target in (
+        "app.services.conversation_service.count_tokens",
+        "app.services.llm_service.count_tokens",
+        "app.utils.context_manager.count_tokens"
+    ):
+        monkeypatch.setattr(target, words)
+    monkeypatch.setattr(
+        conversation_service.llm_service, "pool", ProviderPool([Backend("fake", None, AsyncFakeLLMClient())])
+    )
+    
+    db = TestingSessionLocal()
+    if not db.get(User, 1):
+        db.add(User(id=1, username="user_1", email="user_1@example.com"))
+    conversation = Conversation(user_id=1, mode="open")
+    db.add(conversation)
+    db.commit()
+    conversation_id = conversation.id
+    db.close()
+    
+    response = client.post(
+        f"/api/v1/conversations/{conversation_id}/messages/stream",
+        json={"content": "stream this reply please"}
+    )
+    assert response.status_code == 201
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in response.text.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["token"] * 6 + ["message"]
+    streamed = "".join(data["content"] for _, data in events[:-1])
+    assert streamed == "You said: stream this reply please"
+    
+    pair = events[-1][1]
+    assert pair["assistant_message"]["content"] == streamed
+    db = TestingSessionLocal()
+    stored = db.get(Message, pair["assistant_message"]["id"])
+    assert stored.content == streamed and stored.tokens_used > 0
+    db.close()
+    
+    missing = client.post("/api/v1/conversations/999999/messages/stream", json={"content": "hi"})
+    assert missing.status_code == 404
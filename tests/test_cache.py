@@ -0,0 +1,53 @@
+"""
+Test the memory-bounded LRU cache
+"""
+from app.utils.cache import LRUCache
+
+
+def test_lru_eviction_by_memory():
+    """Test that entries are evicted least-recently-used once the budget is exceeded"""
+    cache = LRUCache(max_bytes=1000, sizeof=lambda value: 100)
+    for key in range(5):
+        cache.set(key, key)
+    assert len(cache) == 5 and cache.current_bytes == 1000
+    
+    cache.get(0)  # 0 becomes most recently used
+    cache.set(5, 5)
+    assert cache.get(1) is None
+    assert cache.get(0) == 0
+    assert cache.evictions == 1
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_oversized_values_not_cached():
+    """Test that a value larger than the whole budget is skipped"""
+    cache = LRUCache(max_bytes=200)
+    cache.set("small", "x")
+    cache.set("big", "x" * 1000)
+    assert cache.get("big") is None
+    assert cache.get("small") == "x"
+
+
+def test_ttl_expiry(monkeypatch):
+    """Test that expired entries count as misses"""
+    now = [100.0]
+    monkeypatch.setattr("app.utils.cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(max_bytes=10000, ttl_seconds=10)
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    now[0] += 11
+    assert cache.get("key") is None
+    assert len(cache) == 0 and cache.current_bytes == 0
+    
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_invalidate_by_predicate():
+    """Test removing matching entries"""
+    cache = LRUCache(max_bytes=10000)
+    for key in range(6):
+        cache.set(key, str(key))
+    assert cache.invalidate(lambda key: key % 2 == 0) == 3
+    assert sorted(cache._entries) == [1, 3, 5]
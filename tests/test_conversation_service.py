@@ -25,3 +25,219 @@ def test_llm_service_title_generation():
     title = service.llm_service.generate_title(long_message)
     assert len(title) <= 53  # 50 chars + "..."
     assert title.endswith("...")
+
+
+def test_history_window_uses_stored_token_counts(monkeypatch):
+    """Test that only the newest messages fitting the budget are loaded, from stored counts"""
+    import random
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base
+    from app.models import Conversation, Message, User
+    from app.utils.context_manager import build_context_window
+    
+    counted = []
+    monkeypatch.setattr(
+        "app.services.conversation_service.count_tokens_batch",
+        lambda texts: counted.extend(texts) or [len(text.split()) for text in texts]
+    )
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, username="u", email="u@example.com"))
+    db.add(Conversation(id=1, user_id=1, mode="open"))
+    db.commit()
+    
+    rng = random.Random(1)
+    rows = []
+    for i in range(3000):
+        words = rng.randint(1, 40)
+        rows.append({
+            "conversation_id": 1,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(["word"] * words),
+            # The newest few predate stored counts
+            "prompt_tokens": None if i >= 2995 else words
+        })
+    db.execute(insert(Message), rows)
+    db.commit()
+    
+    service = ConversationService()
+    history = service._load_history(db, 1, max_tokens=500)
+    
+    # Exactly the longest suffix of the conversation within the budget
+    total, expected = 0, 0
+    for row in reversed(rows):
+        total += len(row["content"].split())
+        if total > 500:
+            break
+        expected += 1
+    assert [message["content"] for message in history] == [row["content"] for row in rows[-expected:]]
+    assert [message["tokens"] for message in history] == [len(row["content"].split()) for row in rows[-expected:]]
+    
+    # Only the uncounted messages were tokenized, and their counts were stored
+    assert len(counted) == 5
+    db.commit()
+    assert db.query(Message).filter(Message.prompt_tokens.is_(None)).count() == 0
+    
+    # Windows longer than the first scan widen it
+    history = service._load_history(db, 1, max_tokens=4000)
+    total = sum(message["tokens"] for message in history)
+    assert len(history) > 128 and total <= 4000
+    assert total + len(rows[-len(history) - 1]["content"].split()) > 4000
+    
+    monkeypatch.setattr("app.utils.context_manager.count_tokens", lambda text: len(text.split()))
+    context = build_context_window(history, "be brief", max_tokens=500)
+    assert context[0] == {"role": "system", "content": "be brief"}
+    assert set(context[1]) == {"role", "content"}
+
+
+def test_rolling_summary_bounds_prompt_size(monkeypatch):
+    """Test that compaction keeps prompts to summary plus recent turns"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.config import settings
+    from app.database import Base
+    from app.models import Conversation, User
+    from app.utils.summarizer import extractive_summary
+    
+    def words(text):
+        return len(text.split())
+    
+    monkeypatch.setattr(settings, "CONTEXT_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(settings, "SUMMARY_BACKEND", "extractive")
+    monkeypatch.setattr(settings, "SUMMARY_TRIGGER_TOKENS", 300)
+    monkeypatch.setattr(settings, "SUMMARY_KEEP_RECENT_TOKENS", 100)
+    monkeypatch.setattr(settings, "SUMMARY_MAX_TOKENS", 60)
+    monkeypatch.setattr("app.services.conversation_service.count_tokens", words)
+    monkeypatch.setattr("app.services.conversation_service.count_tokens_batch", lambda texts: [words(t) for t in texts])
+    
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, username="u", email="u@example.com"))
+    db.add(Conversation(id=1, user_id=1, mode="open"))
+    db.commit()
+    
+    service = ConversationService()
+    prompts = []
+    
+    def generate_response(messages, system_prompt, **budget):
+        prompts.append(words(system_prompt) + sum(words(m["content"]) for m in messages))
+        return "Noted. The retrieval ranking uses BM25 over chunk terms.", 20
+    
+    monkeypatch.setattr(service.llm_service, "generate_response", generate_response)
+    
+    compactions = 0
+    for turn in range(80):
+        service.add_message(db, 1, f"Turn {turn} asks about topic{turn % 7} and ranking. Please explain chunk scoring again.")
+        if service.needs_compaction(db, 1):
+            compactions += service.compact_history(db, 1)
+    
+    conversation = db.get(Conversation, 1)
+    assert compactions > 1
+    assert conversation.summary and words(conversation.summary) <= 60
+    # Prompt size stops growing once compaction kicks in
+    assert max(prompts[40:]) <= 300 + 60 + 20
+    assert max(prompts[40:]) < sum(prompts[:40]) / 2
+    
+    # A summary that did not move is not overwritten by a stale compaction
+    assert not service.compact_history(db, 1)
+    
+    summary = extractive_summary(
+        ["Cats purr. Cats sleep a lot. Dogs bark.", "Cats and dogs play."], max_tokens=8, count_tokens=words
+    )
+    assert summary == "Cats sleep a lot. Cats and dogs play."
+
+
+@pytest.mark.asyncio
+async def test_async_messages_do_not_hold_threads(monkeypatch, tmp_path):
+    """Test that concurrent async turns overlap their LLM calls beyond the threadpool size"""
+    import asyncio
+    import time
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base
+    from app.models import Conversation, Message, User
+    from app.services.fake_llm import AsyncFakeLLMClient
+    from app.services.provider_pool import Backend, ProviderPool
+    from app.utils.resilience import AdaptiveLimiter
+    
+    words = lambda text: len(text.split())
+    for target in (
+        "app.services.conversation_service.count_tokens",
+        "app.services.llm_service.count_tokens",
+        "app.utils.context_manager.count_tokens"
+    ):
+        monkeypatch.setattr(target, words)
+    
+    engine = create_engine(f"sqlite:///{tmp_path / 'async.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    turns = 100  # well beyond the default 40 threadpool workers
+    with Session() as db:
+        db.add(User(id=1, username="u", email="u@example.com"))
+        db.add_all([Conversation(id=i, user_id=1, mode="open") for i in range(1, turns + 1)])
+        db.commit()
+    
+    service = ConversationService()
+    service.llm_service.pool = ProviderPool([Backend(
+        "fake", None, AsyncFakeLLMClient(latency=1.0),
+        limiter=AdaptiveLimiter(initial=turns, max_limit=turns)  # measure the app, not the limit
+    )])
+    
+    async def turn(conversation_id):
+        with Session() as db:
+            _, assistant = await service.aadd_message(db, conversation_id, f"hello {conversation_id}")
+            return assistant.content
+    
+    started = time.perf_counter()
+    replies = await asyncio.gather(*(turn(i) for i in range(1, turns + 1)))
+    elapsed = time.perf_counter() - started
+    
+    assert replies[0] == "You said: hello 1"
+    # Serialized through 40 threads this would take at least 3 latencies
+    assert elapsed < 2.5
+    with Session() as db:
+        assert db.query(Message).count() == 2 * turns
+
+
+@pytest.mark.asyncio
+async def test_closed_stream_cancels_upstream(monkeypatch):
+    """Test that closing a response stream midway stops the provider call and stores nothing"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.database import Base
+    from app.models import Conversation, Message, User
+    from app.services.fake_llm import AsyncFakeLLMClient
+    from app.services.provider_pool import Backend, ProviderPool
+    
+    words = lambda text: len(text.split())
+    for target in (
+        "app.services.conversation_service.count_tokens",
+        "app.services.llm_service.count_tokens",
+        "app.utils.context_manager.count_tokens"
+    ):
+        monkeypatch.setattr(target, words)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, username="u", email="u@example.com"))
+    db.add(Conversation(id=1, user_id=1, mode="open"))
+    db.commit()
+    
+    service = ConversationService()
+    fake = AsyncFakeLLMClient(token_interval=0.01)
+    service.llm_service.pool = ProviderPool([Backend("fake", None, fake)])
+    _, stream = await service.astream_message(db, 1, "one two three four five six")
+    received = []
+    async for delta in stream:
+        received.append(delta)
+        if len(received) == 2:
+            break
+    await stream.aclose()
+    
+    assert received == ["You", " said:"]
+    assert fake.closed_streams == 1 and fake.in_flight == 0
+    assert db.query(Message).count() == 0
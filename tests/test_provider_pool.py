@@ -0,0 +1,181 @@
+"""
+Test routing across LLM backends
+"""
+import time
+import httpx
+import pytest
+from app.services import fake_llm
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.openai_client import AsyncOpenAICompatibleClient, OpenAICompatibleClient, ProviderHTTPError
+from app.services.provider_pool import Backend, ProviderPool, parse_reset
+from app.utils.error_handler import ProviderUnavailableError
+from app.utils.resilience import CircuitBreaker
+from app.utils.response_cache import ResponseCache
+
+
+class ProviderError(Exception):
+    """An HTTP error shaped like the SDK's"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = httpx.Response(status_code, headers={} if retry_after is None else {"retry-after": retry_after})
+
+
+class ScriptedClient(FakeLLMClient):
+    """Fake client raising the given errors first, then answering"""
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def create(self, **kwargs):
+        if self.errors:
+            self.calls += 1
+            raise self.errors.pop(0)
+        return super().create(**kwargs)
+
+
+def _backend(name, client=None, **kwargs):
+    return Backend(name, client or FakeLLMClient(), AsyncFakeLLMClient(), **kwargs)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """An LLM service without response cache or coalescing"""
+    from app.services.llm_service import LLMService
+    words = lambda text: len(text.split())
+    for target in ("app.services.llm_service.count_tokens", "app.utils.context_manager.count_tokens"):
+        monkeypatch.setattr(target, words)
+    llm = LLMService()
+    llm.response_cache = ResponseCache(0)
+    llm.coalesce = False
+    llm.max_retries = 3
+    llm.retry_delay = 0.001
+    return llm
+
+
+def test_reset_headers_are_parsed():
+    """Test the duration formats providers use in x-ratelimit-reset-*"""
+    assert parse_reset("7.66s") == pytest.approx(7.66)
+    assert parse_reset("2m59.56s") == pytest.approx(179.56)
+    assert parse_reset("120ms") == pytest.approx(0.12)
+    assert parse_reset("1h") == 3600.0
+    assert parse_reset("30") == 30.0
+    assert parse_reset("soon") is None and parse_reset(None) is None
+
+
+def test_routing_prefers_fast_backends_with_quota():
+    """Test that picks follow latency and quota, and skip exhausted or cooling backends"""
+    slow, fast = _backend("slow"), _backend("fast")
+    pool = ProviderPool([slow, fast])
+    slow.record_latency(0.8)
+    fast.record_latency(0.2)
+    assert {pool.pick().name for _ in range(5)} == {"fast"}
+
+    fast.observe_headers({
+        "x-ratelimit-limit-requests": "1000",
+        "x-ratelimit-remaining-requests": "10",
+        "x-ratelimit-reset-requests": "30s"
+    })
+    assert pool.pick() is slow  # 1% of the quota left costs more than the latency saves
+
+    fast.observe_headers({"x-ratelimit-limit-requests": "1000", "x-ratelimit-remaining-requests": "0"})
+    slow.cool_down(60)
+    with pytest.raises(ProviderUnavailableError) as raised:
+        pool.pick()
+    assert int(raised.value.headers["Retry-After"]) >= 29
+
+
+def test_new_backends_get_tried():
+    """Test that a backend without latency samples is ranked at the pool average"""
+    known, new = _backend("known"), _backend("new")
+    known.record_latency(0.5)
+    pool = ProviderPool([known, new])
+    assert {pool.pick().name for _ in range(4)} == {"known", "new"}
+
+
+def test_failures_fail_over_without_waiting(service):
+    """Test that a 503 or a 429 moves the retry to another backend at once"""
+    first = _backend("first", ScriptedClient(ProviderError(503), ProviderError(429, "30")))
+    second = _backend("second")
+    first.record_latency(0.1)
+    second.record_latency(0.5)
+    service.pool = ProviderPool([first, second])
+    service.retry_delay = 5.0
+
+    started = time.perf_counter()
+    assert service.generate_response([{"role": "user", "content": "hi"}])[0] == "You said: hi"
+    assert service.generate_response([{"role": "user", "content": "hi"}])[0] == "You said: hi"
+    assert time.perf_counter() - started < 1.0
+    assert (first.client.calls, second.client.calls) == (2, 2)
+    assert first.stats()["cooling_down"] and not second.stats()["cooling_down"]
+    assert service.pool.pick() is second
+
+
+def test_health_checks_eject_and_readmit():
+    """Test that a failing ping opens the breaker and a passing one closes it"""
+
+    class PingedClient(FakeLLMClient):
+        healthy = False
+
+        def ping(self):
+            if not self.healthy:
+                raise ConnectionError("down")
+
+    flaky = _backend("flaky", PingedClient(), breaker=CircuitBreaker(failure_threshold=5, cooldown_seconds=60))
+    steady = _backend("steady")
+    pool = ProviderPool([flaky, steady])
+    pool.check_health()
+    assert flaky.breaker.state == "open"
+    assert {pool.pick().name for _ in range(4)} == {"steady"}
+
+    flaky.client.healthy = True
+    pool.check_health()
+    assert flaky.breaker.state == "closed"
+    assert "flaky" in {pool.pick().name for _ in range(4)}
+
+
+def test_openai_client_reads_completions_and_quota():
+    """Test the blocking OpenAI-compatible client, its quota headers and error statuses"""
+
+    def handler(request):
+        if request.url.path.endswith("/models"):
+            return httpx.Response(503, text="warming up")
+        return httpx.Response(
+            200,
+            json={
+                "choices": [{"message": {"role": "assistant", "content": "hello"}}],
+                "usage": {"completion_tokens": 1, "total_tokens": 5}
+            },
+            headers={"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "42"}
+        )
+
+    client = OpenAICompatibleClient("http://local/v1", transport=httpx.MockTransport(handler))
+    backend = Backend("local", client, None, model="served-model")
+    response = backend.complete({"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+    assert response.choices[0].message.content == "hello"
+    assert response.usage.total_tokens == 5
+    assert backend.remaining_requests == 42
+    with pytest.raises(ProviderHTTPError) as raised:
+        backend.ping()
+    assert raised.value.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_streaming_from_the_stand_in_server(service, monkeypatch):
+    """Test a streamed reply from the stand-in server through the async client"""
+    monkeypatch.setattr(fake_llm, "_stand_in_client", AsyncFakeLLMClient(latency=0.0, token_interval=0.0))
+    client = AsyncOpenAICompatibleClient(
+        "http://stand-in/v1", transport=httpx.ASGITransport(app=fake_llm.stand_in_app)
+    )
+    service.pool = ProviderPool([Backend("stand-in", None, client)])
+
+    stream = await service.astream_response([{"role": "user", "content": "stream this please"}])
+    text = "".join([delta async for delta in stream])
+    content, tokens = stream.finish()
+    assert text == content == "You said: stream this please"
+    assert tokens > 0
+    assert (await service.agenerate_response([{"role": "user", "content": "and this"}]))[0] == "You said: and this"
+    await client.ping()
+    await client.close()
@@ -66,3 +66,341 @@ def test_chunk_retrieval():
     assert len(relevant_chunks) > 0
     # First chunk should be most relevant
     assert "machine learning" in relevant_chunks[0].lower()
+
+
+def test_index_matches_whole_tokens():
+    """Test that retrieval matches whole tokens, not substrings"""
+    service = RAGService()
+    
+    chunks = [
+        {"index": 0, "text": "The party starts at nine with a band"},
+        {"index": 1, "text": "Modern art museums display art from many eras"}
+    ]
+    index = service.build_index(chunks)
+    
+    assert "art" in index["postings"]
+    assert [list(column) for column in index["postings"]["art"]] == [[1], [2]]
+    assert "party" in index["postings"]
+    assert index["chunk_count"] == 2
+    
+    relevant_chunks = service.retrieve_relevant_chunks("art", chunks, index)
+    assert relevant_chunks[0] == chunks[1]["text"]
+
+
+def test_retrieve_from_documents():
+    """Test BM25 retrieval across documents, loading only the top-K chunk rows"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base
+    from app.models import Document, DocumentChunk
+    
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    
+    service = RAGService()
+    service.retrieval_cache.clear()
+    first_chunks = [
+        {"index": 0, "text": "Python is a popular programming language"},
+        {"index": 1, "text": "Gardening tips for spring tomatoes"}
+    ]
+    second_chunks = [
+        {"index": 0, "text": "Neural networks are used in deep learning"}
+    ]
+    documents = []
+    for title, chunks, index in [
+        ("first", first_chunks, service.build_index(first_chunks)),
+        # Legacy document without a persisted index
+        ("second", second_chunks, None)
+    ]:
+        document = Document(title=title, content="", chunk_count=len(chunks), term_index=index)
+        document.chunks = [
+            DocumentChunk(chunk_index=chunk["index"], text=chunk["text"]) for chunk in chunks
+        ]
+        db.add(document)
+        documents.append(document)
+    db.commit()
+    
+    relevant_chunks = service.retrieve_from_documents(db, "deep learning networks", documents)
+    assert relevant_chunks[0] == second_chunks[0]["text"]
+    assert len(relevant_chunks) == min(service.top_k, 3)
+    
+    # Same keywords in another order/case hit the cache
+    hits = service.retrieval_cache.hits
+    assert service.retrieve_from_documents(db, "Networks, deep learning?", documents) == relevant_chunks
+    assert service.retrieval_cache.hits == hits + 1
+    
+    # A changed document changes the fingerprint; invalidation frees its entries
+    documents[1].version = 2
+    db.commit()
+    assert service.invalidate_documents([documents[1].id]) == 1
+    misses = service.retrieval_cache.misses
+    service.retrieve_from_documents(db, "deep learning networks", documents)
+    assert service.retrieval_cache.misses == misses + 1
+
+
+def test_chunk_offsets():
+    """Test that chunks record their character offsets into the content"""
+    service = RAGService()
+    service.chunk_size, service.chunk_overlap = 4, 1
+    
+    content = "alpha  beta\ngamma delta epsilon zeta eta"
+    chunks = service.chunk_document(content)
+    
+    assert [chunk["text"] for chunk in chunks] == [
+        "alpha  beta\ngamma delta", "delta epsilon zeta eta", "eta"
+    ]
+    for chunk in chunks:
+        assert content[chunk["start"]:chunk["end"]] == chunk["text"]
+    
+    pieces = [content[i:i + 3] for i in range(0, len(content), 3)]
+    assert list(service.iter_chunks(pieces)) == chunks
+
+
+def test_token_chunking_respects_sentences(monkeypatch):
+    """Test token-budget chunks end on sentence boundaries, however the text is streamed"""
+    monkeypatch.setattr("app.services.rag_service.count_tokens", lambda text: len(text.split()))
+    service = RAGService()
+    service.chunking_mode = "tokens"
+    service.chunk_tokens, service.chunk_overlap_tokens = 12, 4
+    
+    content = (
+        "Retrieval finds relevant chunks. Prompts are measured in tokens!\n\n"
+        "A new paragraph begins here. It has two sentences. "
+        + " ".join(f"word{i}" for i in range(30)) + "."
+    )
+    chunks = service.chunk_document(content)
+    
+    assert chunks[0]["text"] == "Retrieval finds relevant chunks. Prompts are measured in tokens!"
+    for chunk in chunks:
+        assert content[chunk["start"]:chunk["end"]] == chunk["text"]
+        assert chunk["token_count"] <= service.chunk_tokens
+    # The overlong final sentence is split between words
+    assert chunks[-1]["text"].endswith("word29.")
+    
+    pieces = [content[i:i + 7] for i in range(0, len(content), 7)]
+    assert list(service.iter_chunks(pieces)) == chunks
+
+
+def test_rag_prompt_packs_chunks_by_token_budget(monkeypatch):
+    """Test that prompt assembly uses stored token counts and respects the budget"""
+    from app.services.rag_service import RetrievedChunk
+    
+    def fail(text):
+        raise AssertionError("stored token counts should be used")
+    monkeypatch.setattr("app.services.rag_service.count_tokens", fail)
+    service = RAGService()
+    
+    chunks = [
+        RetrievedChunk("best chunk", 60),
+        RetrievedChunk("too large chunk", 50),
+        RetrievedChunk("small chunk", 20)
+    ]
+    assert service.pack_chunks(chunks, 100) == ["best chunk", "small chunk"]
+    
+    prompt = service.build_rag_prompt("query", chunks, max_tokens=100)
+    assert "best chunk\n\nsmall chunk" in prompt
+    assert "too large chunk" not in prompt
+
+
+def test_sparse_scoring_matches_reference_bm25():
+    """Test that the vectorized engine reproduces the reference BM25 scores"""
+    import math
+    import numpy as np
+    from app.utils.inverted_index import BM25_B, BM25_K1, build_index, tokenize
+    from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix, top_k_rows
+    
+    texts_a = ["apple banana cherry", "banana banana split", "cherry pie recipe"]
+    texts_b = ["apple pie with cherry", "nothing relevant here"]
+    indexes = [build_index(texts_a), build_index(texts_b)]
+    
+    stacked = StackedMatrix([ChunkMatrix.from_index(index) for index in indexes])
+    scores = stacked.score(["cherry", "banana"])
+    
+    # Okapi BM25 with corpus statistics over all chunks of both documents
+    chunks = [tokenize(text) for text in texts_a + texts_b]
+    avg_length = sum(map(len, chunks)) / len(chunks)
+    for row, tokens in enumerate(chunks):
+        expected = 0.0
+        for term in ("cherry", "banana"):
+            doc_freq = sum(term in other for other in chunks)
+            idf = math.log(1 + (len(chunks) - doc_freq + 0.5) / (doc_freq + 0.5))
+            tf = tokens.count(term)
+            expected += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_length))
+        assert np.isclose(scores[row], expected)
+    
+    # Unmatched chunks only pad the result, after every matched chunk
+    top = list(top_k_rows(scores, 5))
+    assert top[-1] == 4
+    assert scores[top[0]] == scores.max()
+
+
+def test_pruned_top_k_matches_exhaustive():
+    """Test that MaxScore pruning returns exactly the exhaustive top-K"""
+    import random
+    from app.utils.inverted_index import build_index
+    from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix, top_k_rows
+    
+    rng = random.Random(7)
+    vocab = [f"word{i}" for i in range(40)]
+    skipped = 0
+    for _ in range(200):
+        matrices = []
+        for _ in range(rng.randint(1, 4)):
+            # Skewed term frequencies so some query terms are common
+            texts = [
+                " ".join(rng.choices(vocab, weights=range(40, 0, -1), k=rng.randint(1, 15)))
+                for _ in range(rng.randint(1, 40))
+            ]
+            matrices.append(ChunkMatrix.from_index(build_index(texts)))
+        stacked = StackedMatrix(matrices)
+        query = rng.sample(vocab + ["missing"], rng.randint(1, 4))
+        k = rng.randint(1, 8)
+        
+        expected = list(top_k_rows(stacked.score(query), k))
+        assert list(stacked.top_k(query, k)) == expected
+        skipped += stacked.postings_total - stacked.postings_scored
+    assert skipped > 0
+
+
+def test_near_duplicate_chunks(monkeypatch):
+    """Test SimHash dedup within a document at ingestion and across documents at retrieval"""
+    from app.services.document_service import prepare_document
+    from app.services.rag_service import RetrievedChunk
+    from app.utils.simhash import simhash, hamming_distance
+    
+    monkeypatch.setattr(
+        "app.services.document_service.count_tokens_batch", lambda texts: [len(text.split()) for text in texts]
+    )
+    boilerplate = " ".join(f"legal{i}" for i in range(40))
+    assert hamming_distance(simhash(boilerplate), simhash(boilerplate + " extra")) <= 3
+    
+    # Ingestion: repeated boilerplate windows collapse, indexes stay contiguous
+    service = RAGService()
+    service.chunk_size, service.chunk_overlap = 40, 0
+    monkeypatch.setattr("app.services.document_service._worker_rag_service", service)
+    content = " ".join([boilerplate, "unique text about neural networks " * 8, boilerplate])
+    prepared = prepare_document(content)
+    assert prepared["duplicate_chunk_count"] == 1
+    assert [chunk["index"] for chunk in prepared["chunks"]] == [0, 1]
+    
+    # Retrieval: the same boilerplate from another document is suppressed
+    candidates = [
+        RetrievedChunk(boilerplate, 40, simhash(boilerplate)),
+        RetrievedChunk(boilerplate + " extra", 41),
+        RetrievedChunk("something else entirely different here", 5)
+    ]
+    assert service._suppress_duplicates(candidates) == [candidates[0], candidates[2]]
+    
+    service.dedup_distance = -1
+    assert len(service._suppress_duplicates(candidates)) == 3
+
+
+def test_sharded_search_matches_single_corpus():
+    """Test that shard-parallel search returns the unsharded top-K"""
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from app.utils.inverted_index import build_index
+    from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix, ShardedMatrix, top_k_rows
+    
+    rng = random.Random(3)
+    vocab = [f"word{i}" for i in range(30)]
+    matrices = [
+        ChunkMatrix.from_index(build_index([
+            " ".join(rng.choices(vocab, weights=range(30, 0, -1), k=rng.randint(1, 12)))
+            for _ in range(rng.randint(1, 25))
+        ]))
+        for _ in range(12)
+    ]
+    stacked = StackedMatrix(matrices)
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for shard_chunks in (1, 20, 60, 1000):
+            sharded = ShardedMatrix(matrices, shard_chunks)
+            for _ in range(30):
+                query = rng.sample(vocab, rng.randint(1, 3))
+                k = rng.randint(1, 6)
+                expected = list(top_k_rows(stacked.score(query), k))
+                assert list(sharded.top_k(query, k, executor)) == expected
+                assert list(sharded.top_k(query, k, executor, prune=False)) == expected
+
+
+def test_mapped_index_file_matches_in_memory(tmp_path):
+    """Test that a memory-mapped index file scores exactly like the in-memory matrix"""
+    import random
+    import numpy as np
+    from app.utils.index_file import open_index_file, write_index_file
+    from app.utils.inverted_index import build_index
+    from app.utils.sparse_scoring import ChunkMatrix, StackedMatrix
+    
+    rng = random.Random(5)
+    vocab = [f"word{i}" for i in range(30)] + ["naïve", "日本"]
+    in_memory, mapped = [], []
+    for position in range(4):
+        texts = [" ".join(rng.choices(vocab, k=rng.randint(1, 300))) for _ in range(rng.randint(1, 50))]
+        index = build_index(texts)
+        offsets = [(i * 10, i * 10 + 9) for i in range(len(texts))]
+        vectors = np.random.default_rng(position).random((len(texts), 8), dtype=np.float32)
+        path = str(tmp_path / f"{position}.idx")
+        write_index_file(path, index, position + 1, offsets, vectors)
+        matrix = open_index_file(path)
+        assert matrix.version == position + 1
+        assert matrix.chunk_offsets.tolist() == [list(pair) for pair in offsets]
+        assert np.array_equal(matrix.vectors, vectors)
+        in_memory.append(ChunkMatrix.from_index(index))
+        mapped.append(matrix)
+    
+    expected, actual = StackedMatrix(in_memory), StackedMatrix(mapped)
+    for _ in range(50):
+        query = rng.sample(vocab + ["missing"], rng.randint(1, 3))
+        assert np.array_equal(actual.score(query), expected.score(query))
+        assert list(actual.top_k(query, 5)) == list(expected.top_k(query, 5))
+    
+    (tmp_path / "bad.idx").write_bytes(b"not an index" * 20)
+    with pytest.raises(ValueError):
+        open_index_file(str(tmp_path / "bad.idx"))
+
+
+def test_index_files_follow_ingestion_and_updates(monkeypatch, tmp_path):
+    """Test that ingestion publishes index files that other processes map lazily"""
+    import os
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base
+    from app.schemas.document import DocumentCreate, DocumentUpdate
+    from app.services.document_service import DocumentService
+    from app.utils.index_file import MappedChunkMatrix, index_file_path, open_index_file
+    
+    monkeypatch.setattr(
+        "app.services.document_service.count_tokens_batch", lambda texts: [len(text.split()) for text in texts]
+    )
+    monkeypatch.setattr("app.config.settings.INDEX_DIR", str(tmp_path))
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    
+    document_service = DocumentService()
+    monkeypatch.setattr("app.services.document_service._worker_rag_service", document_service.rag_service)
+    document = document_service.create_document(
+        db, DocumentCreate(title="Doc", content="Python is a popular programming language")
+    )
+    path = index_file_path(str(tmp_path), document.id)
+    assert open_index_file(path).version == 1
+    
+    # A separate service (as in another worker) maps the published file
+    service = RAGService()
+    service.retrieval_cache.clear()
+    assert service.retrieve_from_documents(db, "python", [document]) == [
+        "Python is a popular programming language"
+    ]
+    assert isinstance(service._matrix_cache[(document.id, 1)], MappedChunkMatrix)
+    
+    document_service.update_document(
+        db, document.id, DocumentUpdate(content="Rust is a systems programming language")
+    )
+    assert open_index_file(path).version == 2
+    assert service.retrieve_from_documents(db, "rust", [document]) == [
+        "Rust is a systems programming language"
+    ]
+    # No staged or temporary files are left behind
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
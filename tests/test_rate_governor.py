@@ -0,0 +1,171 @@
+"""
+Test the client-side RPM/TPM rate governor
+"""
+import asyncio
+import threading
+import time
+import pytest
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.error_handler import ProviderUnavailableError
+from app.utils.rate_governor import BATCH, INTERACTIVE, SUMMARY, TITLE, RateGovernor
+from app.utils.response_cache import ResponseCache
+
+
+def _drained(**limits):
+    """A governor with its budgets used up"""
+    governor = RateGovernor(**limits)
+    governor.requests.level = 0
+    governor.tokens.level = 0
+    return governor
+
+
+def test_requests_are_paced_to_the_budget():
+    """Test that calls beyond the RPM budget wait for it to refill"""
+    assert not RateGovernor().enabled
+    governor = _drained(requests_per_minute=1200)  # one every 50 ms
+    started = time.perf_counter()
+    for _ in range(4):
+        governor.acquire(0)
+    assert 0.18 <= time.perf_counter() - started < 0.5
+    stats = governor.stats()["priorities"][INTERACTIVE]
+    assert stats["admitted"] == 4 and stats["max_wait_ms"] > 30
+
+
+def test_tokens_are_estimated_then_settled():
+    """Test that the TPM budget is taken up front and corrected by the actual usage"""
+    governor = RateGovernor(tokens_per_minute=6000)  # 100 per second
+    governor.acquire(5000)
+    governor.settle(5000, 5900)
+    assert governor.stats()["tokens_available"] == pytest.approx(100, abs=5)
+
+    started = time.perf_counter()
+    governor.acquire(120)  # 20 short
+    assert 0.15 <= time.perf_counter() - started < 0.5
+    governor.settle(120, 20)
+    assert governor.stats()["tokens_available"] == pytest.approx(100, abs=5)
+
+    governor.tokens.level = 6000
+    governor.acquire(1_000_000)  # larger than the budget: takes all of it
+    assert governor.stats()["tokens_available"] == pytest.approx(0, abs=5)
+
+
+@pytest.mark.asyncio
+async def test_interactive_calls_jump_the_queue():
+    """Test that queued calls are admitted by priority, then in arrival order"""
+    governor = _drained(requests_per_minute=1200)
+    admitted = []
+
+    async def call(name, priority):
+        await governor.aacquire(10, priority)
+        admitted.append(name)
+
+    tasks = []
+    for name, priority in (
+        ("batch", BATCH), ("summary", SUMMARY), ("title", TITLE),
+        ("chat 1", INTERACTIVE), ("chat 2", INTERACTIVE)
+    ):
+        tasks.append(asyncio.create_task(call(name, priority)))
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    assert governor.stats()["queue_depth"] == 5
+    await asyncio.gather(*tasks)
+    assert admitted == ["chat 1", "chat 2", "title", "summary", "batch"]
+    assert governor.stats()["queue_depth"] == 0
+
+
+def test_threads_and_coroutines_share_the_queue():
+    """Test that a blocking caller waits behind a more urgent coroutine"""
+    governor = _drained(requests_per_minute=600)  # one every 100 ms
+    admitted = []
+
+    def blocking_batch():
+        governor.acquire(0, BATCH)
+        admitted.append("batch")
+
+    worker = threading.Thread(target=blocking_batch)
+    worker.start()
+    time.sleep(0.02)
+
+    async def chat():
+        await governor.aacquire(0)
+        admitted.append("chat")
+
+    asyncio.run(chat())
+    worker.join()
+    assert admitted == ["chat", "batch"]
+
+
+@pytest.mark.asyncio
+async def test_waiters_time_out_or_give_up():
+    """Test 503 after the queue timeout, and that a cancelled head lets the next call in"""
+    governor = _drained(requests_per_minute=60, queue_timeout=0.2)
+    with pytest.raises(ProviderUnavailableError) as raised:
+        await governor.aacquire(0)
+    assert int(raised.value.headers["Retry-After"]) >= 1
+    assert governor.stats()["priorities"][INTERACTIVE]["timeouts"] == 1
+
+    governor = _drained(requests_per_minute=600, queue_timeout=5.0)
+    head = asyncio.create_task(governor.aacquire(0, INTERACTIVE))
+    await asyncio.sleep(0.01)
+    behind = asyncio.create_task(governor.aacquire(0, BATCH))
+    await asyncio.sleep(0.01)
+    head.cancel()
+    await behind
+    assert head.cancelled()
+    assert governor.stats()["queue_depth"] == 0
+
+    with pytest.raises(ValueError):
+        await governor.aacquire(0, "urgent")
+
+
+@pytest.mark.asyncio
+async def test_service_calls_go_through_the_governor(monkeypatch):
+    """Test that provider calls take the budgets with their priority, and cache hits do not"""
+    from app.services.llm_service import LLMService
+    words = lambda text: len(text.split())
+    for target in ("app.services.llm_service.count_tokens", "app.utils.context_manager.count_tokens"):
+        monkeypatch.setattr(target, words)
+    service = LLMService()
+    service.response_cache = ResponseCache(1024 * 1024)
+    service.pool = ProviderPool([Backend("fake", FakeLLMClient(), AsyncFakeLLMClient())])
+    service.governor = RateGovernor(requests_per_minute=100, tokens_per_minute=100_000)
+
+    messages = [{"role": "user", "content": "how fast can we go"}]
+    _, tokens = await service.agenerate_response(messages)
+    await service.agenerate_response(messages)  # from cache
+    stream = await service.astream_response([{"role": "user", "content": "and streamed"}])
+    _ = [delta async for delta in stream]
+    _, stream_tokens = stream.finish()
+    service.summarize(None, messages, 50)
+
+    stats = service.governor.stats()
+    assert stats["priorities"][INTERACTIVE]["admitted"] == 2
+    assert stats["priorities"][SUMMARY]["admitted"] == 1
+    assert stats["requests_available"] == pytest.approx(97, abs=0.5)
+    assert 100_000 - stats["tokens_available"] >= tokens + stream_tokens
+
+
+@pytest.mark.asyncio
+async def test_budget_is_refunded_when_no_backend_takes_the_call(monkeypatch):
+    """Test that an attempt rejected before it is sent gives its budget back"""
+    from app.services.llm_service import LLMService
+    from app.utils.resilience import CircuitBreaker
+    words = lambda text: len(text.split())
+    for target in ("app.services.llm_service.count_tokens", "app.utils.context_manager.count_tokens"):
+        monkeypatch.setattr(target, words)
+    service = LLMService()
+    service.response_cache = ResponseCache(0)
+    backend = Backend("fake", FakeLLMClient(), AsyncFakeLLMClient(), breaker=CircuitBreaker(cooldown_seconds=60))
+    backend.breaker.trip()
+    service.pool = ProviderPool([backend])
+    service.governor = RateGovernor(requests_per_minute=10, tokens_per_minute=1000)
+
+    messages = [{"role": "user", "content": "nobody is answering"}]
+    with pytest.raises(ProviderUnavailableError):
+        service.generate_response(messages)
+    with pytest.raises(ProviderUnavailableError):
+        await service.agenerate_response(messages)
+    stats = service.governor.stats()
+    assert stats["requests_available"] == pytest.approx(10)
+    assert stats["tokens_available"] == pytest.approx(1000)
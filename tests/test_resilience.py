@@ -0,0 +1,191 @@
+"""
+Test failure handling around the LLM provider
+"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.error_handler import LLMAPIError, ProviderUnavailableError
+from app.utils.resilience import (
+    RATE_LIMITED, REJECTED, UNAVAILABLE, AdaptiveLimiter, CircuitBreaker,
+    backoff_delay, classify_error, retry_after_seconds
+)
+from app.utils.response_cache import ResponseCache
+
+
+class ProviderError(Exception):
+    """An HTTP error shaped like the SDK's"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {"retry-after": retry_after}
+        self.response = SimpleNamespace(headers=headers)
+
+
+class ScriptedClient(FakeLLMClient):
+    """Fake client raising the given errors first, then answering"""
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def create(self, **kwargs):
+        if self.errors:
+            self.calls += 1
+            raise self.errors.pop(0)
+        return super().create(**kwargs)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """An LLM service with its own breaker and limiter and no response cache"""
+    from app.services.llm_service import LLMService
+    words = lambda text: len(text.split())
+    for target in ("app.services.llm_service.count_tokens", "app.utils.context_manager.count_tokens"):
+        monkeypatch.setattr(target, words)
+    llm = LLMService()
+    llm.response_cache = ResponseCache(0)
+    llm.coalesce = False
+    llm.max_retries = 3
+    llm.retry_delay = 0.001
+    llm.max_retry_delay = 1.0
+    llm.pool = ProviderPool([Backend(
+        "fake", FakeLLMClient(), AsyncFakeLLMClient(),
+        breaker=CircuitBreaker(failure_threshold=2, cooldown_seconds=0.2),
+        limiter=AdaptiveLimiter(initial=4, queue_timeout=1.0)
+    )])
+    return llm
+
+
+def backend(service):
+    return service.pool.backends[0]
+
+
+def test_errors_are_classified():
+    """Test status codes, connection errors, Retry-After parsing and jittered backoff"""
+    assert classify_error(ProviderError(429)) == RATE_LIMITED
+    assert classify_error(ProviderError(503)) == UNAVAILABLE
+    assert classify_error(ConnectionError()) == UNAVAILABLE
+    assert classify_error(ProviderError(401)) == REJECTED
+    assert classify_error(ValueError()) == REJECTED
+
+    assert retry_after_seconds(ProviderError(429, "2.5")) == 2.5
+    assert retry_after_seconds(ProviderError(429, "Wed, 21 Oct 2015 07:28:00 GMT")) == 0.0
+    assert retry_after_seconds(ProviderError(429)) is None
+
+    delays = [backoff_delay(3, base=1.0, cap=5.0) for _ in range(200)]
+    assert all(0 <= delay <= 5.0 for delay in delays) and len(set(delays)) > 100
+    assert backoff_delay(0, base=1.0, cap=5.0, retry_after=3.0) == 3.0
+
+
+def test_only_transient_errors_are_retried(service):
+    """Test that 4xx errors fail at once and 429 waits out Retry-After"""
+    backend(service).client = ScriptedClient(ProviderError(401))
+    with pytest.raises(LLMAPIError):
+        service.generate_response([{"role": "user", "content": "hi"}])
+    assert backend(service).client.calls == 1
+
+    backend(service).client = ScriptedClient(ProviderError(429, "0.3"), ProviderError(500))
+    started = time.perf_counter()
+    assert service.generate_response([{"role": "user", "content": "hi"}])[0] == "You said: hi"
+    assert time.perf_counter() - started >= 0.3
+    assert backend(service).client.calls == 3
+
+    backend(service).client = ScriptedClient(ProviderError(429, "60"))
+    with pytest.raises(ProviderUnavailableError) as raised:
+        service.generate_response([{"role": "user", "content": "hi"}])
+    assert raised.value.headers["Retry-After"] == "60"
+
+
+def test_circuit_opens_and_recovers(service):
+    """Test that an open circuit fails fast and a successful probe closes it"""
+    messages = [{"role": "user", "content": "hi"}]
+    service.max_retries = 1
+    backend(service).client = ScriptedClient(*[ProviderError(503)] * 3)
+    for _ in range(2):
+        with pytest.raises(LLMAPIError):
+            service.generate_response(messages)
+    assert backend(service).breaker.state == "open"
+
+    with pytest.raises(ProviderUnavailableError):
+        service.generate_response(messages)
+    assert backend(service).client.calls == 2  # not called while open
+
+    time.sleep(0.25)
+    with pytest.raises(LLMAPIError):
+        service.generate_response(messages)  # the probe fails: open again
+    assert backend(service).breaker.state == "open" and backend(service).breaker.trips == 2
+
+    time.sleep(0.25)
+    assert service.generate_response(messages)[0] == "You said: hi"
+    assert backend(service).breaker.state == "closed"
+
+
+def test_limit_adapts_to_pushback():
+    """Test additive increase on fast calls and multiplicative decrease on 429s and slow calls"""
+    limiter = AdaptiveLimiter(initial=8, max_limit=10, latency_target=1.0)
+    limiter.acquire()
+    limiter.release(latency=0.1)
+    assert limiter.limit == pytest.approx(8.125)
+    limiter.acquire()
+    limiter.release(overloaded=True)
+    assert limiter.limit == pytest.approx(4.0625)
+    limiter.acquire()
+    limiter.release(latency=5.0)
+    assert limiter.limit == pytest.approx(2.03125)
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(overloaded=True)
+    assert limiter.limit == 1
+
+
+def test_limiter_queues_threads_and_coroutines():
+    """Test that waiters of both kinds get freed slots and time out with 503"""
+    limiter = AdaptiveLimiter(initial=1, queue_timeout=0.2)
+    limiter.acquire()
+    with pytest.raises(ProviderUnavailableError):
+        limiter.acquire()
+
+    async def wait_for_slot():
+        await limiter.aacquire()
+        return "granted"
+
+    async def scenario():
+        waiter = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0.05)
+        assert limiter.stats()["waiting"] == 1
+        threading.Timer(0.05, limiter.release).start()  # released from another thread
+        return await waiter
+
+    assert asyncio.run(scenario()) == "granted"
+    assert limiter.in_flight == 1
+    with pytest.raises(ProviderUnavailableError):
+        asyncio.run(wait_for_slot())
+    assert limiter.stats()["queue_timeouts"] == 2 and limiter.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_async_calls_respect_the_limit(service):
+    """Test that concurrent async calls beyond the limit wait for a slot"""
+    backend(service).limiter = AdaptiveLimiter(initial=3, max_limit=3, queue_timeout=5.0)
+    backend(service).async_client = AsyncFakeLLMClient(latency=0.1)
+    results = await asyncio.gather(*(
+        service.agenerate_response([{"role": "user", "content": f"turn {i}"}]) for i in range(12)
+    ))
+    assert len(results) == 12
+    assert backend(service).async_client.peak_in_flight == 3
+    assert backend(service).limiter.in_flight == 0
+
+
+def test_open_until_is_read_atomically():
+    """Test that the reopening time is None once the breaker closes"""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=60)
+    assert breaker.open_until() is None
+    breaker.record_failure(UNAVAILABLE)
+    assert breaker.open_until() == pytest.approx(time.monotonic() + 60, abs=1)
+    breaker.record_success()
+    assert breaker.open_until() is None
@@ -0,0 +1,120 @@
+"""
+Test the LLM response cache
+"""
+import os
+import pytest
+from app.services.conversation_service import ConversationService
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.response_cache import FileResponseStore, ResponseCache, response_cache_key
+
+
+def _request(**changes):
+    request = {
+        "model": "m",
+        "messages": [{"role": "user", "content": "hi"}],
+        "temperature": 0.7,
+        "max_tokens": 100
+    }
+    request.update(changes)
+    return request
+
+
+def _count_words(monkeypatch):
+    words = lambda text: len(text.split())
+    for target in (
+        "app.services.conversation_service.count_tokens",
+        "app.services.llm_service.count_tokens",
+        "app.utils.context_manager.count_tokens"
+    ):
+        monkeypatch.setattr(target, words)
+
+
+def test_key_covers_everything_that_shapes_the_response():
+    """Test that model, context, temperature and max_tokens all change the key"""
+    key = response_cache_key(_request())
+    assert key == response_cache_key(dict(reversed(list(_request().items()))))
+    assert key == response_cache_key(_request(stream=True))  # not part of the response
+    for changes in (
+        {"model": "other"},
+        {"messages": [{"role": "user", "content": "hi!"}]},
+        {"temperature": 0.0},
+        {"max_tokens": 101}
+    ):
+        assert response_cache_key(_request(**changes)) != key
+
+
+def test_persistent_tier_survives_restarts_and_expires(tmp_path, monkeypatch):
+    """Test that a new cache finds stored entries, promotes them and honours the TTL"""
+    entry = {"content": "hello", "seconds": 2.0}
+    ResponseCache(1024, store=FileResponseStore(str(tmp_path))).set("ab12", entry)
+
+    restarted = ResponseCache(1024, store=FileResponseStore(str(tmp_path), ttl_seconds=60))
+    assert restarted.get("ab12") == entry
+    assert restarted.get("ab12") == entry  # now from memory
+    assert restarted.get("cd34") is None
+    stats = restarted.stats()
+    assert (stats["hits"], stats["store_hits"], stats["misses"]) == (2, 1, 1)
+    assert stats["latency_saved_seconds"] == 4.0
+
+    path = tmp_path / "ab" / "ab12.json"
+    os.utime(path, (0, 0))
+    assert ResponseCache(1024, store=FileResponseStore(str(tmp_path), ttl_seconds=60)).get("ab12") is None
+    assert not path.exists()
+    assert not ResponseCache(0).enabled
+
+
+@pytest.mark.asyncio
+async def test_repeated_prompt_is_served_from_cache(monkeypatch):
+    """Test that identical requests reach the provider once, unless the caller opts out"""
+    from app.services.llm_service import LLMService
+    _count_words(monkeypatch)
+    service = LLMService()
+    service.response_cache = ResponseCache(1024 * 1024)
+    client, async_client = FakeLLMClient(), AsyncFakeLLMClient()
+    service.pool = ProviderPool([Backend("fake", client, async_client)])
+    messages = [{"role": "user", "content": "same question"}]
+
+    first = service.generate_response(messages)
+    assert service.generate_response(messages) == (first[0], 0)
+    assert await service.agenerate_response(messages) == (first[0], 0)
+    stream = await service.astream_response(messages)
+    assert [delta async for delta in stream] == [first[0]]
+    assert stream.finish() == (first[0], 0)
+    assert client.calls == 1 and async_client.calls == 0
+
+    service.generate_response(messages, use_cache=False)
+    await service.agenerate_response(messages, max_tokens=50)
+    assert client.calls == 2 and async_client.calls == 1
+    assert service.response_cache.stats()["hits"] == 3
+
+
+def test_cached_reply_is_still_stored(monkeypatch):
+    """Test that a cache hit persists an assistant message and opted-out conversations skip the cache"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.database import Base
+    from app.models import Conversation, Message, User
+    _count_words(monkeypatch)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, username="u", email="u@example.com"))
+    db.add_all([
+        Conversation(id=1, user_id=1, mode="open"),
+        Conversation(id=2, user_id=1, mode="open"),
+        Conversation(id=3, user_id=1, mode="open", cache_responses=False)
+    ])
+    db.commit()
+
+    service = ConversationService()
+    service.llm_service.response_cache = ResponseCache(1024 * 1024)
+    fake = FakeLLMClient()
+    service.llm_service.pool = ProviderPool([Backend("fake", fake, None)])
+    replies = [service.add_message(db, i, "what is a cache?")[1] for i in (1, 2, 3)]
+
+    assert [reply.content for reply in replies] == ["You said: what is a cache?"] * 3
+    assert [reply.tokens_used > 0 for reply in replies] == [True, False, True]
+    assert fake.calls == 2
+    assert db.query(Message).filter(Message.role == "assistant").count() == 3
@@ -0,0 +1,125 @@
+"""
+Test coalescing of identical concurrent LLM requests
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.services.fake_llm import AsyncFakeLLMClient, FakeLLMClient
+from app.services.provider_pool import Backend, ProviderPool
+from app.utils.error_handler import LLMAPIError
+from app.utils.response_cache import ResponseCache
+from app.utils.single_flight import SingleFlight
+
+
+class FailingClient(FakeLLMClient):
+    def create(self, **kwargs):
+        self._enter()
+        try:
+            time.sleep(self.latency)
+            raise RuntimeError("provider down")
+        finally:
+            self._exit()
+
+
+class AsyncFailingClient(AsyncFakeLLMClient):
+    async def create(self, **kwargs):
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency)
+            raise RuntimeError("provider down")
+        finally:
+            self._exit()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """An LLM service with its own coalescer and no response cache"""
+    from app.services.llm_service import LLMService
+    words = lambda text: len(text.split())
+    for target in ("app.services.llm_service.count_tokens", "app.utils.context_manager.count_tokens"):
+        monkeypatch.setattr(target, words)
+    llm = LLMService()
+    llm.response_cache = ResponseCache(0)
+    llm.in_flight = SingleFlight()
+    llm.coalesce = True
+    llm.max_retries = 1
+    llm.pool = ProviderPool([Backend("fake", FakeLLMClient(), AsyncFakeLLMClient())])
+    return llm
+
+
+def backend(service):
+    return service.pool.backends[0]
+
+
+def test_blocking_calls_share_one_upstream_call(service):
+    """Test that threads sending the same request wait for a single provider call"""
+    backend(service).client = FakeLLMClient(latency=0.3)
+    messages = [{"role": "user", "content": "what's new?"}]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: service.generate_response(messages), range(8)))
+        other = pool.submit(service.generate_response, [{"role": "user", "content": "hello"}]).result()
+
+    assert backend(service).client.calls == 2  # one per distinct request
+    assert {content for content, _ in results} == {"You said: what's new?"}
+    assert sorted(tokens > 0 for _, tokens in results) == [False] * 7 + [True]
+    assert other[1] > 0
+    assert service.in_flight.stats()["followers"] == 7
+
+    service.generate_response(messages)  # the finished call is not reused
+    assert backend(service).client.calls == 3
+
+
+def test_blocking_waiters_get_the_error(service):
+    """Test that every thread waiting on a failed call gets its error"""
+    backend(service).client = FailingClient(latency=0.3)
+    messages = [{"role": "user", "content": "hi"}]
+
+    def call(_):
+        try:
+            service.generate_response(messages)
+        except LLMAPIError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        errors = list(pool.map(call, range(5)))
+    assert all(isinstance(error, LLMAPIError) for error in errors)
+    assert backend(service).client.calls == 1
+    assert service.in_flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_async_calls_share_one_upstream_call(service):
+    """Test coalescing on the async path, including errors and opted-out requests"""
+    backend(service).async_client = AsyncFakeLLMClient(latency=0.2)
+    messages = [{"role": "user", "content": "launch day"}]
+    results = await asyncio.gather(*(service.agenerate_response(messages) for _ in range(50)))
+    assert backend(service).async_client.calls == 1
+    assert len({content for content, _ in results}) == 1
+    assert sum(tokens > 0 for _, tokens in results) == 1
+
+    await asyncio.gather(*(service.agenerate_response(messages, use_cache=False) for _ in range(3)))
+    assert backend(service).async_client.calls == 4
+
+    backend(service).async_client = AsyncFailingClient(latency=0.2)
+    results = await asyncio.gather(
+        *(service.agenerate_response(messages) for _ in range(5)), return_exceptions=True
+    )
+    assert all(isinstance(result, LLMAPIError) for result in results)
+    assert backend(service).async_client.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_followers(service):
+    """Test that the shared call survives the caller that started it going away"""
+    backend(service).async_client = AsyncFakeLLMClient(latency=0.2)
+    messages = [{"role": "user", "content": "hi"}]
+    leader = asyncio.create_task(service.agenerate_response(messages))
+    await asyncio.sleep(0.05)
+    follower = asyncio.create_task(service.agenerate_response(messages))
+    await asyncio.sleep(0.05)
+    leader.cancel()
+
+    assert await follower == ("You said: hi", 0)
+    assert leader.cancelled()
+    assert backend(service).async_client.calls == 1
@@ -0,0 +1,90 @@
+"""
+Test the token budget allocator
+"""
+import random
+from types import SimpleNamespace
+import pytest
+from app.utils.error_handler import PromptTooLargeError
+from app.utils.token_budget import COMPONENTS, TokenBudget, budget_stats
+
+
+def test_policies_split_the_window():
+    """Test fixed caps, proportional water-filling and priority order"""
+    demands = {"system": 100, "rag": 3000, "history": 5000, "completion": 1000}
+    
+    fixed = TokenBudget(8192, "fixed", caps={"rag": 1500, "completion": 1000}, max_prompt=4000)
+    assert fixed.allocate(demands) == {"system": 100, "rag": 1500, "history": 2400, "completion": 1000}
+    
+    shares = {"rag": 0.25, "history": 0.5, "completion": 0.25}
+    proportional = TokenBudget(4100, "proportional", shares=shares)
+    # The completion needs less than its share; the rest goes to rag and history
+    assert proportional.allocate(demands) == {"system": 100, "rag": 1000, "history": 2000, "completion": 1000}
+    assert proportional.allocate(dict(demands, rag=10)) == {"system": 100, "rag": 10, "history": 2990, "completion": 1000}
+    
+    priority = TokenBudget(4100, "priority", priority=["completion", "rag", "history"])
+    assert priority.allocate(demands) == {"system": 100, "rag": 3000, "history": 0, "completion": 1000}
+
+
+def test_allocations_never_exceed_the_window():
+    """Test the guarantees under random demands, for every policy"""
+    rng = random.Random(0)
+    for policy in ("fixed", "proportional", "priority"):
+        budget = TokenBudget(
+            8192, policy, reserve=128, min_completion=256, max_prompt=rng.choice([None, 4000]),
+            caps={"rag": 1500, "history": 9000}, shares={"rag": 1, "history": 2, "completion": 1},
+            priority=["history", "completion", "rag"]
+        )
+        for _ in range(500):
+            demands = {
+                "system": rng.randint(0, 3000),
+                "rag": rng.randint(0, 9000),
+                "history": rng.randint(0, 20000),
+                "completion": rng.randint(0, 3000)
+            }
+            allocation = budget.allocate(demands)
+            assert set(allocation) == set(COMPONENTS)
+            assert sum(allocation.values()) <= 8192 - 128
+            assert allocation["system"] == demands["system"]
+            assert all(0 <= allocation[c] <= demands[c] for c in COMPONENTS)
+            assert allocation["completion"] >= min(256, demands["completion"])
+            if budget.max_prompt is not None:
+                assert allocation["system"] + allocation["rag"] + allocation["history"] <= 4000
+
+
+def test_oversized_system_prompt_is_rejected():
+    """Test that a prompt that cannot fit is refused instead of sent"""
+    budget = TokenBudget(1000, "priority", reserve=50, min_completion=200)
+    with pytest.raises(PromptTooLargeError):
+        budget.allocate({"system": 800, "completion": 500})
+    with pytest.raises(ValueError):
+        TokenBudget(1000, "greedy")
+
+
+def test_llm_request_fits_the_window(monkeypatch):
+    """Test that the LLM request plus its completion stays within the window"""
+    from app.services.llm_service import LLMService
+    from app.services.provider_pool import Backend, ProviderPool
+    
+    words = lambda text: len(text.split())
+    monkeypatch.setattr("app.services.llm_service.count_tokens", words)
+    monkeypatch.setattr("app.utils.context_manager.count_tokens", words)
+    service = LLMService()
+    service.budget = TokenBudget(500, "priority", reserve=20, min_completion=50, priority=["completion", "history", "rag"])
+    sent = {}
+    
+    def create(model, messages, max_tokens, temperature):
+        sent.update(messages=messages, max_tokens=max_tokens)
+        usage = SimpleNamespace(total_tokens=0, completion_tokens=max_tokens)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))], usage=usage)
+    
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    service.pool = ProviderPool([Backend("test", client, None)])
+    history = [{"role": "user", "content": "word " * 30} for _ in range(40)]
+    before = dict(budget_stats)
+    service.generate_response(history, "be brief", max_tokens=200)
+    
+    prompt = sum(words(message["content"]) for message in sent["messages"])
+    assert sent["max_tokens"] == 200
+    assert prompt + sent["max_tokens"] <= 500 - 20
+    assert budget_stats["requests"] == before["requests"] + 1
+    assert budget_stats["history"] - before["history"] == prompt - 2
@@ -0,0 +1,46 @@
+"""
+Test the cached, batched token counter
+"""
+import tiktoken
+from app.utils.context_manager import build_context_window
+from app.utils.tokenizer import TokenCounter
+
+
+def byte_encoding() -> tiktoken.Encoding:
+    """Byte-level encoding built locally (the real ones need a download)"""
+    return tiktoken.Encoding(
+        "test_bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={"<|endoftext|>": 256}
+    )
+
+
+def test_counts_are_cached_by_content():
+    """Test that repeated texts hit the cache and special markers count as text"""
+    counter = TokenCounter(byte_encoding(), cache_bytes=1 << 20)
+    assert counter.count("hello") == 5
+    assert counter.count("hello") == 5
+    assert counter.cache.hits == 1
+    assert counter.count("<|endoftext|>") == len("<|endoftext|>")
+
+
+def test_batch_matches_single_counts():
+    """Test that batch counting equals one-by-one counting, duplicates included"""
+    texts = [f"message number {i % 7} " * (i % 5 + 1) for i in range(40)]
+    counter = TokenCounter(byte_encoding(), cache_bytes=1 << 20, num_threads=2)
+    assert counter.count_batch(texts) == [len(text.encode()) for text in texts]
+    assert len(counter.cache) == len(set(texts))
+
+    uncached = TokenCounter(byte_encoding(), cache_bytes=0)
+    assert uncached.count_batch(texts) == counter.count_batch(texts)
+
+
+def test_context_window_keeps_newest_in_order(monkeypatch):
+    """Test that the window keeps the newest messages that fit, oldest first"""
+    monkeypatch.setattr("app.utils.context_manager.count_tokens", lambda text: len(text))
+    messages = [{"role": "user", "content": "x" * 10, "tokens": 10} for _ in range(1000)]
+    messages[-1] = {"role": "user", "content": "last"}
+    context = build_context_window(messages, "sys", max_tokens=50)
+    assert context[0]["role"] == "system"
+    assert [m["content"] for m in context[1:]] == ["x" * 10] * 4 + ["last"]
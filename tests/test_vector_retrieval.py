@@ -0,0 +1,60 @@
+"""
+Test offline embeddings and ANN retrieval
+"""
+import numpy as np
+import pytest
+from app.utils.embeddings import HashingEmbedder, vectors_to_bytes, vectors_from_bytes
+from app.utils.ann_index import IVFIndex
+from app.services.rag_service import RAGService
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    """Test that embeddings are stable, unit length and similarity-aware"""
+    embedder = HashingEmbedder(dim=128)
+    vectors = embedder.embed([
+        "machine learning models",
+        "learning machine models",
+        "tomato gardening tips"
+    ])
+    
+    assert vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.allclose(vectors[0], embedder.embed(["machine learning models"])[0])
+    # Same bag of words -> identical vector; unrelated text -> low similarity
+    assert vectors[0] @ vectors[1] == pytest.approx(1.0)
+    assert vectors[0] @ vectors[2] < 0.5
+    
+    restored = vectors_from_bytes(vectors_to_bytes(vectors), 128)
+    assert np.array_equal(restored, vectors)
+
+
+def test_ivf_index_recall_against_exact_search():
+    """Test that the IVF index finds the exact nearest neighbours on clustered data"""
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(50, 32))
+    vectors = (centers[rng.integers(0, 50, 5000)] + 0.1 * rng.normal(size=(5000, 32))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    
+    index = IVFIndex(vectors, nprobe=8, min_ivf_size=1000)
+    assert index.centroids is not None
+    
+    hits = 0
+    for query in vectors[:50]:
+        rows, _ = index.search(query, 5)
+        exact = np.argsort(-(vectors @ query))[:5]
+        hits += len(set(rows) & set(exact))
+    assert hits / 250 > 0.9
+
+
+def test_vector_backend_retrieval():
+    """Test retrieval through the vector backend"""
+    service = RAGService()
+    service.retrieval_backend = "vector"
+    
+    chunks = [
+        {"index": 0, "text": "Machine learning is a subset of artificial intelligence"},
+        {"index": 1, "text": "Python is a popular programming language"},
+        {"index": 2, "text": "Gardening requires patience and sunlight"}
+    ]
+    relevant_chunks = service.retrieve_relevant_chunks("python programming", chunks)
+    assert relevant_chunks[0] == chunks[1]["text"]